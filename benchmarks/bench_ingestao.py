@@ -0,0 +1,184 @@
+"""
+Benchmark da ingestão completa (CSV -> SQLite)
+Executa o process_all dos processadores legado e otimizado sobre um
+Database.csv sintético, medindo o tempo e a vazão (registros/s) de cada fase e
+o pico de memória (RSS), e grava os resultados em JSON para comparação entre
+versões
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from data_processor import AlmoxarifadoDataProcessor, pa
+from data_processor_optimized import OptimizedAlmoxarifadoProcessor
+from bench_leitura_csv import pico_rss_mb
+from gerar_database_csv import gerar_database_csv
+
+# Configurações medidas: nome -> (processador, opções do construtor)
+CONFIGURACOES = {
+    'legado': (AlmoxarifadoDataProcessor, {}),
+    'otimizado': (OptimizedAlmoxarifadoProcessor, {'batch_size': 100000}),
+    'otimizado_pyarrow': (OptimizedAlmoxarifadoProcessor, {'batch_size': 100000, 'engine': 'pyarrow'}),
+    'otimizado_paralelo': (OptimizedAlmoxarifadoProcessor, {'batch_size': 100000, 'workers': 2}),
+    'otimizado_mmap': (OptimizedAlmoxarifadoProcessor, {'batch_size': 100000, 'memory_map': True}),
+}
+
+# Ordem das fases no relatório; no otimizado, leitura e limpeza são sub-fases de lookups/estoque
+FASES = ['leitura', 'limpeza', 'staging', 'lookups', 'estoque', 'estoque_flat', 'resumos', 'indices']
+
+def medir(configuracao, arquivo, perfil_carga):
+    """Executa uma configuração no processo atual, em um banco temporário, e retorna as métricas
+    
+    A carga é uma recarga completa, para que a fase de índices também seja
+    medida.
+    """
+    processador, opcoes = CONFIGURACOES[configuracao]
+    with tempfile.TemporaryDirectory() as diretorio:
+        processor = processador(arquivo, db_path=os.path.join(diretorio, 'bench.db'), perfil_carga=perfil_carga,
+                                recarga_completa=True, **opcoes)
+        inicio = time.perf_counter()
+        try:
+            sucesso = processor.process_all()
+            segundos = time.perf_counter() - inicio
+            registros = processor.conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0] if sucesso else 0
+        finally:
+            processor.close_connection()
+    
+    return {
+        'configuracao': configuracao,
+        'opcoes': opcoes,
+        'sucesso': sucesso,
+        'registros': registros,
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(registros / segundos, 1) if segundos else 0.0,
+        'pico_rss_mb': pico_rss_mb(),
+        'fases': {nome: {'linhas': fase['linhas'], 'segundos': round(fase['segundos'], 3),
+                         'linhas_por_segundo': round(fase['linhas_por_segundo'], 1)}
+                  for nome, fase in processor.metricas.resultados.items()},
+    }
+
+def versao_codigo():
+    """Commit atual do repositório (None fora de um checkout git)"""
+    try:
+        saida = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=RAIZ,
+                               capture_output=True, text=True, check=True)
+        return saida.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def ambiente():
+    """Versões e máquina em que o benchmark rodou"""
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pa.__version__ if pa is not None else None,
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def tabela(resultados):
+    """DataFrame com uma linha por configuração e o tempo de cada fase"""
+    linhas = []
+    for resultado in resultados:
+        linha = {'configuracao': resultado['configuracao'], 'registros': resultado['registros'],
+                 'segundos': resultado['segundos'], 'linhas_por_segundo': resultado['linhas_por_segundo'],
+                 'pico_rss_mb': resultado['pico_rss_mb']}
+        for nome in FASES:
+            if nome in resultado['fases']:
+                linha[f's_{nome}'] = resultado['fases'][nome]['segundos']
+        linhas.append(linha)
+    return pd.DataFrame(linhas)
+
+def comparar(atual, anterior):
+    """Compara a vazão e o pico de memória de cada configuração com um resultado anterior"""
+    antes = {resultado['configuracao']: resultado for resultado in anterior['resultados']}
+    linhas = []
+    for resultado in atual['resultados']:
+        base = antes.get(resultado['configuracao'])
+        if base is None:
+            continue
+        linhas.append({
+            'configuracao': resultado['configuracao'],
+            'linhas_por_segundo': resultado['linhas_por_segundo'],
+            'anterior': base['linhas_por_segundo'],
+            'variacao_vazao': f"{resultado['linhas_por_segundo'] / base['linhas_por_segundo'] - 1:+.1%}"
+                              if base['linhas_por_segundo'] else None,
+            'pico_rss_mb': resultado['pico_rss_mb'],
+            'pico_rss_anterior': base['pico_rss_mb'],
+        })
+    return pd.DataFrame(linhas)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da ingestão do Database.csv nos dois processadores")
+    parser.add_argument("--arquivo", default="bench_database.csv",
+                        help="Database.csv de entrada (gerado se não existir)")
+    parser.add_argument("--linhas", type=int, default=1000000)
+    parser.add_argument("--materiais", type=int, default=5000)
+    parser.add_argument("--periodos", type=int, default=12)
+    parser.add_argument("--almoxarifados", type=int, default=5)
+    parser.add_argument("--configuracoes", nargs='+', choices=sorted(CONFIGURACOES),
+                        default=['legado', 'otimizado'], help="Configurações a medir")
+    parser.add_argument("--repeticoes", type=int, default=1,
+                        help="Execuções por configuração; vale a mais rápida")
+    parser.add_argument("--perfil-carga", choices=["seguro", "rapido", "maximo"], default="rapido")
+    parser.add_argument("--saida", default="resultados_ingestao.json", help="Arquivo JSON com os resultados")
+    parser.add_argument("--comparar", metavar="JSON", help="Resultados anteriores para comparar")
+    parser.add_argument("--configuracao", choices=sorted(CONFIGURACOES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.configuracao:
+        # Execução filha: um processo limpo por configuração para o pico de RSS não se misturar
+        print(json.dumps(medir(args.configuracao, args.arquivo, args.perfil_carga)))
+        sys.exit(0)
+    
+    arquivo = os.path.abspath(args.arquivo)
+    if not os.path.exists(arquivo):
+        print(f"Gerando {arquivo} com {args.linhas} linhas...")
+        gerar_database_csv(arquivo, args.linhas, args.materiais, args.periodos, args.almoxarifados)
+    
+    resultados = []
+    for configuracao in args.configuracoes:
+        print(f"Medindo {configuracao}...")
+        execucoes = []
+        for _ in range(args.repeticoes):
+            saida = subprocess.run([sys.executable, os.path.abspath(__file__), "--arquivo", arquivo,
+                                    "--configuracao", configuracao, "--perfil-carga", args.perfil_carga],
+                                   capture_output=True, text=True, check=True)
+            execucoes.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+        resultados.append(min(execucoes, key=lambda resultado: resultado['segundos']))
+    
+    relatorio = {
+        'versao': versao_codigo(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': ambiente(),
+        'parametros': {'arquivo': os.path.basename(arquivo), 'tamanho_bytes': os.path.getsize(arquivo),
+                       'linhas': args.linhas, 'materiais': args.materiais, 'periodos': args.periodos,
+                       'almoxarifados': args.almoxarifados, 'perfil_carga': args.perfil_carga,
+                       'repeticoes': args.repeticoes},
+        'resultados': resultados,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    
+    print(tabela(resultados).to_string(index=False))
+    print(f"✅ Resultados gravados em {args.saida}")
+    
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            print(comparar(relatorio, json.load(f)).to_string(index=False))
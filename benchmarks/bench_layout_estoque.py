@@ -0,0 +1,209 @@
+"""
+Benchmark do layout de armazenamento do estoque
+Compara o layout antigo (id AUTOINCREMENT e created_at por registro) com o
+compacto (WITHOUT ROWID agrupado por período) sobre os mesmos registros:
+tamanho do arquivo, tempo da varredura completa e da leitura de um período,
+além do tempo da migração de um banco antigo, e grava os resultados em JSON
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from data_processor import apply_schema
+from data_processor_optimized import OptimizedAlmoxarifadoProcessor
+from bench_ingestao import ambiente, versao_codigo
+from gerar_database_csv import gerar_database_csv
+
+# Estoque no layout anterior ao compacto
+SQL_ESTOQUE_ANTIGO = """
+    CREATE TABLE estoque (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        periodo_id INTEGER,
+        material_id INTEGER,
+        localizacao_id INTEGER,
+        almoxarifado_id INTEGER,
+        classificacao_sped_id INTEGER,
+        conta_contabil_id INTEGER,
+        classificacao_fiscal_id INTEGER,
+        identificacao_id INTEGER,
+        quantidade REAL,
+        custo_medio REAL,
+        valor_total REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+COLUNAS_ESTOQUE = ('material_id, localizacao_id, almoxarifado_id, classificacao_sped_id, conta_contabil_id, '
+                   'classificacao_fiscal_id, identificacao_id, quantidade, custo_medio, valor_total')
+
+# Layouts medidos: nome -> índices do estoque (None: o layout compacto carregado pelo processador)
+LAYOUTS = {
+    'antigo': [
+        "CREATE INDEX idx_estoque_periodo ON estoque(periodo_id)",
+        "CREATE INDEX idx_estoque_material ON estoque(material_id)",
+        "CREATE INDEX idx_estoque_almoxarifado ON estoque(almoxarifado_id)",
+        "CREATE INDEX idx_estoque_localizacao ON estoque(localizacao_id)",
+    ],
+    'antigo_cobertura': [
+        "CREATE INDEX idx_estoque_periodo_almoxarifado "
+        "ON estoque(periodo_id, almoxarifado_id, material_id, quantidade, valor_total, custo_medio)",
+    ],
+    'compacto': None,
+}
+
+# Leitura de um período como a atualização dos resumos faz
+SQL_PERIODO = """
+    SELECT material_id, almoxarifado_id, SUM(quantidade), SUM(valor_total), SUM(custo_medio), COUNT(*)
+    FROM estoque
+    WHERE periodo_id = ?
+    GROUP BY material_id, almoxarifado_id
+"""
+
+def carregar_compacto(arquivo, db_path):
+    """Carrega o Database.csv em um banco novo, já no layout compacto"""
+    processor = OptimizedAlmoxarifadoProcessor(arquivo, db_path=db_path, batch_size=100000, recarga_completa=True)
+    try:
+        if not processor.process_all():
+            raise RuntimeError("Falha ao carregar o banco do benchmark")
+    finally:
+        processor.close_connection()
+
+def montar_layout_antigo(origem, db_path, indices):
+    """Copia o banco compacto e reescreve o estoque no layout antigo, com ``indices``
+    
+    Os registros entram intercalados entre os períodos (ordem de linha), como
+    chegam do Database.csv, e não agrupados por período.
+    """
+    shutil.copyfile(origem, db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ALTER TABLE estoque RENAME TO estoque_compacto")
+    conn.execute(SQL_ESTOQUE_ANTIGO)
+    conn.execute(f"""
+        INSERT INTO estoque (periodo_id, {COLUNAS_ESTOQUE})
+        SELECT NULLIF(periodo_id, 0), {COLUNAS_ESTOQUE} FROM estoque_compacto ORDER BY linha, periodo_id
+    """)
+    conn.execute("DROP TABLE estoque_compacto")
+    for sql in indices:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+def cronometrar(db_path, sql, params=(), repeticoes=3):
+    """Menor tempo de ``repeticoes`` execuções de ``sql``, cada uma em uma conexão nova"""
+    tempos = []
+    for _ in range(repeticoes):
+        conn = sqlite3.connect(db_path)
+        inicio = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        tempos.append(time.perf_counter() - inicio)
+        conn.close()
+    return min(tempos)
+
+def medir(nome, db_path, repeticoes):
+    """Tamanho do arquivo e tempos de leitura do estoque em um layout"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("VACUUM")
+    registros = conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]
+    periodos = [linha[0] for linha in conn.execute("SELECT id FROM periodos ORDER BY ano, mes")]
+    periodo = periodos[len(periodos) // 2]
+    paginas = dict(conn.execute("""
+        SELECT CASE WHEN d.name = 'estoque' THEN 'tabela' ELSE 'indices' END, SUM(d.pgsize)
+        FROM dbstat d
+        JOIN sqlite_master m ON m.name = d.name
+        WHERE m.tbl_name = 'estoque'
+        GROUP BY 1
+    """).fetchall()) if tem_dbstat(conn) else {}
+    conn.close()
+    
+    tamanho = os.path.getsize(db_path)
+    return {
+        'layout': nome,
+        'registros': registros,
+        'tamanho_mb': round(tamanho / 1e6, 2),
+        'estoque_tabela_mb': round(paginas.get('tabela', 0) / 1e6, 2) if paginas else None,
+        'estoque_indices_mb': round(paginas.get('indices', 0) / 1e6, 2) if paginas else None,
+        # Varredura completa da tabela (NOT INDEXED: sem trocar a tabela por um índice menor)
+        's_varredura': round(cronometrar(db_path, "SELECT COUNT(*), SUM(quantidade), SUM(valor_total) "
+                                                  "FROM estoque NOT INDEXED", repeticoes=repeticoes), 3),
+        's_periodo': round(cronometrar(db_path, SQL_PERIODO, (periodo,), repeticoes), 3),
+    }
+
+def tem_dbstat(conn):
+    """Indica se o SQLite foi compilado com a tabela virtual dbstat"""
+    try:
+        conn.execute("SELECT 1 FROM dbstat LIMIT 1")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def medir_migracao(origem, db_path):
+    """Tempo de apply_schema migrando uma cópia de um banco no layout antigo"""
+    shutil.copyfile(origem, db_path)
+    conn = sqlite3.connect(db_path)
+    inicio = time.perf_counter()
+    apply_schema(conn)
+    segundos = time.perf_counter() - inicio
+    registros = conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]
+    conn.close()
+    return {'registros': registros, 'segundos': round(segundos, 3),
+            'linhas_por_segundo': round(registros / segundos, 1) if segundos else 0.0}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do layout de armazenamento do estoque")
+    parser.add_argument("--arquivo", default="bench_database.csv",
+                        help="Database.csv de entrada (gerado se não existir)")
+    parser.add_argument("--linhas", type=int, default=1000000)
+    parser.add_argument("--repeticoes", type=int, default=3, help="Execuções de cada leitura; vale a mais rápida")
+    parser.add_argument("--saida", default="resultados_layout_estoque.json", help="Arquivo JSON com os resultados")
+    args = parser.parse_args()
+    
+    arquivo = os.path.abspath(args.arquivo)
+    saida = os.path.abspath(args.saida)
+    if not os.path.exists(arquivo):
+        print(f"Gerando {arquivo} com {args.linhas} linhas...")
+        gerar_database_csv(arquivo, args.linhas)
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        compacto = os.path.join(diretorio, 'compacto.db')
+        print("Carregando o layout compacto...")
+        carregar_compacto(arquivo, compacto)
+        
+        resultados = []
+        for nome, indices in LAYOUTS.items():
+            db_path = compacto
+            if indices is not None:
+                print(f"Montando o layout {nome}...")
+                db_path = os.path.join(diretorio, f'{nome}.db')
+                montar_layout_antigo(compacto, db_path, indices)
+            print(f"Medindo {nome}...")
+            resultados.append(medir(nome, db_path, args.repeticoes))
+        
+        print("Medindo a migração do layout antigo...")
+        migracao = medir_migracao(os.path.join(diretorio, 'antigo.db'), os.path.join(diretorio, 'migrado.db'))
+    
+    relatorio = {
+        'versao': versao_codigo(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': ambiente(),
+        'parametros': {'arquivo': os.path.basename(arquivo), 'repeticoes': args.repeticoes},
+        'resultados': resultados,
+        'migracao': migracao,
+    }
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    
+    print(pd.DataFrame(resultados).to_string(index=False))
+    print(f"Migração: {migracao['registros']} registros em {migracao['segundos']}s")
+    print(f"✅ Resultados gravados em {saida}")
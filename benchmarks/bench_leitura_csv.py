@@ -0,0 +1,100 @@
+"""
+Benchmark da leitura/limpeza do Database.csv
+Compara a leitura sem tipos + astype(str).str.replace (caminho anterior) com a
+leitura tipada de read_database_csv, medindo tempo e pico de memória (RSS)
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from data_processor import COLUNAS, COLUNAS_NUMERICAS, clean_text, convert_numeric, read_database_csv
+from gerar_database_csv import gerar_database_csv
+
+COLUNAS_TEXTO = ['desc_familia', 'desc_grupo_material', 'desc_material', 'desc_tipo_material',
+                 'desc_localizacao', 'desc_almoxarifado', 'desc_classificacao_sped',
+                 'desc_conta_contabil', 'desc_classificacao_fiscal', 'desc_identificacao']
+
+def ler_sem_tipos(caminho):
+    """Caminho anterior: leitura sem tipos e conversão via string"""
+    df = pd.read_csv(caminho, sep=';', encoding='latin-1', low_memory=False)
+    df.columns = COLUNAS
+    df['periodo'] = df['periodo'].astype(str)
+    for col in COLUNAS_NUMERICAS:
+        df[col] = df[col].astype(str).str.replace(',', '.')
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in COLUNAS_TEXTO:
+        df[col] = df[col].astype(str).str.strip().str.upper()
+        df[col] = df[col].replace('NAN', '')
+    return df
+
+def ler_tipado(caminho):
+    """Leitura com schema declarado (decimal=',' e category)"""
+    df = read_database_csv(caminho, low_memory=False)
+    convert_numeric(df)
+    for col in COLUNAS_TEXTO:
+        df[col] = clean_text(df[col])
+    return df
+
+VARIANTES = {'sem_tipos': ler_sem_tipos, 'tipado': ler_tipado}
+
+def pico_rss_mb():
+    """Pico de memória residente do processo atual, em MB
+    
+    No Linux usa VmHWM, que é zerado no exec; ru_maxrss herda o pico do
+    processo pai e inflaria a medição.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def medir(variante, caminho):
+    """Executa uma variante no processo atual e retorna as métricas"""
+    inicio = time.perf_counter()
+    df = VARIANTES[variante](caminho)
+    segundos = time.perf_counter() - inicio
+    
+    return {
+        'variante': variante,
+        'linhas': len(df),
+        'segundos': round(segundos, 3),
+        'pico_rss_mb': pico_rss_mb(),
+        'memoria_df_mb': round(df.memory_usage(deep=True).sum() / 1024 ** 2, 1),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da leitura tipada do Database.csv")
+    parser.add_argument("--arquivo", default="bench_database.csv")
+    parser.add_argument("--linhas", type=int, default=1000000)
+    parser.add_argument("--variante", choices=sorted(VARIANTES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.variante:
+        # Execução filha: um processo limpo por variante para o pico de RSS não se misturar
+        print(json.dumps(medir(args.variante, args.arquivo)))
+        sys.exit(0)
+    
+    if not os.path.exists(args.arquivo):
+        print(f"Gerando {args.arquivo} com {args.linhas} linhas...")
+        gerar_database_csv(args.arquivo, args.linhas)
+    
+    resultados = []
+    for variante in VARIANTES:
+        saida = subprocess.run([sys.executable, __file__, "--arquivo", args.arquivo, "--variante", variante],
+                               capture_output=True, text=True, check=True)
+        resultados.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+    
+    print(pd.DataFrame(resultados).to_string(index=False))
@@ -0,0 +1,105 @@
+"""
+Gerador de Database.csv sintético
+Cria arquivos no mesmo formato da exportação do ERP (32 colunas, ';', latin-1,
+decimal com vírgula) para testes de desempenho da ingestão
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+# Cabeçalho original do Database.csv
+CABECALHO = [
+    'Período', 'Cód. Família', 'Desc. Família', 'Cód. Grupo Material', 'Desc. Grupo Material',
+    'Cód. Material', 'Desc. Material', 'Cód. Tipo Material', 'Desc. Tipo Material', 'Situação',
+    'Localização', 'Desc. Localização', 'Cód. Localização', 'Cód. Almoxarifado', 'Desc. Almoxarifado',
+    'Unidade', 'Quantidade', 'Custo Médio', 'Vlr. Total', 'Cód. Classificação SPED',
+    'Desc. Classificação SPED', 'Controla Est. Mín.', 'Estoque Mínimo', 'Controla Est. Máx.',
+    'Estoque Máximo', 'Conta Contábil', 'Desc. Conta Contábil', 'NCM', 'Desc. Classificação Fiscal',
+    'Cód. Identificação', 'Descrição Identificação', 'Curva X-Y-Z'
+]
+
+MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
+
+def gerar_frame(linhas, materiais=5000, periodos=12, almoxarifados=5, inicio=0, total=None, seed=0):
+    """Gera ``linhas`` registros sintéticos a partir da linha ``inicio`` de um arquivo de ``total`` linhas
+    
+    Os registros são ordenados por período, como na exportação do ERP; cada
+    material tem família, grupo, localização e almoxarifado fixos.
+    """
+    rng = np.random.default_rng(seed + inicio)
+    idx = np.arange(inicio, inicio + linhas)
+    
+    periodo_idx = idx * periodos // (total or linhas)
+    material = rng.integers(1, materiais + 1, size=linhas)
+    familia = material % 60 + 1
+    grupo = material % 400 + 1
+    localizacao = material % 3000 + 1000
+    almoxarifado = material % almoxarifados + 1
+    tipo = material % 3 + 1
+    ncm = 73201000 + material % 900
+    
+    quantidade = rng.integers(0, 500, size=linhas).astype(float)
+    custo = np.round(rng.gamma(2.0, 80.0, size=linhas), 4)
+    controla_min = np.where(material % 2 == 0, 'Sim', 'Não')
+    
+    ano = 23 + periodo_idx // 12
+    periodo = np.char.add(np.char.add(np.array(MESES)[periodo_idx % 12], '/'), ano.astype(str))
+    
+    return pd.DataFrame({
+        'Período': periodo,
+        'Cód. Família': familia,
+        'Desc. Família': np.char.add('FAMÍLIA ', familia.astype(str)),
+        'Cód. Grupo Material': grupo,
+        'Desc. Grupo Material': np.char.add('GRUPO DE MATERIAIS ', grupo.astype(str)),
+        'Cód. Material': material,
+        'Desc. Material': np.char.add('MATERIAL Nº ', material.astype(str)),
+        'Cód. Tipo Material': tipo,
+        'Desc. Tipo Material': np.where(tipo == 1, 'Estoque', 'Consumo'),
+        'Situação': 'Ativo',
+        'Localização': np.char.add(localizacao.astype(str), '.01'),
+        'Desc. Localização': np.char.add('PRATELEIRA ', localizacao.astype(str)),
+        'Cód. Localização': localizacao,
+        'Cód. Almoxarifado': almoxarifado,
+        'Desc. Almoxarifado': np.char.add('ALMOXARIFADO ', almoxarifado.astype(str)),
+        'Unidade': np.where(material % 4 == 0, 'PC', 'UN'),
+        'Quantidade': quantidade,
+        'Custo Médio': custo,
+        'Vlr. Total': np.round(quantidade * custo, 4),
+        'Cód. Classificação SPED': 7,
+        'Desc. Classificação SPED': 'Material de Uso e Consumo',
+        'Controla Est. Mín.': controla_min,
+        'Estoque Mínimo': (material % 20).astype(float),
+        'Controla Est. Máx.': 'Não',
+        'Estoque Máximo': np.nan,
+        'Conta Contábil': 11607001 + material % 4,
+        'Desc. Conta Contábil': 'INSUMOS E MATERIAIS',
+        'NCM': ncm,
+        'Desc. Classificação Fiscal': np.char.add('CLASSIFICAÇÃO ', (ncm % 1000).astype(str)),
+        'Cód. Identificação': 1,
+        'Descrição Identificação': 'NORMAL',
+        'Curva X-Y-Z': np.array(['X', 'Y', 'Z'])[material % 3],
+    }, columns=CABECALHO)
+
+def gerar_database_csv(caminho, linhas, materiais=5000, periodos=12, almoxarifados=5, seed=0,
+                       linhas_por_bloco=500000):
+    """Grava um Database.csv sintético em blocos (memória limitada mesmo para 10M linhas)"""
+    with open(caminho, 'w', encoding='latin-1', newline='') as f:
+        for inicio in range(0, linhas, linhas_por_bloco):
+            frame = gerar_frame(min(linhas_por_bloco, linhas - inicio), materiais, periodos,
+                                almoxarifados, inicio=inicio, total=linhas, seed=seed)
+            frame.to_csv(f, sep=';', decimal=',', index=False, header=(inicio == 0), lineterminator='\r\n')
+    return caminho
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera um Database.csv sintético")
+    parser.add_argument("caminho", help="Arquivo de saída")
+    parser.add_argument("--linhas", type=int, default=1000000)
+    parser.add_argument("--materiais", type=int, default=5000)
+    parser.add_argument("--periodos", type=int, default=12)
+    parser.add_argument("--almoxarifados", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    gerar_database_csv(args.caminho, args.linhas, args.materiais, args.periodos, args.almoxarifados, args.seed)
+    print(f"✅ Arquivo gerado: {args.caminho} ({args.linhas} linhas)")
@@ -0,0 +1,165 @@
+"""
+Verificação dos planos de consulta (EXPLAIN QUERY PLAN)
+Confere que as consultas do load_data do dashboard, de todos os métodos do
+DatabaseUtils e da atualização das tabelas derivadas leem o estoque e os
+resumos só por índices de cobertura (ou por busca na própria chave de uma
+tabela WITHOUT ROWID, como o estoque), sem consultar as linhas das tabelas
+nem varrê-las por inteiro. Sai com código 1 se algum plano regredir; o mesmo
+conferido roda nos testes (tests/test_planos.py)
+"""
+
+import argparse
+import inspect
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from data_processor import SQL_ESTOQUE_FLAT, SQL_RESUMOS
+from data_processor_optimized import OptimizedAlmoxarifadoProcessor
+from database_utils import CONSULTAS_DASHBOARD, DatabaseUtils
+from gerar_database_csv import gerar_database_csv
+
+# Tabelas que só podem ser lidas por índices de cobertura (ou pela chave, se WITHOUT ROWID).
+# Ficam de fora estoque_flat, que é a cópia desnormalizada do estoque feita para o load_data
+# lê-la inteira, e materiais e as dimensões, pequenas e lidas pelo rowid nos joins
+TABELAS_COBERTAS = {'estoque', 'resumo_periodo_material', 'resumo_periodo_almoxarifado', 'resumo_periodo_familia'}
+
+# Palavras que podem seguir o nome da tabela no FROM/JOIN sem serem um alias
+PALAVRAS_SQL = {'WHERE', 'GROUP', 'ORDER', 'LEFT', 'INNER', 'JOIN', 'ON', 'LIMIT', 'HAVING', 'USING'}
+
+def tabelas_por_alias(sql):
+    """Mapeia os aliases (e os próprios nomes) das tabelas do FROM/JOIN para as tabelas"""
+    tabelas = {}
+    for tabela, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        tabelas[tabela] = tabela
+        if alias and alias.upper() not in PALAVRAS_SQL:
+            tabelas[alias] = tabela
+    return tabelas
+
+def consultas_database_utils(db_path):
+    """SQL executado por cada método get_* do DatabaseUtils: nome -> lista de comandos"""
+    executadas = []
+    
+    class DatabaseUtilsRastreado(DatabaseUtils):
+        @contextmanager
+        def conexao(self):
+            with super().conexao() as conn:
+                conn.set_trace_callback(executadas.append)
+                try:
+                    yield conn
+                finally:
+                    conn.set_trace_callback(None)
+    
+    utils = DatabaseUtilsRastreado(db_path)
+    consultas = {}
+    for nome, _ in inspect.getmembers(DatabaseUtils, inspect.isfunction):
+        # get_connection só entrega uma conexão ao chamador, sem consulta própria a verificar
+        if not nome.startswith('get_') or nome == 'get_connection':
+            continue
+        del executadas[:]
+        getattr(utils, nome)()
+        consultas[f'DatabaseUtils.{nome}'] = [sql for sql in executadas if sql.lstrip().upper().startswith('SELECT')]
+    utils.pool.fechar()
+    return consultas
+
+def consultas_verificadas(db_path, periodo_id):
+    """Todas as consultas verificadas: nome -> lista de comandos SQL"""
+    consultas = {f'dashboard.{nome}': [sql] for nome, sql in CONSULTAS_DASHBOARD.items()}
+    consultas.update(consultas_database_utils(db_path))
+    
+    # Atualização por período das tabelas derivadas, feita a cada carga
+    filtro = f'WHERE e.periodo_id = {int(periodo_id)}'
+    consultas['carga.estoque_flat'] = [f'{SQL_ESTOQUE_FLAT} {filtro}']
+    for tabela, sql in SQL_RESUMOS.items():
+        consultas[f'carga.{tabela}'] = [sql.format(filtro=filtro)]
+    return consultas
+
+def tabelas_agrupadas(conn):
+    """Tabelas WITHOUT ROWID: os registros ficam na própria B-tree da chave primária"""
+    return {nome for nome, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+            if sql and 'WITHOUT ROWID' in sql.upper()}
+
+def verificar_plano(conn, sql):
+    """Retorna (plano, violações): as linhas do plano e as que leem uma tabela coberta sem índice de cobertura
+    
+    Em uma tabela WITHOUT ROWID a busca pela chave primária já lê o registro
+    (não há acesso extra pelo rowid) e é aceita; a varredura da tabela
+    inteira, não.
+    """
+    tabelas = tabelas_por_alias(sql)
+    agrupadas = tabelas_agrupadas(conn)
+    plano = [linha[3] for linha in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    violacoes = []
+    for detalhe in plano:
+        acesso = re.match(r'(SCAN|SEARCH) (\w+)', detalhe)
+        if not acesso or tabelas.get(acesso.group(2)) not in TABELAS_COBERTAS or 'COVERING INDEX' in detalhe:
+            continue
+        if acesso.group(1) == 'SEARCH' and tabelas.get(acesso.group(2)) in agrupadas and 'PRIMARY KEY' in detalhe:
+            continue
+        violacoes.append(detalhe)
+    return plano, violacoes
+
+def verificar_consultas(db_path):
+    """Planos de todas as consultas no banco ``db_path``: nome -> (planos, violações)
+    
+    A atualização das tabelas derivadas é conferida em um período real (o
+    período 0 só guarda os registros sem período).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        periodo = conn.execute("SELECT MIN(id) FROM periodos WHERE id <> 0").fetchone()[0] or 1
+        resultado = {}
+        for nome, comandos in consultas_verificadas(db_path, periodo).items():
+            planos = [verificar_plano(conn, sql) for sql in comandos]
+            resultado[nome] = ([plano for plano, _ in planos], [detalhe for _, erros in planos for detalhe in erros])
+        return resultado
+    finally:
+        conn.close()
+
+def verificar(db_path, verbose=False):
+    """Verifica os planos de todas as consultas no banco ``db_path``; retorna o número de violações"""
+    total = 0
+    for nome, (planos, violacoes) in verificar_consultas(db_path).items():
+        total += len(violacoes)
+        print(f"{'❌' if violacoes else '✅'} {nome}")
+        for plano in planos if verbose or violacoes else []:
+            for detalhe in plano:
+                print(f"    {'>> ' if detalhe in violacoes else ''}{detalhe}")
+    return total
+
+def banco_de_teste(diretorio, linhas):
+    """Carrega um Database.csv sintético em um banco novo e retorna o caminho do banco"""
+    arquivo = os.path.join(diretorio, 'planos.csv')
+    db_path = os.path.join(diretorio, 'planos.db')
+    gerar_database_csv(arquivo, linhas)
+    processor = OptimizedAlmoxarifadoProcessor(arquivo, db_path=db_path, recarga_completa=True)
+    try:
+        if not processor.process_all():
+            raise RuntimeError("Falha ao carregar o banco de teste")
+    finally:
+        processor.close_connection()
+    return db_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confere os planos das consultas do dashboard e do DatabaseUtils")
+    parser.add_argument("--db", help="Banco a verificar (sem ele, um banco sintético é carregado)")
+    parser.add_argument("--linhas", type=int, default=50000, help="Linhas do Database.csv sintético")
+    parser.add_argument("--verbose", action="store_true", help="Mostra o plano de todas as consultas")
+    args = parser.parse_args()
+    
+    db_path = os.path.abspath(args.db) if args.db else None
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        db_path = db_path or banco_de_teste(diretorio, args.linhas)
+        violacoes = verificar(db_path, args.verbose)
+    
+    if violacoes:
+        print(f"❌ {violacoes} acessos ao estoque e aos resumos sem índice de cobertura")
+        sys.exit(1)
+    print("✅ Todas as consultas leem o estoque e os resumos sem acessar as linhas por rowid nem varrer o estoque")
@@ -10,26 +10,33 @@ import plotly.graph_objects as go
 import sqlite3
 from datetime import datetime, timedelta
 import numpy as np
-import re
 import os
+import threading
 from scipy import stats
 
+from data_processor import (SCHEMA_PATH, apply_schema, bootstrap_database, ensure_derived_tables, period_dates,
+                            validate_file)
+from data_processor_optimized import ingest
+from database_utils import CONSULTAS_DASHBOARD, PoolConexoes
+
+# Staging em Parquet da carga inicial, ao lado do app (e não no diretório em que ele foi iniciado)
+STAGING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'staging')
+
+# Arquivo de exemplo no layout do Database.csv, oferecido como modelo na aba de integração
+EXEMPLO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exemplo_almoxarifado.csv')
+
 def init_database():
-    """Inicializa o banco de dados se não existir"""
+    """Inicializa o banco de dados se não existir
+    
+    Na primeira execução o banco é montado pelo mesmo carregador em lote dos
+    processadores, a partir do Database.csv ou, na falta dele, do
+    sample_data.csv. Os dados limpos ficam no staging em Parquet, então
+    recriar o banco depois não repete o parsing nem a limpeza. Um banco já
+    existente, carregado antes de estoque_flat e dos resumos, é migrado e tem
+    essas tabelas montadas uma vez.
+    """
     if not os.path.exists('almoxarifado.db'):
         try:
-            # Ler o schema
-            with open('database_schema.sql', 'r', encoding='utf-8') as f:
-                schema = f.read()
-            
-            # Conectar e criar tabelas
-            conn = sqlite3.connect('almoxarifado.db')
-            cursor = conn.cursor()
-            
-            # Executar schema
-            cursor.executescript(schema)
-            conn.commit()
-            
             # Tentar carregar dados se disponível
             data_file = None
             if os.path.exists('Database.csv'):
@@ -39,120 +46,36 @@ def init_database():
             
             if data_file:
                 try:
-                    # Carregar dados de exemplo
-                    df = pd.read_csv(data_file, encoding='utf-8', sep=',')
-                    
-                    # Inserir dados básicos (simplificado para demo)
-                    if len(df) > 0:
-                        # Inserir dados nas tabelas relacionadas primeiro
-                        
-                        # Inserir períodos
-                        periodos_unicos = df['Período'].unique() if 'Período' in df.columns else ['jan/23']
-                        for periodo in periodos_unicos:
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO periodos (periodo, ano, mes) 
-                                VALUES (?, ?, ?)
-                            """, (periodo, 2023, 1))
-                        
-                        # Inserir famílias
-                        familias_unicas = df['Desc. Família'].unique() if 'Desc. Família' in df.columns else ['Família de Exemplo']
-                        for familia in familias_unicas:
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO familias (descricao) 
-                                VALUES (?)
-                            """, (familia,))
-                        
-                        # Inserir almoxarifados
-                        almoxarifados_unicos = df['Desc. Almoxarifado'].unique() if 'Desc. Almoxarifado' in df.columns else ['Almoxarifado de Exemplo']
-                        for almoxarifado in almoxarifados_unicos:
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO almoxarifados (descricao) 
-                                VALUES (?)
-                            """, (almoxarifado,))
-                        
-                        # Inserir materiais
-                        materiais_unicos = df[['Cód. Material', 'Desc. Material', 'Unidade']].drop_duplicates() if all(col in df.columns for col in ['Cód. Material', 'Desc. Material', 'Unidade']) else pd.DataFrame({'Cód. Material': ['1'], 'Desc. Material': ['Material de Exemplo'], 'Unidade': ['UN']})
-                        
-                        for _, material in materiais_unicos.iterrows():
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO materiais (codigo, descricao, unidade) 
-                                VALUES (?, ?, ?)
-                            """, (
-                                str(material.get('Cód. Material', '1')),
-                                material.get('Desc. Material', 'Material de Exemplo'),
-                                material.get('Unidade', 'UN')
-                            ))
-                        
-                        conn.commit()
-                        
-                        # Agora inserir dados de estoque
-                        for _, row in df.head(50).iterrows():  # Limitar a 50 registros para demo
-                            # Obter IDs das tabelas relacionadas
-                            cursor.execute("SELECT id FROM periodos WHERE periodo = ?", (row.get('Período', 'jan/23'),))
-                            periodo_id = cursor.fetchone()
-                            periodo_id = periodo_id[0] if periodo_id else 1
-                            
-                            cursor.execute("SELECT id FROM materiais WHERE codigo = ?", (str(row.get('Cód. Material', '1')),))
-                            material_id = cursor.fetchone()
-                            material_id = material_id[0] if material_id else 1
-                            
-                            cursor.execute("SELECT id FROM almoxarifados WHERE descricao = ?", (row.get('Desc. Almoxarifado', 'Almoxarifado de Exemplo'),))
-                            almoxarifado_id = cursor.fetchone()
-                            almoxarifado_id = almoxarifado_id[0] if almoxarifado_id else 1
-                            
-                            # Inserir dados de estoque
-                            cursor.execute("""
-                                INSERT OR IGNORE INTO estoque 
-                                (periodo_id, material_id, almoxarifado_id, quantidade, custo_medio, valor_total)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, (
-                                periodo_id,
-                                material_id,
-                                almoxarifado_id,
-                                float(row.get('Quantidade', 1)),
-                                float(row.get('Custo Médio', 100.0)),
-                                float(row.get('Vlr. Total', 100.0))
-                            ))
-                    
-                    conn.commit()
-                    st.info(f"📊 Dados de exemplo carregados: {len(df)} registros")
+                    with st.spinner(f"Carregando dados iniciais de {data_file}..."):
+                        registros = bootstrap_database(data_file, 'almoxarifado.db', staging=STAGING_DIR)
+                    st.info(f"📊 Dados de exemplo carregados: {registros} registros")
                     
                 except Exception as e:
                     st.warning(f"Aviso: Não foi possível carregar dados: {e}")
             
-            conn.close()
+            if not os.path.exists('almoxarifado.db'):
+                # Sem dados: apenas criar as tabelas
+                conn = sqlite3.connect('almoxarifado.db')
+                apply_schema(conn)
+                conn.close()
+            
             return True
             
         except Exception as e:
             st.error(f"Erro ao inicializar banco de dados: {e}")
             return False
-    return True
-
-def create_date_from_period(periodo):
-    """
-    Converte string de período (ex: 'jan/23') para objeto datetime
-    """
-    # Mapeamento de meses em português para números
-    meses_map = {
-        'jan': 1, 'fev': 2, 'mar': 3, 'abr': 4, 'mai': 5, 'jun': 6,
-        'jul': 7, 'ago': 8, 'set': 9, 'out': 10, 'nov': 11, 'dez': 12
-    }
     
     try:
-        # Extrair mês e ano usando regex
-        match = re.match(r'([a-z]{3})/(\d{2})', periodo.lower())
-        if match:
-            mes_str, ano_str = match.groups()
-            mes = meses_map.get(mes_str)
-            ano = 2000 + int(ano_str)  # Assumindo anos 2000+
-            
-            if mes:
-                return datetime(ano, mes, 1)  # Primeiro dia do mês
-    except:
-        pass
-    
-    # Se não conseguir converter, retorna data muito antiga
-    return datetime(1900, 1, 1)
+        conn = sqlite3.connect('almoxarifado.db')
+        try:
+            ensure_derived_tables(conn)
+        finally:
+            conn.close()
+        return True
+        
+    except Exception as e:
+        st.error(f"Erro ao atualizar banco de dados: {e}")
+        return False
 
 # Configuração da página
 st.set_page_config(
@@ -247,6 +170,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_pool():
+    """Pool de conexões somente leitura compartilhado pelas sessões do dashboard"""
+    return PoolConexoes('almoxarifado.db')
+
 @st.cache_data
 def load_data():
     """Carrega dados do banco SQLite"""
@@ -254,75 +182,16 @@ def load_data():
     init_database()
     
     try:
-        conn = sqlite3.connect('almoxarifado.db')
-        
-        # Queries principais
-        queries = {
-            'estoque': """
-                SELECT e.*, m.codigo as cod_material, m.descricao as desc_material,
-                       m.unidade, f.descricao as familia, g.descricao as grupo,
-                       a.descricao as almoxarifado, p.periodo, p.ano, p.mes
-                FROM estoque e
-                JOIN materiais m ON e.material_id = m.id
-                LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
-                LEFT JOIN familias f ON g.familia_id = f.id
-                LEFT JOIN almoxarifados a ON e.almoxarifado_id = a.id
-                LEFT JOIN periodos p ON e.periodo_id = p.id
-            """,
-            'materiais': """
-                SELECT m.*, f.descricao as familia, g.descricao as grupo,
-                       t.descricao as tipo_material
-                FROM materiais m
-                LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
-                LEFT JOIN familias f ON g.familia_id = f.id
-                LEFT JOIN tipos_materiais t ON m.tipo_material_id = t.id
-            """,
-            'resumo_por_periodo': """
-                SELECT p.periodo, p.ano, p.mes,
-                       COUNT(DISTINCT e.material_id) as total_materiais,
-                       SUM(e.quantidade) as total_quantidade,
-                       SUM(e.valor_total) as valor_total_estoque,
-                       AVG(e.custo_medio) as custo_medio_geral
-                FROM estoque e
-                JOIN periodos p ON e.periodo_id = p.id
-                GROUP BY p.id, p.periodo, p.ano, p.mes
-                ORDER BY p.ano, p.mes
-            """,
-            'top_materiais_valor': """
-                SELECT m.codigo, m.descricao, f.descricao as familia,
-                       SUM(e.valor_total) as valor_total,
-                       SUM(e.quantidade) as quantidade_total,
-                       AVG(e.custo_medio) as custo_medio
-                FROM estoque e
-                JOIN materiais m ON e.material_id = m.id
-                LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
-                LEFT JOIN familias f ON g.familia_id = f.id
-                GROUP BY m.id, m.codigo, m.descricao, f.descricao
-                ORDER BY valor_total DESC
-                LIMIT 20
-            """,
-            'estoque_por_almoxarifado': """
-                SELECT a.descricao as almoxarifado,
-                       COUNT(DISTINCT e.material_id) as total_materiais,
-                       SUM(e.quantidade) as quantidade_total,
-                       SUM(e.valor_total) as valor_total
-                FROM estoque e
-                JOIN almoxarifados a ON e.almoxarifado_id = a.id
-                GROUP BY a.id, a.descricao
-                ORDER BY valor_total DESC
-            """
-        }
-        
         data = {}
-        for key, query in queries.items():
-            try:
-                df = pd.read_sql_query(query, conn)
-                data[key] = df if len(df) > 0 else pd.DataFrame()
-            except Exception as e:
-                st.warning(f"Erro ao carregar {key}: {e}")
-                data[key] = pd.DataFrame()
+        with get_pool().conexao() as conn:
+            for key, query in CONSULTAS_DASHBOARD.items():
+                try:
+                    df = pd.read_sql_query(query, conn)
+                    data[key] = df if len(df) > 0 else pd.DataFrame()
+                except Exception as e:
+                    st.warning(f"Erro ao carregar {key}: {e}")
+                    data[key] = pd.DataFrame()
         
-        conn.close()
         return data
         
     except Exception as e:
@@ -389,15 +258,15 @@ def show_price_evolution(codigo_material, data):
         st.warning("Nenhum dado histórico encontrado para este material.")
         return
     
-    # Agrupar por período
-    evolucao_precos = material_historico.groupby(['periodo', 'ano', 'mes']).agg({
+    # Agrupar só pelo período (ano e mes são nulos nos períodos que não puderam ser interpretados)
+    evolucao_precos = material_historico.groupby('periodo').agg({
         'custo_medio': 'mean',
         'quantidade': 'sum',
         'valor_total': 'sum'
     }).reset_index()
     
     # Criar coluna de data real para ordenação cronológica correta
-    evolucao_precos['data_ordem'] = evolucao_precos['periodo'].apply(create_date_from_period)
+    evolucao_precos['data_ordem'] = period_dates(evolucao_precos['periodo'])
     
     # Ordenar cronologicamente
     evolucao_precos = evolucao_precos.sort_values('data_ordem')
@@ -459,14 +328,14 @@ def show_period_movement(codigo_material, data):
         return
     
     # Agrupar por período
-    movimentacao = material_historico.groupby(['periodo', 'ano', 'mes']).agg({
+    movimentacao = material_historico.groupby('periodo').agg({
         'quantidade': 'sum',
         'valor_total': 'sum',
         'custo_medio': 'mean'
     }).reset_index()
     
     # Criar coluna de data real para ordenação cronológica correta
-    movimentacao['data_ordem'] = movimentacao['periodo'].apply(create_date_from_period)
+    movimentacao['data_ordem'] = period_dates(movimentacao['periodo'])
     
     # Ordenar cronologicamente
     movimentacao = movimentacao.sort_values('data_ordem')
@@ -586,14 +455,14 @@ def show_trend_analysis(codigo_material, data):
         return
     
     # Agrupar por período
-    tendencias = material_historico.groupby(['periodo', 'ano', 'mes']).agg({
+    tendencias = material_historico.groupby('periodo').agg({
         'quantidade': 'sum',
         'valor_total': 'sum',
         'custo_medio': 'mean'
     }).reset_index()
     
     # Criar coluna de data real para ordenação cronológica correta
-    tendencias['data_ordem'] = tendencias['periodo'].apply(create_date_from_period)
+    tendencias['data_ordem'] = period_dates(tendencias['periodo'])
     
     # Ordenar cronologicamente
     tendencias = tendencias.sort_values('data_ordem')
@@ -1120,7 +989,7 @@ def show_main_dashboard():
         }).reset_index()
         
         # Criar coluna de data real para ordenação cronológica correta
-        evolucao_filtrada['data_ordem'] = evolucao_filtrada['periodo'].apply(create_date_from_period)
+        evolucao_filtrada['data_ordem'] = period_dates(evolucao_filtrada['periodo'])
         
         # Ordenar cronologicamente
         evolucao_filtrada = evolucao_filtrada.sort_values('data_ordem')
@@ -1730,7 +1599,7 @@ def show_advanced_analyses():
         estabilidade['cv'] = (estabilidade['desvio_padrao'] / estabilidade['media']) * 100
         
         # Criar coluna de data real para ordenação cronológica
-        estabilidade['data_ordem'] = estabilidade['periodo'].apply(create_date_from_period)
+        estabilidade['data_ordem'] = period_dates(estabilidade['periodo'])
         estabilidade = estabilidade.sort_values('data_ordem')
         
         fig_estab = px.line(
@@ -2321,6 +2190,11 @@ def show_advanced_analyses():
                 st.success("✅ Dashboard executivo gerado com sucesso!")
     
 
+@st.cache_data(max_entries=1, show_spinner="🔍 Validando o arquivo inteiro...")
+def validar_upload(conteudo):
+    """Valida o arquivo enviado (dry-run, sem gravar no banco), uma vez por conteúdo"""
+    return validate_file(conteudo)
+
 def show_data_integration():
     """
     Aba para integração de dados futuros
@@ -2345,37 +2219,44 @@ def show_data_integration():
     with tab_docs:
         st.subheader("📋 Colunas Obrigatórias no Arquivo CSV/Excel")
         
+        st.markdown("""
+        O arquivo segue o layout do relatório `Database.csv` do ERP: **32 colunas, nesta ordem**.
+        As colunas são lidas pela posição, então o texto do cabeçalho pode variar, mas a ordem não.
+        """)
+        
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("""
-            **Colunas Principais:**
-            - `cod_material`: Código único do material
-            - `desc_material`: Descrição do material
-            - `quantidade`: Quantidade em estoque
-            - `custo_medio`: Custo médio unitário
-            - `valor_total`: Valor total (quantidade × custo_medio)
-            - `unidade`: Unidade de medida
-            - `periodo`: Período no formato 'mmm/aa' (ex: 'jan/23')
-            - `ano`: Ano (ex: 2023)
-            - `mes`: Mês numérico (1-12)
+            **Material e Estoque:**
+            1. `Período`: Período no formato 'mmm/aa' (ex: 'jan/23')
+            2. `Cód. Família` / 3. `Desc. Família`
+            4. `Cód. Grupo Material` / 5. `Desc. Grupo Material`
+            6. `Cód. Material`: Código numérico do material
+            7. `Desc. Material`: Descrição do material
+            8. `Cód. Tipo Material` / 9. `Desc. Tipo Material`
+            10. `Situação`: Situação do material (ex: 'Ativo')
+            11. `Localização` / 12. `Desc. Localização` / 13. `Cód. Localização`
+            14. `Cód. Almoxarifado` / 15. `Desc. Almoxarifado`
+            16. `Unidade`: Unidade de medida
+            17. `Quantidade`: Quantidade em estoque
+            18. `Custo Médio`: Custo médio unitário
+            19. `Vlr. Total`: Valor total (Quantidade × Custo Médio)
             """)
         
         with col2:
             st.markdown("""
-            **Colunas de Classificação:**
-            - `familia`: Família do material
-            - `grupo_material`: Grupo do material
-            - `tipo_material`: Tipo do material
-            - `almoxarifado`: Nome do almoxarifado
-            - `localizacao`: Localização física
-            - `classificacao_sped`: Classificação SPED
-            - `conta_contabil`: Conta contábil
-            - `classificacao_fiscal`: Classificação fiscal
-            - `identificacao`: Identificação adicional
+            **Classificações e Controles:**
+            20. `Cód. Classificação SPED` / 21. `Desc. Classificação SPED`
+            22. `Controla Est. Mín.` / 23. `Estoque Mínimo`
+            24. `Controla Est. Máx.` / 25. `Estoque Máximo`
+            26. `Conta Contábil` / 27. `Desc. Conta Contábil`
+            28. `NCM` / 29. `Desc. Classificação Fiscal`
+            30. `Cód. Identificação` / 31. `Descrição Identificação`
+            32. `Curva X-Y-Z`
             """)
         
-        st.info("💡 **Dica**: Todas as colunas são obrigatórias. Use valores vazios ou 'N/A' para campos sem informação.")
+        st.info("💡 **Dica**: Use ';' como separador, vírgula decimal e codificação latin-1, como o arquivo exportado pelo ERP. Campos sem informação podem ficar vazios.")
     
     with tab_estrutura:
         st.subheader("🏗️ Estrutura do Banco de Dados")
@@ -2388,8 +2269,8 @@ def show_data_integration():
         st.markdown("""
         **Tabelas Principais:**
         - `materiais`: Informações dos materiais
-        - `estoque`: Dados de estoque por período
-        - `periodos`: Períodos disponíveis
+        - `estoque`: Dados de estoque por período (WITHOUT ROWID, chave `(periodo_id, linha)`)
+        - `periodos`: Períodos disponíveis (o período 0, `(sem período)`, guarda os registros sem período)
         - `familias`: Famílias de materiais
         - `grupos_materiais`: Grupos de materiais
         - `tipos_materiais`: Tipos de materiais
@@ -2401,89 +2282,38 @@ def show_data_integration():
         - `identificacoes`: Identificações adicionais
         """)
         
+        # Tabelas mantidas pela carga
+        st.markdown("""
+        **Tabelas Derivadas e de Controle (mantidas pela carga):**
+        - `estoque_flat`: Estoque já desnormalizado, lido pelo dashboard sem joins
+        - `resumo_periodo_material`, `resumo_periodo_almoxarifado`, `resumo_periodo_familia`: Agregados por período usados nos indicadores
+        - `cargas_periodos`: Hash de conteúdo de cada período carregado (carga incremental)
+        - `checkpoints_carga`: Progresso da carga, para retomar uma carga interrompida
+        """)
+        
         # Relacionamentos
         st.markdown("""
         **Relacionamentos:**
-        - Cada material pertence a uma família, grupo e tipo
-        - Cada registro de estoque está associado a um material e período
+        - Cada material pertence a um grupo (e, por ele, a uma família) e a um tipo
+        - Cada registro de estoque está associado a um material e a um período (período 0 se não tiver)
         - As classificações são referenciadas por IDs numéricos
         """)
         
-        # Botão para mostrar schema
+        # Botão para mostrar schema (o próprio arquivo aplicado ao banco)
         if st.button("🔍 Ver Schema Completo"):
-            st.code("""
--- Schema do banco de dados
-CREATE TABLE periodos (
-    id INTEGER PRIMARY KEY,
-    periodo TEXT UNIQUE NOT NULL,
-    ano INTEGER NOT NULL,
-    mes INTEGER NOT NULL
-);
-
-CREATE TABLE familias (
-    id INTEGER PRIMARY KEY,
-    nome TEXT UNIQUE NOT NULL
-);
-
-CREATE TABLE materiais (
-    id INTEGER PRIMARY KEY,
-    cod_material TEXT UNIQUE NOT NULL,
-    desc_material TEXT NOT NULL,
-    unidade TEXT NOT NULL,
-    familia_id INTEGER,
-    grupo_material_id INTEGER,
-    tipo_material_id INTEGER,
-    FOREIGN KEY (familia_id) REFERENCES familias (id),
-    FOREIGN KEY (grupo_material_id) REFERENCES grupos_materiais (id),
-    FOREIGN KEY (tipo_material_id) REFERENCES tipos_materiais (id)
-);
-
-CREATE TABLE estoque (
-    id INTEGER PRIMARY KEY,
-    material_id INTEGER NOT NULL,
-    periodo_id INTEGER NOT NULL,
-    quantidade REAL NOT NULL,
-    custo_medio REAL NOT NULL,
-    valor_total REAL NOT NULL,
-    almoxarifado_id INTEGER,
-    localizacao_id INTEGER,
-    FOREIGN KEY (material_id) REFERENCES materiais (id),
-    FOREIGN KEY (periodo_id) REFERENCES periodos (id),
-    FOREIGN KEY (almoxarifado_id) REFERENCES almoxarifados (id),
-    FOREIGN KEY (localizacao_id) REFERENCES localizacoes (id)
-);
-            """, language="sql")
+            with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                st.code(f.read(), language="sql")
     
     with tab_exemplo:
         st.subheader("📄 Exemplo de Arquivo CSV")
         
-        # Exemplo de dados
-        exemplo_dados = {
-            'cod_material': ['MAT001', 'MAT002', 'MAT003'],
-            'desc_material': ['Parafuso M6x20', 'Porca M6', 'Arruela M6'],
-            'quantidade': [1000, 500, 2000],
-            'custo_medio': [0.15, 0.08, 0.03],
-            'valor_total': [150.00, 40.00, 60.00],
-            'unidade': ['UN', 'UN', 'UN'],
-            'periodo': ['jan/23', 'jan/23', 'jan/23'],
-            'ano': [2023, 2023, 2023],
-            'mes': [1, 1, 1],
-            'familia': ['Ferramentas', 'Ferramentas', 'Ferramentas'],
-            'grupo_material': ['Parafusos', 'Porcas', 'Arruelas'],
-            'tipo_material': ['Metal', 'Metal', 'Metal'],
-            'almoxarifado': ['Principal', 'Principal', 'Principal'],
-            'localizacao': ['A1-B2', 'A1-B3', 'A1-B4'],
-            'classificacao_sped': ['15.01.01', '15.01.02', '15.01.03'],
-            'conta_contabil': ['1.1.01.001', '1.1.01.002', '1.1.01.003'],
-            'classificacao_fiscal': ['NCM12345678', 'NCM87654321', 'NCM11223344'],
-            'identificacao': ['LOTE001', 'LOTE002', 'LOTE003']
-        }
-        
-        df_exemplo = pd.DataFrame(exemplo_dados)
+        # Exemplo de dados no layout do Database.csv
+        df_exemplo = pd.read_csv(EXEMPLO_PATH, sep=';', encoding='latin-1', dtype=str, keep_default_na=False)
         st.dataframe(df_exemplo, use_container_width=True)
         
-        # Botão para download
-        csv_exemplo = df_exemplo.to_csv(index=False, encoding='utf-8-sig')
+        # Botão para download do próprio arquivo, sem regravar separador e codificação
+        with open(EXEMPLO_PATH, 'rb') as arquivo:
+            csv_exemplo = arquivo.read()
         st.download_button(
             label="📥 Baixar Exemplo CSV",
             data=csv_exemplo,
@@ -2491,7 +2321,7 @@ CREATE TABLE estoque (
             mime="text/csv"
         )
         
-        st.info("💡 **Dica**: Use este arquivo como modelo para seus dados. Mantenha o mesmo formato e nomes das colunas.")
+        st.info("💡 **Dica**: Use este arquivo como modelo para seus dados. Mantenha as 32 colunas na mesma ordem, o separador ';' e a vírgula decimal.")
     
     with tab_guia:
         st.subheader("🔧 Guia de Integração")
@@ -2499,8 +2329,8 @@ CREATE TABLE estoque (
         # Botão de upload de arquivo
         st.markdown("### 📤 Upload de Arquivo")
         uploaded_file = st.file_uploader(
-            "Escolha um arquivo CSV ou Excel para integrar:",
-            type=['csv', 'xlsx', 'xls'],
+            "Escolha um arquivo CSV (ou CSV compactado) ou Excel para integrar:",
+            type=['csv', 'gz', 'zip', 'xz', 'xlsx', 'xls'],
             help="Selecione um arquivo com os dados do almoxarifado no formato correto"
         )
         
@@ -2509,90 +2339,79 @@ CREATE TABLE estoque (
             st.success(f"✅ Arquivo carregado: {uploaded_file.name}")
             st.info(f"📊 Tamanho: {uploaded_file.size} bytes")
             
-            # Validar arquivo
+            # Validar o arquivo inteiro antes da carga: tipos, períodos, custos, totais e códigos
+            valido = False
             try:
-                # Ler arquivo para validação
-                if uploaded_file.name.endswith('.csv'):
-                    df_validation = pd.read_csv(uploaded_file)
-                elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-                    df_validation = pd.read_excel(uploaded_file)
-                
-                # Verificar colunas obrigatórias
-                colunas_obrigatorias = [
-                    'cod_material', 'desc_material', 'quantidade', 'custo_medio', 
-                    'valor_total', 'unidade', 'periodo', 'ano', 'mes', 'familia',
-                    'grupo_material', 'tipo_material', 'almoxarifado', 'localizacao',
-                    'classificacao_sped', 'conta_contabil', 'classificacao_fiscal', 'identificacao'
-                ]
+                relatorio = validar_upload(uploaded_file.getvalue())
+                valido = relatorio.valido
                 
-                colunas_faltando = [col for col in colunas_obrigatorias if col not in df_validation.columns]
-                
-                if colunas_faltando:
-                    st.error(f"❌ Colunas obrigatórias faltando: {', '.join(colunas_faltando)}")
-                    st.info("💡 Use o arquivo de exemplo como referência.")
+                if valido:
+                    st.success(f"✅ Arquivo válido! {relatorio.linhas:,} registros verificados "
+                               f"em {relatorio.segundos:.1f}s.")
                 else:
-                    st.success("✅ Arquivo válido! Todas as colunas obrigatórias estão presentes.")
-                    st.info(f"📊 Registros encontrados: {len(df_validation)}")
+                    st.error("❌ O arquivo tem problemas que comprometem a carga:")
+                    resumo = relatorio.resumo()
+                    st.dataframe(resumo[resumo['ocorrencias'] > 0], use_container_width=True, hide_index=True)
                     
-                    # Mostrar preview dos dados
-                    with st.expander("👁️ Preview dos Dados"):
-                        st.dataframe(df_validation.head(10), use_container_width=True)
+                    # Mostrar exemplos das linhas com problema
+                    for regra, total in relatorio.ocorrencias.items():
+                        if total:
+                            with st.expander(f"👁️ Exemplos: {regra} ({total:,} ocorrências)"):
+                                st.dataframe(relatorio.exemplos(regra), use_container_width=True, hide_index=True)
+                    st.info("💡 Use o arquivo de exemplo como referência.")
                 
             except Exception as e:
                 st.error(f"❌ Erro ao validar arquivo: {str(e)}")
                 st.info("💡 Verifique se o arquivo está no formato correto.")
             
+            ignorar = not valido and st.checkbox("⚠️ Ignorar os problemas e processar mesmo assim")
+            
             # Botão para processar
-            if st.button("🚀 Processar Arquivo", type="primary", use_container_width=True):
-                with st.spinner("Processando arquivo..."):
+            if st.button("🚀 Processar Arquivo", type="primary", use_container_width=True,
+                         disabled=not (valido or ignorar)):
+                barra = st.progress(0.0, text="📝 Preparando a carga...")
+                andamento = {}
+                resultado = {}
+                
+                def carregar():
+                    # Os bytes do upload vão direto ao processador; reenviar o mesmo
+                    # arquivo retoma a carga do último lote confirmado
                     try:
-                        # Salvar arquivo temporariamente
-                        import tempfile
-                        import os
-                        
-                        # Criar arquivo temporário
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-                            tmp_file.write(uploaded_file.getvalue())
-                            tmp_path = tmp_file.name
-                        
-                        # Processar arquivo
-                        st.info("📝 Processando dados...")
-                        
-                        # Chamar o processador de dados
-                        try:
-                            import subprocess
-                            import sys
-                            
-                            # Executar o processador de dados
-                            result = subprocess.run([
-                                sys.executable, 
-                                "data_processor_optimized.py",
-                                "--file", tmp_path
-                            ], capture_output=True, text=True, timeout=300)
-                            
-                            if result.returncode == 0:
-                                st.success("✅ Arquivo processado com sucesso!")
-                                st.info("🔄 Recarregue a página para ver os novos dados no dashboard.")
-                                
-                                # Mostrar informações do processamento
-                                if result.stdout:
-                                    st.text("📊 Log do processamento:")
-                                    st.code(result.stdout)
-                            else:
-                                st.error(f"❌ Erro no processamento: {result.stderr}")
-                                
-                        except subprocess.TimeoutExpired:
-                            st.error("⏰ Timeout: O processamento demorou muito. Tente com um arquivo menor.")
-                        except Exception as e:
-                            st.error(f"❌ Erro ao executar processador: {str(e)}")
-                            st.info("💡 Verifique se o arquivo data_processor_optimized.py existe e está funcionando.")
-                        
-                        # Limpar arquivo temporário
-                        os.unlink(tmp_path)
-                        
+                        resultado['sucesso'] = ingest(uploaded_file.getvalue(), 'almoxarifado.db',
+                                                      progresso=andamento.update,
+                                                      nome_arquivo=uploaded_file.name, resume=True)
                     except Exception as e:
-                        st.error(f"❌ Erro ao processar arquivo: {str(e)}")
-                        st.info("💡 Verifique se o arquivo está no formato correto e tente novamente.")
+                        resultado['erro'] = e
+                
+                # A carga roda em uma thread; esta apenas acompanha o andamento
+                carga = threading.Thread(target=carregar, daemon=True)
+                carga.start()
+                while carga.is_alive():
+                    carga.join(timeout=0.25)
+                    estado = dict(andamento)
+                    if not estado:
+                        continue
+                    vazao = f"{estado['linhas_por_segundo']:,.0f} registros/s"
+                    if estado['fase'] == 'lookups':
+                        barra.progress(0.05, text=f"🔎 Lendo códigos: lote {estado['lote']}, "
+                                                  f"{estado['linhas']:,} registros ({vazao})")
+                    else:
+                        fracao = estado['linhas'] / estado['total'] if estado['total'] else 0.0
+                        barra.progress(0.1 + 0.9 * min(fracao, 1.0),
+                                       text=f"📦 Gravando estoque: lote {estado['lote']}, "
+                                            f"{estado['linhas']:,}/{estado['total']:,} registros ({vazao})")
+                
+                if resultado.get('sucesso'):
+                    barra.progress(1.0, text="✅ Carga concluída")
+                    # Os dados em cache do dashboard deixam de valer
+                    load_data.clear()
+                    st.success("✅ Arquivo processado com sucesso! O dashboard já mostra os novos dados.")
+                elif 'erro' in resultado:
+                    st.error(f"❌ Erro ao processar arquivo: {resultado['erro']}")
+                    st.info("💡 Verifique se o arquivo está no formato correto e tente novamente.")
+                else:
+                    st.error("❌ Erro no processamento. Consulte o log da aplicação.")
+                    st.info("💡 Os lotes já gravados foram preservados: envie o mesmo arquivo para continuar a carga.")
         
         st.markdown("---")
         
@@ -2612,10 +2431,13 @@ CREATE TABLE estoque (
                         
                         # Limpar todas as tabelas
                         tabelas = [
-                            'estoque', 'materiais', 'periodos', 'familias', 
+                            'estoque', 'estoque_flat', 'resumo_periodo_material',
+                            'resumo_periodo_almoxarifado', 'resumo_periodo_familia',
+                            'materiais', 'periodos', 'familias', 
                             'grupos_materiais', 'tipos_materiais', 'almoxarifados',
                             'localizacoes', 'classificacoes_sped', 'contas_contabeis',
-                            'classificacoes_fiscais', 'identificacoes'
+                            'classificacoes_fiscais', 'identificacoes', 'cargas_periodos',
+                            'checkpoints_carga'
                         ]
                         
                         for tabela in tabelas:
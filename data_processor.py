@@ -6,47 +6,1487 @@ Processa o arquivo CSV e prepara os dados para importação no banco de dados
 import pandas as pd
 import sqlite3
 import numpy as np
-from datetime import datetime
-import re
+from datetime import date
 import logging
+import os
+import time
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import lzma
+import mmap
+import shutil
+import zipfile
+from contextlib import contextmanager, nullcontext
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional (engine='pyarrow' e staging em Parquet)
+    pa = None
+    pa_csv = None
+    pq = None
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl é opcional (planilhas .xlsx)
+    openpyxl = None
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # python-calamine é opcional (leitura mais rápida de .xlsx)
+    CalamineWorkbook = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Nomes das 32 colunas do Database.csv, na ordem do arquivo
+COLUNAS = [
+    'periodo', 'cod_familia', 'desc_familia', 'cod_grupo_material', 'desc_grupo_material',
+    'cod_material', 'desc_material', 'cod_tipo_material', 'desc_tipo_material', 'situacao',
+    'localizacao', 'desc_localizacao', 'cod_localizacao', 'cod_almoxarifado', 'desc_almoxarifado',
+    'unidade', 'quantidade', 'custo_medio', 'vlr_total', 'cod_classificacao_sped',
+    'desc_classificacao_sped', 'controla_est_min', 'estoque_minimo', 'controla_est_max',
+    'estoque_maximo', 'conta_contabil', 'desc_conta_contabil', 'ncm', 'desc_classificacao_fiscal',
+    'cod_identificacao', 'desc_identificacao', 'curva_xyz'
+]
+
+# Colunas numéricas: o parser as lê direto como número (decimal=','); só as que
+# vierem como texto por conter valores inválidos passam por convert_numeric
+COLUNAS_NUMERICAS = ['cod_familia', 'cod_grupo_material', 'cod_material', 'cod_tipo_material',
+                     'cod_almoxarifado', 'quantidade', 'custo_medio', 'vlr_total',
+                     'cod_classificacao_sped', 'estoque_minimo', 'estoque_maximo',
+                     'conta_contabil', 'cod_identificacao']
+
+# Tipos declarados das colunas de texto: descrições com poucos valores distintos
+# viram 'category' (um código por linha em vez de uma string); códigos textuais
+# ficam como str para não serem inferidos como número
+TIPOS_COLUNAS = {
+    'periodo': 'category',
+    'desc_familia': 'category',
+    'desc_grupo_material': 'category',
+    'desc_material': str,
+    'desc_tipo_material': 'category',
+    'situacao': 'category',
+    'localizacao': str,
+    'desc_localizacao': 'category',
+    'cod_localizacao': str,
+    'desc_almoxarifado': 'category',
+    'unidade': 'category',
+    'desc_classificacao_sped': 'category',
+    'controla_est_min': 'category',
+    'controla_est_max': 'category',
+    'desc_conta_contabil': 'category',
+    'ncm': str,
+    'desc_classificacao_fiscal': 'category',
+    'desc_identificacao': 'category',
+    'curva_xyz': 'category',
+}
+
+# Tabelas de lookup: tabela -> (coluna do código no CSV, tipo do código, colunas adicionais)
+DIMENSOES = {
+    'periodos': ('periodo', str, ()),
+    'familias': ('cod_familia', int, ('desc_familia',)),
+    'grupos_materiais': ('cod_grupo_material', int, ('desc_grupo_material', 'cod_familia')),
+    'tipos_materiais': ('cod_tipo_material', int, ('desc_tipo_material',)),
+    'almoxarifados': ('cod_almoxarifado', int, ('desc_almoxarifado',)),
+    'localizacoes': ('cod_localizacao', str, ('desc_localizacao', 'cod_almoxarifado')),
+    'classificacoes_sped': ('cod_classificacao_sped', int, ('desc_classificacao_sped',)),
+    'contas_contabeis': ('conta_contabil', int, ('desc_conta_contabil',)),
+    'classificacoes_fiscais': ('ncm', str, ('desc_classificacao_fiscal',)),
+    'identificacoes': ('cod_identificacao', int, ('desc_identificacao',)),
+}
+
+def resolve_engine(engine):
+    """Valida o parser pedido, caindo para o parser C do pandas sem pyarrow"""
+    if engine not in ('c', 'pyarrow'):
+        raise ValueError(f"Engine inválida: {engine} (use 'c' ou 'pyarrow')")
+    if engine == 'pyarrow' and pa_csv is None:
+        logger.warning("pyarrow não está instalado; usando o parser padrão do pandas")
+        return 'c'
+    return engine
+
+# Assinaturas (magic bytes) dos formatos compactados aceitos na entrada
+ASSINATURAS_COMPACTACAO = {
+    b'\x1f\x8b': 'gzip',
+    b'PK\x03\x04': 'zip',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+def in_memory(path):
+    """Indica se a entrada é o próprio conteúdo do arquivo (bytes) em vez de um caminho"""
+    return isinstance(path, (bytes, bytearray))
+
+def file_hash(path, bloco=1 << 20):
+    """Hash SHA-1 do conteúdo de um arquivo (caminho ou bytes), lido em blocos de ``bloco`` bytes"""
+    if in_memory(path):
+        return hashlib.sha1(path).hexdigest()
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b''):
+            digest.update(parte)
+    return digest.hexdigest()
+
+def _open_binary(path):
+    """Abre um caminho ou um conteúdo em bytes como fluxo binário"""
+    return io.BytesIO(path) if in_memory(path) else open(path, 'rb')
+
+def detect_compression(path):
+    """Identifica a compactação do arquivo pelos primeiros bytes (None para texto puro)"""
+    with _open_binary(path) as f:
+        inicio = f.read(6)
+    for assinatura, metodo in ASSINATURAS_COMPACTACAO.items():
+        if inicio.startswith(assinatura):
+            return metodo
+    return None
+
+def open_compressed(path, metodo):
+    """Abre um arquivo compactado como fluxo binário, descompactado sob demanda"""
+    if in_memory(path):
+        path = io.BytesIO(path)
+    if metodo == 'gzip':
+        return gzip.open(path, 'rb')
+    if metodo == 'xz':
+        return lzma.open(path, 'rb')
+    
+    arquivo = zipfile.ZipFile(path)
+    nomes = [nome for nome in arquivo.namelist() if not nome.endswith('/')]
+    if len(nomes) != 1:
+        arquivo.close()
+        raise ValueError(f"O arquivo zip deve conter um único CSV ({len(nomes)} encontrados)")
+    return arquivo.open(nomes[0])
+
+# Assinatura dos arquivos .xls (formato binário antigo do Excel)
+ASSINATURA_XLS = b'\xd0\xcf\x11\xe0'
+
+def excel_format(path):
+    """Identifica planilhas do Excel: 'xlsx', 'xls' (formato binário antigo) ou None"""
+    with _open_binary(path) as f:
+        inicio = f.read(4)
+    if inicio == ASSINATURA_XLS:
+        return 'xls'
+    if inicio == b'PK\x03\x04':
+        with zipfile.ZipFile(io.BytesIO(path) if in_memory(path) else path) as arquivo:
+            if 'xl/workbook.xml' in arquivo.namelist():
+                return 'xlsx'
+    return None
+
+def can_memory_map(path):
+    """Só arquivos CSV não compactados em disco podem ser mapeados em memória"""
+    return not in_memory(path) and detect_compression(path) is None
+
+def _texto_celula(valor, coluna):
+    """Converte uma célula do Excel no texto que o CSV exportado traria"""
+    if valor is None:
+        return None
+    if isinstance(valor, date):
+        # O Excel converte 'jan/23' em data; o período volta ao formato do ERP
+        if coluna == 'periodo':
+            abreviacao = next(mes for mes, numero in MESES_ABREVIADOS.items() if numero == valor.month)
+            return f"{abreviacao}/{valor.year % 100:02d}"
+        return valor.isoformat()
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+def _excel_frame(linhas, dtype=None, usecols=None):
+    """Monta com linhas de células do Excel o mesmo frame que read_database_csv produziria"""
+    colunas = list(usecols) if usecols is not None else COLUNAS
+    dados = {}
+    for col in colunas:
+        posicao = COLUNAS.index(col)
+        valores = [linha[posicao] if posicao < len(linha) else None for linha in linhas]
+        if dtype is str or col in TIPOS_COLUNAS:
+            serie = pd.Series([_texto_celula(valor, col) for valor in valores], dtype=object)
+            if dtype is None and TIPOS_COLUNAS[col] == 'category':
+                serie = serie.astype('category')
+        else:
+            # Como na inferência do parser: número se todas as células forem números
+            serie = pd.Series(valores, dtype=object)
+            try:
+                serie = pd.to_numeric(serie)
+            except (ValueError, TypeError):
+                pass
+        dados[col] = serie
+    return pd.DataFrame(dados, columns=colunas)
+
+def _excel_rows(path):
+    """Gera as linhas de dados (sem o cabeçalho) da primeira planilha de um .xlsx
+    
+    Usa o python-calamine se estiver instalado (o parsing é feito em Rust e a
+    planilha fica em memória na forma compacta nativa); senão, o openpyxl em
+    modo somente leitura, que lê o XML em fluxo. Células vazias vêm como None.
+    """
+    if CalamineWorkbook is not None:
+        livro = CalamineWorkbook.from_filelike(io.BytesIO(path)) if in_memory(path) else CalamineWorkbook.from_path(path)
+        linhas = livro.get_sheet_by_index(0).iter_rows()
+        next(linhas, None)
+        for linha in linhas:
+            yield [None if valor == '' else valor for valor in linha]
+        return
+    
+    if openpyxl is None:
+        raise ImportError("O pacote openpyxl (ou python-calamine) é necessário para ler planilhas .xlsx")
+    
+    livro = openpyxl.load_workbook(io.BytesIO(path) if in_memory(path) else path, read_only=True, data_only=True)
+    try:
+        yield from livro.worksheets[0].iter_rows(min_row=2, values_only=True)
+    finally:
+        livro.close()
+
+def read_excel_chunks(path, chunksize, dtype=None, usecols=None, inicio=0):
+    """Lê a primeira planilha de um .xlsx em lotes
+    
+    As linhas são convertidas em frames de ``chunksize`` linhas com as colunas
+    e tipos de read_database_csv, então os frames em memória são limitados
+    pelo lote e não pelo tamanho da planilha. Linhas vazias são ignoradas,
+    como no CSV.
+    """
+    linhas = (linha for linha in _excel_rows(path) if any(valor is not None for valor in linha))
+    linhas = itertools.islice(linhas, inicio, None)
+    lidas = inicio
+    while True:
+        lote = list(itertools.islice(linhas, chunksize))
+        if not lote:
+            break
+        chunk = _excel_frame(lote, dtype, usecols)
+        chunk.index = pd.RangeIndex(lidas, lidas + len(chunk))
+        lidas += len(chunk)
+        yield chunk
+
+def _read_excel(path, dtype=None, chunksize=None, usecols=None, inicio=0):
+    """Lê uma planilha do Excel com a mesma interface de read_database_csv"""
+    if excel_format(path) == 'xls':
+        raise ValueError("Planilhas .xls (formato antigo) não são suportadas; salve o arquivo como .xlsx")
+    if chunksize:
+        return read_excel_chunks(path, chunksize, dtype, usecols, inicio)
+    frames = list(read_excel_chunks(path, 100000, dtype, usecols, inicio))
+    return pd.concat(frames, ignore_index=True) if frames else _excel_frame([], dtype, usecols)
+
+def _arrow_source(path, metodo):
+    """Origem para o leitor do pyarrow: o caminho, os bytes (sem cópia) ou o fluxo descompactado"""
+    if metodo:
+        return open_compressed(path, metodo)
+    return nullcontext(pa.BufferReader(path) if in_memory(path) else path)
+
+def _arrow_options(dtype, usecols, block_size=None, inicio=0, cabecalho=True):
+    """Opções do leitor CSV do pyarrow equivalentes às de read_database_csv"""
+    colunas = list(usecols) if usecols is not None else COLUNAS
+    if dtype is str:
+        tipos = {col: pa.string() for col in colunas}
+    else:
+        # Tipos fixos: a inferência por bloco do leitor em streaming não pode variar
+        tipos = {col: pa.string() for col in TIPOS_COLUNAS}
+        tipos.update({col: pa.float64() for col in COLUNAS_NUMERICAS})
+    
+    read_options = pa_csv.ReadOptions(encoding='latin1', column_names=COLUNAS, skip_rows=1 if cabecalho else 0,
+                                      skip_rows_after_names=inicio, use_threads=True, **({'block_size': block_size} if block_size else {}))
+    parse_options = pa_csv.ParseOptions(delimiter=';')
+    convert_options = pa_csv.ConvertOptions(column_types=tipos, include_columns=colunas,
+                                            decimal_point=',', strings_can_be_null=True)
+    return read_options, parse_options, convert_options
+
+def _iter_arrow_chunks(path, dtype, usecols, chunksize, inicio=0):
+    """Lê o CSV em lotes com o leitor em streaming do pyarrow
+    
+    Os lotes seguem os blocos do pyarrow (cerca de ``chunksize`` linhas). Se um
+    valor não puder ser convertido, a leitura continua com o parser C a partir
+    da primeira linha ainda não entregue.
+    """
+    lidas = 0
+    try:
+        opcoes = _arrow_options(dtype, usecols, block_size=max(chunksize * 256, 1 << 20), inicio=inicio)
+        with _arrow_source(path, detect_compression(path)) as fonte, pa_csv.open_csv(fonte, *opcoes) as reader:
+            for batch in reader:
+                if batch.num_rows == 0:
+                    continue
+                chunk = batch.to_pandas(types_mapper=pd.ArrowDtype)
+                chunk.index = pd.RangeIndex(inicio + lidas, inicio + lidas + len(chunk))
+                lidas += len(chunk)
+                yield chunk
+    except pa.ArrowInvalid as e:
+        logger.warning(f"pyarrow não conseguiu ler o arquivo ({e}); continuando com o parser padrão "
+                       f"a partir do registro {inicio + lidas + 1}")
+        yield from read_database_csv(path, dtype=dtype, usecols=usecols, chunksize=chunksize,
+                                     inicio=inicio + lidas)
+
+def read_database_csv(path, dtype=None, engine='c', chunksize=None, usecols=None, inicio=0, memory_map=False,
+                      **kwargs):
+    """Lê o Database.csv com nomes de coluna e tipos declarados
+    
+    Com ``engine='pyarrow'`` a leitura é multi-thread, a conversão de latin-1 é
+    feita pelo próprio leitor e as colunas usam dtypes Arrow. Os demais
+    argumentos (``low_memory``, ``skiprows``, ...) só se aplicam ao parser C.
+    ``inicio`` pula os primeiros registros de dados (após o cabeçalho) em
+    ambos os parsers. ``path`` pode ser também o conteúdo do arquivo em bytes.
+    
+    Arquivos gzip, zip ou xz são reconhecidos pelos primeiros bytes (não pela
+    extensão) e descompactados em fluxo, lote a lote, sem cópia em disco.
+    
+    Com ``memory_map=True`` a leitura completa de um arquivo não compactado é
+    feita sobre o arquivo mapeado em memória, sem cópias para buffers de
+    leitura (leituras em lotes mapeados ficam com ArquivoMapeado).
+    
+    Planilhas .xlsx também são reconhecidas pelo conteúdo e lidas em fluxo
+    por read_excel_chunks, com as mesmas colunas e tipos.
+    """
+    if excel_format(path):
+        return _read_excel(path, dtype=dtype, chunksize=chunksize, usecols=usecols, inicio=inicio)
+    
+    compactacao = detect_compression(path)
+    memory_map = memory_map and compactacao is None and not in_memory(path)
+    if resolve_engine(engine) == 'pyarrow':
+        if chunksize:
+            return _iter_arrow_chunks(path, dtype, usecols, chunksize, inicio)
+        try:
+            with pa.memory_map(path) if memory_map else _arrow_source(path, compactacao) as fonte:
+                return pa_csv.read_csv(fonte, *_arrow_options(dtype, usecols, inicio=inicio)).to_pandas(
+                    types_mapper=pd.ArrowDtype)
+        except pa.ArrowInvalid as e:
+            logger.warning(f"pyarrow não conseguiu ler o arquivo ({e}); usando o parser padrão")
+    
+    if inicio:
+        kwargs['skiprows'] = range(1, inicio + 1)
+    
+    opcoes = dict(sep=';', encoding='latin-1', decimal=',')
+    opcoes.update(kwargs)
+    return pd.read_csv(
+        io.BytesIO(path) if in_memory(path) else path,
+        header=0,
+        names=COLUNAS,
+        dtype=TIPOS_COLUNAS if dtype is None else dtype,
+        chunksize=chunksize,
+        usecols=usecols,
+        compression=compactacao,
+        memory_map=memory_map,
+        **opcoes
+    )
+
+def csv_dialect(path):
+    """Opções de leitura conforme o separador do cabeçalho
+    
+    O Database.csv do ERP usa ';', latin-1 e vírgula decimal (o padrão de
+    read_database_csv); o sample_data.csv usa ',', UTF-8 e ponto decimal. Como
+    as descrições podem conter vírgulas sem aspas, nesse formato as linhas com
+    campos a mais são descartadas com aviso em vez de abortar a leitura.
+    """
+    if excel_format(path):
+        return {}
+    
+    compactacao = detect_compression(path)
+    with open_compressed(path, compactacao) if compactacao else _open_binary(path) as f:
+        cabecalho = f.readline()
+    if b';' in cabecalho:
+        return {}
+    return {'sep': ',', 'encoding': 'utf-8', 'decimal': '.', 'on_bad_lines': 'warn'}
+
+def _read_csv_sem_cabecalho(fonte, dtype=None, engine='c', usecols=None):
+    """Lê um trecho do CSV que começa no início de uma linha de dados (sem cabeçalho)"""
+    if engine == 'pyarrow':
+        try:
+            return pa_csv.read_csv(pa.BufferReader(fonte), *_arrow_options(dtype, usecols, cabecalho=False)).to_pandas(
+                types_mapper=pd.ArrowDtype)
+        except pa.ArrowInvalid as e:
+            logger.warning(f"pyarrow não conseguiu ler o trecho ({e}); usando o parser padrão")
+    
+    return pd.read_csv(
+        io.BytesIO(fonte),
+        sep=';',
+        encoding='latin-1',
+        header=None,
+        names=COLUNAS,
+        dtype=TIPOS_COLUNAS if dtype is None else dtype,
+        decimal=',',
+        usecols=usecols
+    )
+
+class ArquivoMapeado:
+    """CSV não compactado mapeado em memória (mmap) e dividido em limites de linha
+    
+    As faixas de bytes de ``faixas`` começam sempre no início de uma linha e
+    podem ser lidas de forma independente, inclusive em outros processos, que
+    mapeiam o mesmo arquivo e compartilham as páginas do cache do sistema
+    operacional em vez de ler o arquivo de novo. Com o engine pyarrow o trecho
+    é entregue ao parser sem cópia. Campos com quebra de linha entre aspas não
+    são suportados (o Database.csv não os tem).
+    """
+    
+    def __init__(self, path, engine='c'):
+        self.path = path
+        self.engine = resolve_engine(engine)
+        self._arquivo = open(path, 'rb')
+        self.mapa = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapa_arrow = pa.memory_map(path) if self.engine == 'pyarrow' else None
+        # Os dados começam após a linha de cabeçalho
+        self.inicio_dados = self._fim_da_linha(0)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+    
+    def close(self):
+        if self._mapa_arrow is not None:
+            self._mapa_arrow.close()
+        self.mapa.close()
+        self._arquivo.close()
+    
+    def _fim_da_linha(self, posicao):
+        """Posição logo após o fim da linha que contém ``posicao``"""
+        fim = self.mapa.find(b'\n', posicao)
+        return len(self.mapa) if fim < 0 else fim + 1
+    
+    def tamanho_para(self, linhas, amostra=1 << 20):
+        """Estima quantos bytes ocupam ``linhas`` linhas, pela média de uma amostra do início"""
+        trecho = self.mapa[self.inicio_dados:self.inicio_dados + amostra]
+        media = len(trecho) / max(trecho.count(b'\n'), 1)
+        return max(int(linhas * media), 1)
+    
+    def offset_linha(self, linhas, bloco=16 << 20):
+        """Posição em bytes do início do registro de dados de número ``linhas`` (0 = primeiro)"""
+        posicao = self.inicio_dados
+        while linhas > 0 and posicao < len(self.mapa):
+            trecho = self.mapa[posicao:posicao + bloco]
+            quebras = trecho.count(b'\n')
+            if quebras >= linhas:
+                for _ in range(linhas):
+                    posicao = self._fim_da_linha(posicao)
+                return posicao
+            linhas -= quebras
+            posicao += len(trecho)
+        return min(posicao, len(self.mapa))
+    
+    def faixas(self, tamanho, inicio=None):
+        """Divide o arquivo, a partir de ``inicio``, em faixas de cerca de ``tamanho`` bytes"""
+        posicao = self.inicio_dados if inicio is None else inicio
+        faixas = []
+        while posicao < len(self.mapa):
+            fim = self._fim_da_linha(min(posicao + tamanho, len(self.mapa)) - 1)
+            faixas.append((posicao, fim))
+            posicao = fim
+        return faixas
+    
+    def ler(self, inicio, fim, dtype=None, usecols=None):
+        """Lê a faixa ``[inicio, fim)`` como DataFrame, com as colunas e tipos de read_database_csv"""
+        if self._mapa_arrow is not None:
+            fonte = self._mapa_arrow.read_at(fim - inicio, inicio)
+        else:
+            fonte = self.mapa[inicio:fim]
+        return _read_csv_sem_cabecalho(fonte, dtype=dtype, engine=self.engine, usecols=usecols)
+
+class StagingParquet:
+    """Área de staging em Parquet com os chunks já limpos de um arquivo
+    
+    Cada lote lido do arquivo é gravado em
+    ``<diretorio>/<limpeza>/<hash do arquivo>/periodo=<período>/lote-NNNNN.parquet``,
+    uma parte por período, e o manifesto guarda, na ordem do arquivo, os
+    registros lidos e as partes de cada lote. Depois de concluído, as cargas
+    seguintes do mesmo conteúdo (recargas, banco recriado do zero, schema
+    alterado) leem os lotes daqui, sem parsing do CSV nem limpeza, e podem
+    ler só as partições dos períodos que interessam.
+    
+    ``limpeza`` separa os resultados das limpezas diferentes dos dois
+    processadores para o mesmo arquivo.
+    """
+    
+    MANIFESTO = '_manifesto.json'
+    
+    # Incrementar quando a limpeza mudar: staging de versões anteriores é refeito
+    VERSAO = 2
+    
+    def __init__(self, diretorio, arquivo_hash, limpeza):
+        if pq is None:
+            raise ImportError("O pacote pyarrow é necessário para o staging em Parquet")
+        self.caminho = os.path.join(diretorio, limpeza, arquivo_hash)
+        self.lotes = None
+        self._gravados = []
+        
+        manifesto = os.path.join(self.caminho, self.MANIFESTO)
+        if os.path.exists(manifesto):
+            with open(manifesto, 'r', encoding='utf-8') as f:
+                conteudo = json.load(f)
+            if conteudo.get('versao') == self.VERSAO:
+                self.lotes = conteudo['lotes']
+    
+    @property
+    def pronto(self):
+        """True se o staging deste arquivo já foi gravado por completo"""
+        return self.lotes is not None
+    
+    @property
+    def total_linhas(self):
+        """Registros lidos do arquivo original"""
+        return sum(lote['linhas'] for lote in self.lotes)
+    
+    def iniciar(self):
+        """Começa um staging novo, descartando as partes de uma gravação interrompida"""
+        shutil.rmtree(self.caminho, ignore_errors=True)
+        os.makedirs(self.caminho)
+        self.lotes = None
+        self._gravados = []
+    
+    def gravar(self, chunk, linhas):
+        """Grava um lote limpo, uma parte por período
+        
+        ``linhas`` são os registros do arquivo lidos para o lote (antes das
+        linhas descartadas pela limpeza). O índice do chunk vai junto em cada
+        parte, para que a ordem do arquivo seja refeita na leitura.
+        """
+        numero = len(self._gravados) + 1
+        periodos = period_key(chunk['periodo']).to_numpy()
+        partes = []
+        for periodo, parte in chunk.groupby(periodos, sort=False):
+            arquivo = os.path.join(f"periodo={quote(periodo, safe='')}", f"lote-{numero:05d}.parquet")
+            os.makedirs(os.path.join(self.caminho, os.path.dirname(arquivo)), exist_ok=True)
+            pq.write_table(pa.Table.from_pandas(parte, preserve_index=True), os.path.join(self.caminho, arquivo))
+            partes.append({'periodo': periodo, 'arquivo': arquivo, 'registros': len(parte)})
+        self._gravados.append({'linhas': int(linhas), 'partes': partes})
+    
+    def concluir(self):
+        """Grava o manifesto: só a partir daqui o staging passa a valer"""
+        manifesto = os.path.join(self.caminho, self.MANIFESTO)
+        with open(f"{manifesto}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({'versao': self.VERSAO, 'lotes': self._gravados}, f)
+        os.replace(f"{manifesto}.tmp", manifesto)
+        self.lotes = self._gravados
+        logger.info(f"Staging gravado em {self.caminho}: {len(self.lotes)} lotes")
+    
+    def alinhado(self, inicio):
+        """True se o registro ``inicio`` do arquivo coincide com o início de um lote gravado"""
+        return inicio in itertools.accumulate((lote['linhas'] for lote in self.lotes), initial=0)
+    
+    def ler_lotes(self, inicio=0, periodos=None):
+        """Gera ``(registros lidos do arquivo, chunk limpo)`` na ordem do arquivo
+        
+        Os lotes que terminam até o registro ``inicio`` são pulados. Com
+        ``periodos`` só as partições desses períodos são lidas, e lotes sem
+        nenhuma delas nem chegam a ser abertos.
+        """
+        lidas = 0
+        for lote in self.lotes:
+            lidas += lote['linhas']
+            if lidas <= inicio:
+                continue
+            partes = [parte for parte in lote['partes'] if periodos is None or parte['periodo'] in periodos]
+            if not partes:
+                continue
+            frames = [pq.read_table(os.path.join(self.caminho, parte['arquivo'])).to_pandas() for parte in partes]
+            yield lidas, pd.concat(frames).sort_index() if len(frames) > 1 else frames[0]
+    
+    def ler(self):
+        """Lê todo o staging em um único DataFrame, na ordem do arquivo"""
+        frames = [chunk for _, chunk in self.ler_lotes()]
+        return pd.concat(frames) if frames else pd.DataFrame(columns=COLUNAS)
+
+def open_staging(diretorio, arquivo_hash, limpeza):
+    """Abre o staging em Parquet de um arquivo, ou retorna None (com aviso) sem o pyarrow"""
+    try:
+        return StagingParquet(diretorio, arquivo_hash, limpeza)
+    except ImportError as e:
+        logger.warning(f"{e}; os dados serão lidos do arquivo original")
+        return None
+
+def convert_numeric(df):
+    """Converte para número as colunas numéricas que o parser deixou como texto"""
+    for col in COLUNAS_NUMERICAS:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            # Substituir vírgulas por pontos e converter para numérico
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.'), errors='coerce')
+    return df
+
+def clean_text(values):
+    """Aplica strip/upper e troca valores vazios por '', preservando colunas category"""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(str).str.strip().str.upper()
+        return values.replace('NAN', '')
+    
+    # Limpar só as categorias e remapear os códigos (categorias podem se fundir)
+    categorias = values.cat.categories.astype(str).str.strip().str.upper()
+    categorias = categorias.where(categorias != 'NAN', '')
+    novas = categorias.append(pd.Index([''])).unique()
+    
+    codigos = values.cat.codes.to_numpy()
+    novos_codigos = np.where(codigos >= 0, novas.get_indexer(categorias)[codigos], novas.get_loc(''))
+    return pd.Series(pd.Categorical.from_codes(novos_codigos, novas), index=values.index)
+
+def int_key(values):
+    """Normaliza códigos numéricos para inteiros (mesmo critério de int(row[...]))"""
+    return pd.to_numeric(values, errors='coerce').astype('Int64')
+
+def text_key(values):
+    """Normaliza códigos textuais para str
+    
+    Colunas lidas como float por causa de valores vazios voltam a inteiro antes
+    da conversão, para que '2991' e '2991.0' resultem na mesma chave em
+    qualquer lote.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.where(values.isna(), values.astype(str))
+
+def to_records(frame):
+    """Converte um DataFrame em tuplas para executemany, trocando NaN/NA por None"""
+    frame = frame.astype(object)
+    frame = frame.where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+def load_id_map(conn, table, key_column='codigo'):
+    """Carrega o mapeamento código -> id de uma tabela de lookup"""
+    return dict(conn.execute(f"SELECT {key_column}, id FROM {table}").fetchall())
+
+def load_id_maps(conn):
+    """Carrega os mapas código -> id de todas as dimensões e de materiais"""
+    id_maps = {table: load_id_map(conn, table, 'ncm' if table == 'classificacoes_fiscais' else 'codigo')
+               for table in DIMENSOES}
+    id_maps['periodos'] = load_id_map(conn, 'periodos', 'periodo')
+    id_maps['materiais'] = load_id_map(conn, 'materiais')
+    return id_maps
+
+# Abreviações dos meses usadas nos períodos do ERP ('jan/23')
+MESES_ABREVIADOS = {
+    'jan': 1, 'fev': 2, 'mar': 3, 'abr': 4, 'mai': 5, 'jun': 6,
+    'jul': 7, 'ago': 8, 'set': 9, 'out': 10, 'nov': 11, 'dez': 12
+}
+
+# Calendário dos períodos já interpretados: periodo -> (ano, mes), com NA se inválido
+_CALENDARIO = {}
+
+def _interpretar_periodos(textos):
+    """Interpreta períodos 'jan/23', '01/23', '1/2023' ou '2023-01' de uma vez (sem cache)"""
+    textos = textos.str.strip().str.lower()
+    
+    abreviados = textos.str.extract(r'^([a-z]{3})[a-z]*/(\d{2}|\d{4})$')
+    numericos = textos.str.extract(r'^(\d{1,2})/(\d{2}|\d{4})$')
+    iso = textos.str.extract(r'^(\d{4})-(\d{1,2})$')
+    
+    mes = (abreviados[0].map(MESES_ABREVIADOS)
+           .fillna(pd.to_numeric(numericos[0], errors='coerce'))
+           .fillna(pd.to_numeric(iso[1], errors='coerce')))
+    ano_texto = abreviados[1].fillna(numericos[1]).fillna(iso[0])
+    ano = pd.to_numeric(ano_texto, errors='coerce')
+    ano = ano.where(ano_texto.str.len() != 2, ano + 2000)
+    
+    validos = mes.between(1, 12) & ano.notna()
+    return ano.where(validos).astype('Int64'), mes.where(validos).astype('Int64')
+
+def period_calendar(periodos):
+    """Retorna ``ano`` e ``mes`` (Int64, NA se inválido) de uma Series de períodos
+    
+    Só os valores distintos ainda fora do calendário em cache são
+    interpretados; o resultado é espalhado de volta pelos códigos de
+    ``pd.factorize``.
+    """
+    codigos, distintos = pd.factorize(periodos)
+    distintos = [str(periodo) for periodo in distintos]
+    
+    novos = [periodo for periodo in distintos if periodo not in _CALENDARIO]
+    if novos:
+        ano, mes = _interpretar_periodos(pd.Series(novos, dtype=object))
+        _CALENDARIO.update(zip(novos, zip(ano.tolist(), mes.tolist())))
+    
+    def espalhar(posicao):
+        valores = pd.array([_CALENDARIO[periodo][posicao] for periodo in distintos], dtype='Int64')
+        return pd.Series(valores.take(codigos, allow_fill=True), index=periodos.index)
+    
+    return espalhar(0), espalhar(1)
+
+def parse_periodos(periodos):
+    """Extrai ano e mês dos períodos para a tabela periodos
+    
+    Períodos que não puderem ser interpretados ficam com ano e mês nulos
+    (Int64 com NA, gravados como NULL), sem um mês inventado.
+    """
+    return period_calendar(periodos)
+
+def period_dates(periodos):
+    """Converte períodos no primeiro dia do mês, para ordenação cronológica
+    
+    Períodos que não puderem ser interpretados ficam em 1900-01-01.
+    """
+    ano, mes = period_calendar(periodos)
+    datas = pd.to_datetime(pd.DataFrame({'year': ano.fillna(1900), 'month': mes.fillna(1), 'day': 1}))
+    return datas.set_axis(periodos.index)
+
+def dimension_frames(df):
+    """Monta um frame por dimensão: uma linha por código, primeira ocorrência"""
+    frames = {}
+    for table, (key, key_type, columns) in DIMENSOES.items():
+        frame = df[[key, *columns]]
+        normalize = int_key if key_type is int else text_key
+        frame = frame.assign(**{key: normalize(frame[key])})
+        frames[table] = frame.dropna(subset=[key]).drop_duplicates(subset=[key])
+    return frames
+
+def merge_dimension_frames(acumulado, novos):
+    """Acumula os frames de dimensão de um novo lote, mantendo a primeira ocorrência de cada código"""
+    if not acumulado:
+        return novos
+    
+    merged = {}
+    for table, (key, _, _) in DIMENSOES.items():
+        merged[table] = pd.concat([acumulado[table], novos[table]], ignore_index=True).drop_duplicates(subset=[key])
+    return merged
+
+def _upsert_dimension(conn, table, frame, columns, key_column='codigo'):
+    """Insere uma dimensão com executemany e retorna o mapa código -> id"""
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(f"""
+        INSERT OR IGNORE INTO {table} ({', '.join(columns)}) 
+        VALUES ({placeholders})
+    """, to_records(frame))
+    return load_id_map(conn, table, key_column)
+
+def upsert_dimensions(conn, frames):
+    """Insere as dez tabelas de lookup em lote
+    
+    Recebe os frames de ``dimension_frames`` e retorna um dicionário
+    ``{tabela: {codigo: id}}`` reutilizado pela carga de materiais e estoque
+    sem novas consultas ao SQLite. A transação fica a cargo de quem chama.
+    """
+    id_maps = {}
+    
+    # Períodos (ano/mes também são corrigidos em períodos já existentes)
+    periodos = frames['periodos']
+    ano, mes = parse_periodos(periodos['periodo'])
+    periodos = periodos.assign(ano=ano, mes=mes)
+    id_maps['periodos'] = _upsert_dimension(conn, 'periodos', periodos, ['periodo', 'ano', 'mes'],
+                                            key_column='periodo')
+    conn.executemany("UPDATE periodos SET ano = ?, mes = ? WHERE periodo = ?",
+                     to_records(periodos[['ano', 'mes', 'periodo']]))
+    
+    # Famílias e grupos de materiais (o grupo referencia o id da família)
+    id_maps['familias'] = _upsert_dimension(conn, 'familias', frames['familias'], ['codigo', 'descricao'])
+    
+    grupos = frames['grupos_materiais']
+    grupos = grupos.assign(cod_familia=int_key(grupos['cod_familia']).map(id_maps['familias']))
+    id_maps['grupos_materiais'] = _upsert_dimension(conn, 'grupos_materiais', grupos,
+                                                    ['codigo', 'descricao', 'familia_id'])
+    
+    # Localizações guardam o código (não o id) do almoxarifado
+    localizacoes = frames['localizacoes']
+    localizacoes = localizacoes.assign(cod_almoxarifado=int_key(localizacoes['cod_almoxarifado']))
+    id_maps['localizacoes'] = _upsert_dimension(conn, 'localizacoes', localizacoes,
+                                                ['codigo', 'descricao', 'codigo_almoxarifado'])
+    
+    id_maps['classificacoes_fiscais'] = _upsert_dimension(conn, 'classificacoes_fiscais', frames['classificacoes_fiscais'],
+                                                          ['ncm', 'descricao'], key_column='ncm')
+    
+    # Demais dimensões (código, descrição)
+    for table in ['tipos_materiais', 'almoxarifados', 'classificacoes_sped', 'contas_contabeis', 'identificacoes']:
+        id_maps[table] = _upsert_dimension(conn, table, frames[table], ['codigo', 'descricao'])
+    
+    return id_maps
+
+SQL_INSERT_MATERIAIS = """
+    INSERT OR IGNORE INTO materiais 
+    (codigo, descricao, grupo_material_id, tipo_material_id, unidade, situacao,
+     controla_estoque_min, estoque_minimo, controla_estoque_max, estoque_maximo, curva_xyz)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Período dos registros de estoque sem período (linha de periodos criada pelo schema)
+PERIODO_AUSENTE = 0
+PERIODO_AUSENTE_CHAVE = '(sem período)'
+
+def period_key(values):
+    """Normaliza períodos com text_key, com os registros sem período na chave do PERIODO_AUSENTE
+    
+    Assim esses registros formam uma partição como as demais: têm hash,
+    entram no filtro da carga incremental e no staging, e o id 0 sai do mapa
+    de períodos.
+    """
+    return text_key(values).fillna(PERIODO_AUSENTE_CHAVE)
+
+SQL_INSERT_ESTOQUE = """
+    INSERT INTO estoque 
+    (periodo_id, linha, material_id, localizacao_id, almoxarifado_id, classificacao_sped_id,
+     conta_contabil_id, classificacao_fiscal_id, identificacao_id, quantidade, custo_medio, valor_total)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Linhas de estoque_flat: o estoque com as descrições que o dashboard exibe
+SQL_ESTOQUE_FLAT = """
+    INSERT INTO estoque_flat
+    (cod_material, desc_material, unidade, familia, grupo, almoxarifado, periodo, ano, mes,
+     quantidade, custo_medio, valor_total)
+    SELECT m.codigo, m.descricao, m.unidade, f.descricao, g.descricao, a.descricao, p.periodo, p.ano, p.mes,
+           e.quantidade, e.custo_medio, e.valor_total
+    FROM estoque e
+    JOIN materiais m ON e.material_id = m.id
+    LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
+    LEFT JOIN familias f ON g.familia_id = f.id
+    LEFT JOIN almoxarifados a ON e.almoxarifado_id = a.id
+    LEFT JOIN periodos p ON e.periodo_id = p.id AND p.id <> 0
+"""
+
+def refresh_estoque_flat(conn, periodo_ids=None):
+    """Refaz a tabela desnormalizada estoque_flat a partir do estoque
+    
+    Com ``periodo_ids`` só as partições desses períodos são apagadas e
+    inseridas de novo (um INSERT ... SELECT por período); sem eles, a tabela
+    inteira. Como as dimensões só recebem códigos novos (INSERT OR IGNORE),
+    as linhas dos demais períodos continuam válidas. Os registros sem
+    período (PERIODO_AUSENTE) ficam com periodo NULL, como na tabela
+    inteira. A transação fica a cargo de quem chama. Retorna o número de
+    linhas inseridas.
+    """
+    if periodo_ids is None:
+        conn.execute("DELETE FROM estoque_flat")
+        return conn.execute(SQL_ESTOQUE_FLAT).rowcount
+    
+    inseridas = 0
+    for periodo_id in periodo_ids:
+        if int(periodo_id) == PERIODO_AUSENTE:
+            conn.execute("DELETE FROM estoque_flat WHERE periodo IS NULL")
+        else:
+            conn.execute("DELETE FROM estoque_flat WHERE periodo = (SELECT periodo FROM periodos WHERE id = ?)",
+                         (int(periodo_id),))
+        inseridas += conn.execute(SQL_ESTOQUE_FLAT + " WHERE e.periodo_id = ?", (int(periodo_id),)).rowcount
+    return inseridas
+
+# Resumos (rollups) do estoque: tabela -> INSERT ... SELECT agregado; {filtro} recebe o período
+SQL_RESUMOS = {
+    'resumo_periodo_material': """
+        INSERT INTO resumo_periodo_material
+        (periodo_id, material_id, almoxarifado_id, registros, quantidade, valor_total, soma_custo, registros_custo)
+        SELECT e.periodo_id, e.material_id, e.almoxarifado_id, COUNT(*), SUM(e.quantidade), SUM(e.valor_total),
+               SUM(e.custo_medio), COUNT(e.custo_medio)
+        FROM estoque e
+        {filtro}
+        GROUP BY e.periodo_id, e.material_id, e.almoxarifado_id
+    """,
+    'resumo_periodo_almoxarifado': """
+        INSERT INTO resumo_periodo_almoxarifado
+        (periodo_id, almoxarifado_id, total_materiais, registros, quantidade, valor_total, soma_custo, registros_custo)
+        SELECT e.periodo_id, e.almoxarifado_id, COUNT(DISTINCT e.material_id), COUNT(*), SUM(e.quantidade),
+               SUM(e.valor_total), SUM(e.custo_medio), COUNT(e.custo_medio)
+        FROM estoque e
+        {filtro}
+        GROUP BY e.periodo_id, e.almoxarifado_id
+    """,
+    'resumo_periodo_familia': """
+        INSERT INTO resumo_periodo_familia
+        (periodo_id, familia_id, total_materiais, registros, quantidade, valor_total, soma_custo, registros_custo)
+        SELECT e.periodo_id, g.familia_id, COUNT(DISTINCT e.material_id), COUNT(*), SUM(e.quantidade),
+               SUM(e.valor_total), SUM(e.custo_medio), COUNT(e.custo_medio)
+        FROM estoque e
+        JOIN materiais m ON e.material_id = m.id
+        LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
+        {filtro}
+        GROUP BY e.periodo_id, g.familia_id
+    """,
+}
+
+def refresh_resumos(conn, periodo_ids=None):
+    """Refaz os resumos por período (material, almoxarifado e família) a partir do estoque
+    
+    Mesmo esquema de refresh_estoque_flat: com ``periodo_ids`` só os grupos
+    desses períodos são apagados e agregados de novo, sem eles os resumos
+    inteiros. A transação fica a cargo de quem chama. Retorna o número de
+    grupos inseridos.
+    """
+    inseridos = 0
+    for tabela, sql in SQL_RESUMOS.items():
+        if periodo_ids is None:
+            conn.execute(f"DELETE FROM {tabela}")
+            inseridos += conn.execute(sql.format(filtro='')).rowcount
+            continue
+        
+        for periodo_id in periodo_ids:
+            conn.execute(f"DELETE FROM {tabela} WHERE periodo_id = ?", (int(periodo_id),))
+            inseridos += conn.execute(sql.format(filtro='WHERE e.periodo_id = ?'), (int(periodo_id),)).rowcount
+    return inseridos
+
+def ensure_derived_tables(conn):
+    """Garante estoque_flat e os resumos em bancos carregados antes de essas tabelas existirem
+    
+    Aplica o schema (só cria o que falta, migrando o estoque do layout
+    antigo) e monta por inteiro cada tabela derivada que estiver vazia com o
+    estoque já carregado. Retorna True se alguma foi montada.
+    """
+    apply_schema(conn)
+    
+    if not conn.execute("SELECT EXISTS (SELECT 1 FROM estoque)").fetchone()[0]:
+        return False
+    
+    montadas = False
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM estoque_flat)").fetchone()[0]:
+        linhas = refresh_estoque_flat(conn)
+        conn.commit()
+        logger.info(f"estoque_flat montada a partir do estoque existente: {linhas} registros")
+        montadas = True
+    
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM resumo_periodo_material)").fetchone()[0]:
+        grupos = refresh_resumos(conn)
+        conn.commit()
+        logger.info(f"Resumos montados a partir do estoque existente: {grupos} grupos")
+        montadas = True
+    return montadas
+
+def insert_materiais(conn, df, id_maps):
+    """Insere os materiais de ``df`` ainda ausentes de ``id_maps['materiais']``
+    
+    Vale a primeira ocorrência de cada código, como no INSERT OR IGNORE. Os ids
+    dos novos materiais são lidos de volta e acrescentados ao mapa.
+    """
+    material_ids = id_maps.setdefault('materiais', {})
+    
+    materiais = df[['cod_material', 'desc_material', 'cod_grupo_material',
+                    'cod_tipo_material', 'unidade', 'situacao', 'controla_est_min',
+                    'estoque_minimo', 'controla_est_max', 'estoque_maximo', 'curva_xyz']]
+    materiais = materiais.assign(cod_material=int_key(materiais['cod_material']))
+    materiais = materiais.dropna(subset=['cod_material']).drop_duplicates(subset=['cod_material'])
+    materiais = materiais[~materiais['cod_material'].isin(material_ids.keys())]
+    
+    if materiais.empty:
+        return 0
+    
+    materiais = materiais.assign(
+        cod_grupo_material=int_key(materiais['cod_grupo_material']).map(id_maps['grupos_materiais']),
+        cod_tipo_material=int_key(materiais['cod_tipo_material']).map(id_maps['tipos_materiais'])
+    )
+    conn.executemany(SQL_INSERT_MATERIAIS, to_records(materiais))
+    
+    # Ler de volta apenas os ids dos códigos novos
+    codigos = [int(codigo) for codigo in materiais['cod_material']]
+    for start in range(0, len(codigos), 500):
+        parte = codigos[start:start + 500]
+        material_ids.update(conn.execute(f"""
+            SELECT codigo, id FROM materiais WHERE codigo IN ({', '.join('?' * len(parte))})
+        """, parte).fetchall())
+    
+    return len(materiais)
+
+def estoque_frame(df, id_maps):
+    """Resolve as oito chaves estrangeiras do estoque com um Series.map por coluna"""
+    return pd.DataFrame({
+        'periodo_id': period_key(df['periodo']).map(id_maps['periodos']),
+        'material_id': int_key(df['cod_material']).map(id_maps['materiais']),
+        'localizacao_id': text_key(df['cod_localizacao']).map(id_maps['localizacoes']),
+        'almoxarifado_id': int_key(df['cod_almoxarifado']).map(id_maps['almoxarifados']),
+        'classificacao_sped_id': int_key(df['cod_classificacao_sped']).map(id_maps['classificacoes_sped']),
+        'conta_contabil_id': int_key(df['conta_contabil']).map(id_maps['contas_contabeis']),
+        'classificacao_fiscal_id': text_key(df['ncm']).map(id_maps['classificacoes_fiscais']),
+        'identificacao_id': int_key(df['cod_identificacao']).map(id_maps['identificacoes']),
+        'quantidade': df['quantidade'],
+        'custo_medio': df['custo_medio'],
+        'valor_total': df['vlr_total']
+    })
+
+def insert_estoque(conn, estoque):
+    """Insere os registros de ``estoque`` (saída de estoque_frame) numerando-os dentro do período
+    
+    O estoque é agrupado pela chave (periodo_id, linha): cada registro recebe
+    a linha seguinte à maior já gravada no seu período (lida do banco, então
+    uma transação desfeita não deixa lacunas a corrigir) e os registros sem
+    período ficam no PERIODO_AUSENTE. Os registros entram ordenados pela chave,
+    acrescentados ao fim de cada período.
+    """
+    if estoque.empty:
+        return
+    
+    periodos = estoque['periodo_id'].fillna(PERIODO_AUSENTE).astype('int64')
+    ultimas = {periodo: conn.execute("SELECT COALESCE(MAX(linha), 0) FROM estoque WHERE periodo_id = ?",
+                                     (int(periodo),)).fetchone()[0]
+               for periodo in periodos.unique()}
+    linhas = periodos.map(ultimas) + periodos.groupby(periodos).cumcount() + 1
+    
+    registros = estoque.assign(periodo_id=periodos)
+    registros.insert(1, 'linha', linhas)
+    conn.executemany(SQL_INSERT_ESTOQUE, to_records(registros.sort_values(['periodo_id', 'linha'])))
+
+def estoque_layout_antigo(conn):
+    """Indica se o banco tem o estoque no layout antigo (id AUTOINCREMENT e created_at por registro)"""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'estoque'").fetchone()
+    return sql is not None and 'WITHOUT ROWID' not in sql[0].upper()
+
+# Schema do banco, ao lado deste módulo (e não no diretório de trabalho)
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_schema.sql')
+
+def apply_schema(conn):
+    """Aplica o database_schema.sql (só cria o que falta), migrando o estoque do layout antigo
+    
+    No layout antigo, o estoque é renomeado, a tabela compacta é criada pelo
+    schema e os registros são copiados agrupados por período, com o id antigo
+    como linha (único, então também único dentro do período). Tudo em uma
+    transação: uma falha deixa o banco como estava.
+    """
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+    
+    migrar = estoque_layout_antigo(conn)
+    conn.commit()
+    conn.execute("BEGIN")
+    try:
+        if migrar:
+            conn.execute("ALTER TABLE estoque RENAME TO estoque_layout_antigo")
+        
+        # Executar schema em partes (execute aceita um comando por vez)
+        for statement in schema.split(';'):
+            statement = statement.strip()
+            if statement:
+                conn.execute(statement)
+        
+        if migrar:
+            registros = conn.execute("""
+                INSERT INTO estoque
+                (periodo_id, linha, material_id, localizacao_id, almoxarifado_id, classificacao_sped_id,
+                 conta_contabil_id, classificacao_fiscal_id, identificacao_id, quantidade, custo_medio, valor_total)
+                SELECT COALESCE(periodo_id, 0), id, material_id, localizacao_id, almoxarifado_id,
+                       classificacao_sped_id, conta_contabil_id, classificacao_fiscal_id, identificacao_id,
+                       quantidade, custo_medio, valor_total
+                FROM estoque_layout_antigo
+                ORDER BY COALESCE(periodo_id, 0), id
+            """).rowcount
+            conn.execute("DROP TABLE estoque_layout_antigo")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    if migrar:
+        logger.info(f"Estoque migrado para o layout compacto: {registros} registros")
+    return migrar
+
+# Perfis de carga: PRAGMAs aplicados durante a ingestão ('seguro' mantém os padrões do SQLite)
+PERFIS_CARGA = {
+    'seguro': {},
+    'rapido': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -262144, 'temp_store': 'MEMORY'},
+    'maximo': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -524288, 'temp_store': 'MEMORY'},
+}
+
+# Colunas necessárias para o hash de conteúdo de um período
+COLUNAS_HASH = ['periodo', 'cod_material', 'desc_material', 'cod_almoxarifado', 'cod_localizacao', 'cod_classificacao_sped',
+                'conta_contabil', 'ncm', 'cod_identificacao', 'quantidade', 'custo_medio', 'vlr_total']
+
+def hash_periodos(df):
+    """Calcula o hash de conteúdo de cada período de ``df``
+    
+    Cada linha é reduzida às colunas que definem o registro de estoque (chave
+    periodo/material/almoxarifado/localização, demais chaves e valores) já
+    normalizadas, e o hash do período é a soma dos hashes das linhas. Entram
+    só as linhas que a limpeza dos dois processadores mantém (com código e
+    descrição do material), seja ``df`` o arquivo bruto ou os dados já limpos;
+    as linhas sem período ficam na partição do PERIODO_AUSENTE. Assim o resultado não depende da ordem das linhas, do parser nem do
+    processador, e pode ser acumulado lote a lote com merge_hashes.
+    
+    Retorna ``{periodo: (soma, registros)}``.
+    """
+    frame = pd.DataFrame({
+        'cod_material': int_key(df['cod_material']),
+        'cod_almoxarifado': int_key(df['cod_almoxarifado']),
+        'cod_localizacao': text_key(df['cod_localizacao']).astype(object),
+        'cod_classificacao_sped': int_key(df['cod_classificacao_sped']),
+        'conta_contabil': int_key(df['conta_contabil']),
+        'ncm': text_key(df['ncm']).astype(object),
+        'cod_identificacao': int_key(df['cod_identificacao']),
+        'quantidade': pd.to_numeric(df['quantidade'], errors='coerce').astype(float).round(6),
+        'custo_medio': pd.to_numeric(df['custo_medio'], errors='coerce').astype(float).round(6),
+        'vlr_total': pd.to_numeric(df['vlr_total'], errors='coerce').astype(float).round(6),
+    })
+    periodos = period_key(df['periodo']).astype(object)
+    
+    # Linhas sem código ou descrição do material são descartadas pela limpeza de ambos os processadores
+    validas = frame['cod_material'].notna().to_numpy() & df['desc_material'].notna().to_numpy()
+    frame, periodos = frame[validas], periodos[validas]
+    
+    linhas = pd.util.hash_pandas_object(frame, index=False)
+    agregado = linhas.groupby(periodos.to_numpy()).agg(['sum', 'count'])
+    return {periodo: (int(soma), int(registros))
+            for periodo, soma, registros in agregado.itertuples(name=None)}
+
+def merge_hashes(acumulado, novos):
+    """Soma os hashes de períodos de um novo lote aos já acumulados"""
+    for periodo, (soma, registros) in novos.items():
+        soma_anterior, registros_anteriores = acumulado.get(periodo, (0, 0))
+        acumulado[periodo] = ((soma_anterior + soma) % (1 << 64), registros_anteriores + registros)
+    return acumulado
+
+def _hash_texto(soma, registros):
+    return f"{soma:016x}-{registros}"
+
+def changed_periods(conn, hashes):
+    """Retorna os períodos de ``hashes`` novos ou com conteúdo diferente do já carregado"""
+    carregados = dict(conn.execute("""
+        SELECT p.periodo, c.hash FROM cargas_periodos c JOIN periodos p ON p.id = c.periodo_id
+    """).fetchall())
+    return [periodo for periodo, valor in hashes.items() if carregados.get(periodo) != _hash_texto(*valor)]
+
+def delete_periods(conn, periodo_ids):
+    """Remove do estoque as partições (períodos) que serão recarregadas"""
+    conn.executemany("DELETE FROM estoque WHERE periodo_id = ?", [(periodo_id,) for periodo_id in periodo_ids])
+
+def record_period_hashes(conn, hashes, periodo_ids):
+    """Registra o hash de conteúdo dos períodos carregados"""
+    conn.executemany("""
+        INSERT OR REPLACE INTO cargas_periodos (periodo_id, hash, registros, carregado_em)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    """, [(periodo_ids[periodo], _hash_texto(soma, registros), registros)
+          for periodo, (soma, registros) in hashes.items() if periodo in periodo_ids])
+
+def begin_incremental_load(conn, hashes, periodo_ids):
+    """Prepara uma carga incremental: remove do estoque os períodos novos ou alterados
+    
+    Retorna o subconjunto de ``hashes`` que será carregado e os ids desses
+    períodos. Os demais já estão no banco com o mesmo conteúdo e são pulados.
+    """
+    alterados = {periodo: hashes[periodo] for periodo in changed_periods(conn, hashes)}
+    ids = {periodo_ids[periodo] for periodo in alterados if periodo in periodo_ids}
+    delete_periods(conn, ids)
+    logger.info(f"Carga incremental: {len(alterados)} de {len(hashes)} períodos novos ou alterados, "
+                f"{len(hashes) - len(alterados)} inalterados pulados")
+    return alterados, ids
+
+def forget_period_hashes(conn, periodo_ids):
+    """Invalida o hash dos períodos que receberam linhas sem controle (modo de acréscimo)"""
+    conn.executemany("DELETE FROM cargas_periodos WHERE periodo_id = ?", [(periodo_id,) for periodo_id in periodo_ids])
+
+class CargaSQLite:
+    """Perfil de carga em lote para uma conexão SQLite
+    
+    Aplica os PRAGMAs do perfil e controla as transações explicitamente
+    (BEGIN/COMMIT a cada ``linhas_por_transacao`` registros, ou uma única
+    transação se ``linhas_por_transacao`` for None). Ao sair,
+    confirma a transação pendente (ou desfaz, em caso de erro ou de uma carga
+    marcada com falhar) e restaura os valores originais dos PRAGMAs.
+    """
+    
+    def __init__(self, conn, perfil='rapido', linhas_por_transacao=100000):
+        if perfil not in PERFIS_CARGA:
+            raise ValueError(f"Perfil de carga inválido: {perfil} (use {', '.join(PERFIS_CARGA)})")
+        self.conn = conn
+        self.perfil = perfil
+        self.linhas_por_transacao = linhas_por_transacao
+        self.pendentes = 0
+        self.falhou = False
+        self._originais = {}
+        self._isolation_level = None
+    
+    def __enter__(self):
+        self.conn.commit()
+        self._isolation_level = self.conn.isolation_level
+        self.conn.isolation_level = None
+        
+        for nome, valor in PERFIS_CARGA[self.perfil].items():
+            self._originais[nome] = self.conn.execute(f"PRAGMA {nome}").fetchone()[0]
+            self.conn.execute(f"PRAGMA {nome} = {valor}")
+        
+        if PERFIS_CARGA[self.perfil]:
+            logger.info(f"Perfil de carga '{self.perfil}': " +
+                        ", ".join(f"{nome}={valor}" for nome, valor in PERFIS_CARGA[self.perfil].items()))
+        
+        self.conn.execute("BEGIN")
+        return self
+    
+    def registrar(self, linhas):
+        """Conta registros gravados e confirma a transação ao atingir o limite"""
+        self.pendentes += linhas
+        if self.linhas_por_transacao and self.pendentes >= self.linhas_por_transacao:
+            self.commit()
+    
+    def commit(self):
+        """Confirma a transação atual e abre a próxima"""
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+        self.conn.execute("BEGIN")
+        self.pendentes = 0
+    
+    def falhar(self):
+        """Marca a carga como falha: ao sair, a transação pendente é desfeita em vez de confirmada"""
+        self.falhou = True
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn.in_transaction:
+            self.conn.execute("ROLLBACK" if exc_type or self.falhou else "COMMIT")
+        
+        # Restaurar os PRAGMAs (journal_mode por último, fora de transação)
+        for nome, valor in sorted(self._originais.items(), key=lambda item: item[0] == 'journal_mode'):
+            self.conn.execute(f"PRAGMA {nome} = {valor}")
+        
+        self.conn.isolation_level = self._isolation_level
+        return False
+
+class MedidorFases:
+    """Mede tempo e vazão (registros/s) de cada fase da ingestão"""
+    
+    def __init__(self):
+        self.resultados = {}
+    
+    @contextmanager
+    def fase(self, nome):
+        """Cronometra uma fase; quem chama informa os registros em ``fase['linhas']``
+        
+        Fases com o mesmo nome acumulam tempo e registros.
+        """
+        fase = {'linhas': 0}
+        inicio = time.perf_counter()
+        try:
+            yield fase
+        finally:
+            resultado = self.resultados.setdefault(nome, {'linhas': 0, 'segundos': 0.0})
+            resultado['linhas'] += fase['linhas']
+            resultado['segundos'] += time.perf_counter() - inicio
+            resultado['linhas_por_segundo'] = (
+                resultado['linhas'] / resultado['segundos'] if resultado['segundos'] else 0.0)
+    
+    def log_resumo(self):
+        """Registra no log a vazão de cada fase"""
+        for nome, resultado in self.resultados.items():
+            logger.info(f"Fase {nome}: {resultado['linhas']} registros em {resultado['segundos']:.2f}s "
+                        f"({resultado['linhas_por_segundo']:,.0f} registros/s)")
+
+def drop_secondary_indexes(conn):
+    """Remove os índices do schema (não os automáticos de UNIQUE) e retorna seus CREATE INDEX"""
+    indices = conn.execute("""
+        SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL
+    """).fetchall()
+    for nome, _ in indices:
+        conn.execute(f"DROP INDEX IF EXISTS {nome}")
+    return indices
+
+def rebuild_indexes(conn, indices, perfil='rapido'):
+    """Recria os índices removidos por drop_secondary_indexes e atualiza as estatísticas"""
+    with CargaSQLite(conn, perfil):
+        for _, sql in indices:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+
+def begin_full_reload(conn):
+    """Prepara uma recarga completa: remove os índices secundários e esvazia o estoque
+    
+    Sem os índices, cada INSERT no estoque deixa de manter as B-trees deles; eles
+    são recriados uma única vez por rebuild_indexes ao final da carga.
+    """
+    indices = drop_secondary_indexes(conn)
+    conn.execute("DELETE FROM estoque")
+    conn.execute("DELETE FROM estoque_flat")
+    for tabela in SQL_RESUMOS:
+        conn.execute(f"DELETE FROM {tabela}")
+    conn.execute("DELETE FROM cargas_periodos")
+    logger.info(f"Recarga completa: estoque esvaziado e {len(indices)} índices adiados")
+    return indices
+
+# Regras da validação (dry-run): regra -> descrição exibida no relatório
+REGRAS_VALIDACAO = {
+    'cabecalho': 'Cabeçalho com número de colunas diferente do Database.csv',
+    'tipo_numerico': 'Texto em coluna numérica',
+    'periodo_invalido': 'Período vazio ou fora dos formatos jan/23, 01/23 ou 2023-01',
+    'custo_negativo': 'Custo médio negativo',
+    'valor_total_divergente': 'Vlr. Total diferente de quantidade × custo médio',
+    'codigo_orfao': 'Código sem descrição (ou descrição sem código), sem material ou sem o código pai',
+}
+
+# Vlr. Total aceito: um centavo mais o arredondamento do custo médio (4 casas) multiplicado pela quantidade
+TOLERANCIA_VALOR_TOTAL = 0.01
+TOLERANCIA_CUSTO_MEDIO = 0.00005
+
+# Colunas exibidas nas amostras de cada regra, além da linha do arquivo
+COLUNAS_AMOSTRA = {
+    'tipo_numerico': COLUNAS_NUMERICAS,
+    'periodo_invalido': ['periodo'],
+    'custo_negativo': ['cod_material', 'desc_material', 'custo_medio'],
+    'valor_total_divergente': ['cod_material', 'quantidade', 'custo_medio', 'vlr_total'],
+    'codigo_orfao': list(dict.fromkeys(col for key, _, cols in DIMENSOES.values() for col in (key, *cols)
+                                       if col != 'periodo')) + ['cod_material', 'desc_material'],
+}
+
+# Colunas lidas pela validação (as demais não entram em nenhuma regra)
+COLUNAS_VALIDACAO = [col for col in COLUNAS if col in {'periodo', 'desc_material', *COLUNAS_NUMERICAS}
+                     or any(col in (key, *cols) for key, _, cols in DIMENSOES.values())]
+
+def _campos_vazios(values):
+    """Máscara de valores ausentes ou só com espaços"""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.isna().to_numpy(dtype=bool)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Testar só as categorias; o código -1 (ausente) cai no True acrescentado ao final
+        vazias = np.append(values.cat.categories.astype(str).str.strip() == '', True)
+        return vazias[values.cat.codes.to_numpy()]
+    return (values.isna() | (values.str.strip() == '')).to_numpy(dtype=bool)
+
+def validation_masks(chunk):
+    """Aplica as regras de validação a um chunk lido por read_database_csv
+    
+    Retorna ``{regra: máscara booleana}`` com uma posição por linha. Cada
+    regra é uma operação vetorizada sobre colunas inteiras: nenhuma linha é
+    percorrida em Python.
+    """
+    mascaras = {}
+    
+    # Colunas numéricas que o parser deixou como texto por conter valores inválidos
+    numericos = {}
+    invalidos = np.zeros(len(chunk), dtype=bool)
+    for col in COLUNAS_NUMERICAS:
+        valores = chunk[col]
+        if not pd.api.types.is_numeric_dtype(valores):
+            convertidos = pd.to_numeric(valores.astype(str).str.replace(',', '.'), errors='coerce')
+            invalidos |= (convertidos.isna() & ~_campos_vazios(valores)).to_numpy(dtype=bool)
+            valores = convertidos
+        numericos[col] = valores.astype('float64').to_numpy()
+    mascaras['tipo_numerico'] = invalidos
+    
+    ano, _ = period_calendar(chunk['periodo'])
+    mascaras['periodo_invalido'] = ano.isna().to_numpy(dtype=bool)
+    
+    quantidade, custo, total = numericos['quantidade'], numericos['custo_medio'], numericos['vlr_total']
+    mascaras['custo_negativo'] = custo < 0
+    tolerancia = TOLERANCIA_VALOR_TOTAL + np.abs(quantidade) * TOLERANCIA_CUSTO_MEDIO
+    with np.errstate(invalid='ignore'):
+        # Comparações com NaN são falsas: linhas sem algum dos três valores não divergem
+        mascaras['valor_total_divergente'] = np.abs(total - quantidade * custo) > tolerancia
+    
+    # Código e descrição de cada dimensão andam juntos; grupos e localizações exigem o código pai
+    orfaos = _campos_vazios(chunk['cod_material']) | _campos_vazios(chunk['desc_material'])
+    for key, _, columns in DIMENSOES.values():
+        if key == 'periodo':
+            continue
+        sem_codigo = _campos_vazios(chunk[key])
+        for col in columns:
+            orfaos |= sem_codigo != _campos_vazios(chunk[col])
+    mascaras['codigo_orfao'] = orfaos
+    
+    return mascaras
+
+class RelatorioValidacao:
+    """Acumula, lote a lote, as ocorrências de cada regra e algumas linhas de exemplo"""
+    
+    def __init__(self, amostra=5):
+        self.amostra = amostra
+        self.linhas = 0
+        self.segundos = 0.0
+        self.ocorrencias = dict.fromkeys(REGRAS_VALIDACAO, 0)
+        self.amostras = {regra: [] for regra in REGRAS_VALIDACAO}
+    
+    def registrar(self, chunk, mascaras):
+        """Soma as ocorrências de um chunk e guarda as primeiras linhas de cada regra
+        
+        A coluna ``linha`` das amostras é a linha do arquivo (o cabeçalho é a 1).
+        """
+        for regra, mascara in mascaras.items():
+            total = int(mascara.sum())
+            if not total:
+                continue
+            self.ocorrencias[regra] += total
+            faltam = self.amostra - sum(len(frame) for frame in self.amostras[regra])
+            if faltam > 0:
+                posicoes = np.flatnonzero(mascara)[:faltam]
+                frame = chunk.iloc[posicoes][COLUNAS_AMOSTRA[regra]].astype(object)
+                frame.insert(0, 'linha', self.linhas + posicoes + 2)
+                self.amostras[regra].append(frame.reset_index(drop=True))
+        self.linhas += len(chunk)
+    
+    def registrar_cabecalho(self, colunas):
+        """Registra um cabeçalho com ``colunas`` campos em vez dos 32 esperados"""
+        self.ocorrencias['cabecalho'] += 1
+        self.amostras['cabecalho'].append(pd.DataFrame({'linha': [1], 'colunas': [colunas],
+                                                        'esperadas': [len(COLUNAS)]}))
+    
+    @property
+    def valido(self):
+        """True se nenhuma regra teve ocorrências"""
+        return not any(self.ocorrencias.values())
+    
+    def resumo(self):
+        """DataFrame com a descrição e o número de ocorrências de cada regra"""
+        return pd.DataFrame({
+            'regra': list(REGRAS_VALIDACAO),
+            'descricao': list(REGRAS_VALIDACAO.values()),
+            'ocorrencias': [self.ocorrencias[regra] for regra in REGRAS_VALIDACAO],
+        })
+    
+    def exemplos(self, regra):
+        """Linhas de exemplo de uma regra (DataFrame vazio se não houver)"""
+        frames = self.amostras[regra]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    
+    def log_resumo(self):
+        """Registra no log o resultado de cada regra"""
+        logger.info(f"Validação: {self.linhas} registros em {self.segundos:.2f}s "
+                    f"({self.linhas / self.segundos if self.segundos else 0.0:,.0f} registros/s)")
+        for regra, total in self.ocorrencias.items():
+            if total:
+                logger.warning(f"Regra {regra}: {total} ocorrências ({REGRAS_VALIDACAO[regra]})")
+        if self.valido:
+            logger.info("Nenhum problema encontrado")
+
+def _colunas_cabecalho(path, dialeto):
+    """Número de campos do cabeçalho de um CSV (None para planilhas)"""
+    if excel_format(path):
+        return None
+    compactacao = detect_compression(path)
+    with open_compressed(path, compactacao) if compactacao else _open_binary(path) as f:
+        cabecalho = f.readline().decode(dialeto.get('encoding', 'latin-1'), errors='replace')
+    return len(cabecalho.rstrip('\r\n').split(dialeto.get('sep', ';')))
+
+def validate_file(path, engine='c', chunksize=200000, amostra=5, memory_map=False):
+    """Valida um arquivo inteiro, lote a lote, sem gravar nada no banco (dry-run)
+    
+    O arquivo (caminho ou bytes, CSV, compactado ou .xlsx) é lido com
+    read_database_csv e cada lote passa por validation_masks. Retorna um
+    RelatorioValidacao com as ocorrências por regra e as linhas de exemplo;
+    um cabeçalho com outro número de colunas interrompe a validação.
+    """
+    relatorio = RelatorioValidacao(amostra)
+    inicio = time.perf_counter()
+    
+    dialeto = csv_dialect(path)
+    colunas = _colunas_cabecalho(path, dialeto)
+    if colunas is not None and colunas != len(COLUNAS):
+        relatorio.registrar_cabecalho(colunas)
+    else:
+        leitura = read_database_csv(path, engine='c' if dialeto else engine, chunksize=chunksize,
+                                    usecols=COLUNAS_VALIDACAO, memory_map=memory_map, low_memory=False,
+                                    **dialeto)
+        for chunk in leitura:
+            relatorio.registrar(chunk, validation_masks(chunk))
+    
+    relatorio.segundos = time.perf_counter() - inicio
+    relatorio.log_resumo()
+    return relatorio
+
 class AlmoxarifadoDataProcessor:
-    def __init__(self, csv_file_path, db_path="almoxarifado.db"):
+    def __init__(self, csv_file_path, db_path="almoxarifado.db", batch_size=100000, engine='c',
+                 perfil_carga='rapido', recarga_completa=False, incremental=False, memory_map=False, staging=None):
+        if recarga_completa and incremental:
+            raise ValueError("recarga_completa e incremental são modos exclusivos")
         self.csv_file_path = csv_file_path
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.engine = engine
+        self.perfil_carga = perfil_carga
+        self.recarga_completa = recarga_completa
+        self.incremental = incremental
+        self.memory_map = memory_map
+        self.staging_dir = staging
+        self.staging = None
+        self.periodos_carregados = None
         self.df = None
         self.conn = None
+        self.carga = None
+        self.metricas = MedidorFases()
+        self.id_maps = {}
         
     def load_csv_data(self):
         """Carrega e processa o arquivo CSV"""
         logger.info(f"Carregando dados do arquivo: {self.csv_file_path}")
         
         try:
-            # Carregar CSV com encoding correto
-            self.df = pd.read_csv(
-                self.csv_file_path, 
-                sep=';', 
-                encoding='latin-1',
-                low_memory=False
-            )
+            # Carregar CSV com encoding correto, nomes e tipos declarados
+            dialeto = csv_dialect(self.csv_file_path)
+            self.df = read_database_csv(self.csv_file_path, engine='c' if dialeto else self.engine,
+                                        memory_map=self.memory_map, low_memory=False, **dialeto)
             
             logger.info(f"Dados carregados: {len(self.df)} registros, {len(self.df.columns)} colunas")
             
-            # Renomear colunas para facilitar o processamento
-            self.df.columns = [
-                'periodo', 'cod_familia', 'desc_familia', 'cod_grupo_material', 'desc_grupo_material',
-                'cod_material', 'desc_material', 'cod_tipo_material', 'desc_tipo_material', 'situacao',
-                'localizacao', 'desc_localizacao', 'cod_localizacao', 'cod_almoxarifado', 'desc_almoxarifado',
-                'unidade', 'quantidade', 'custo_medio', 'vlr_total', 'cod_classificacao_sped',
-                'desc_classificacao_sped', 'controla_est_min', 'estoque_minimo', 'controla_est_max',
-                'estoque_maximo', 'conta_contabil', 'desc_conta_contabil', 'ncm', 'desc_classificacao_fiscal',
-                'cod_identificacao', 'desc_identificacao', 'curva_xyz'
-            ]
-            
             return True
             
         except Exception as e:
@@ -58,19 +1498,11 @@ class AlmoxarifadoDataProcessor:
         logger.info("Iniciando limpeza dos dados...")
         
         # Converter período para formato padrão
-        self.df['periodo'] = self.df['periodo'].astype(str)
+        if not isinstance(self.df['periodo'].dtype, pd.CategoricalDtype):
+            self.df['periodo'] = self.df['periodo'].astype(str)
         
         # Limpar valores numéricos
-        numeric_columns = ['cod_familia', 'cod_grupo_material', 'cod_material', 'cod_tipo_material',
-                          'cod_almoxarifado', 'quantidade', 'custo_medio', 'vlr_total',
-                          'cod_classificacao_sped', 'estoque_minimo', 'estoque_maximo',
-                          'conta_contabil', 'cod_identificacao']
-        
-        for col in numeric_columns:
-            if col in self.df.columns:
-                # Substituir vírgulas por pontos e converter para numérico
-                self.df[col] = self.df[col].astype(str).str.replace(',', '.')
-                self.df[col] = pd.to_numeric(self.df[col], errors='coerce')
+        convert_numeric(self.df)
         
         # Limpar strings
         string_columns = ['desc_familia', 'desc_grupo_material', 'desc_material', 'desc_tipo_material',
@@ -79,8 +1511,7 @@ class AlmoxarifadoDataProcessor:
         
         for col in string_columns:
             if col in self.df.columns:
-                self.df[col] = self.df[col].astype(str).str.strip().str.upper()
-                self.df[col] = self.df[col].replace('NAN', '')
+                self.df[col] = clean_text(self.df[col])
         
         # Converter booleanos
         self.df['controla_est_min'] = self.df['controla_est_min'].map({'Sim': True, 'Não': False, 'NÃO': False})
@@ -97,6 +1528,43 @@ class AlmoxarifadoDataProcessor:
         logger.info(f"Limpeza concluída. Registros restantes: {len(self.df)}")
         return True
     
+    def load_staged_data(self):
+        """Carrega os dados já limpos do staging em Parquet, se houver
+        
+        Retorna False sem staging pedido ou ainda não gravado para este
+        arquivo; nesse caso o CSV é lido e limpo normalmente.
+        """
+        if not self.staging_dir:
+            return False
+        
+        self.staging = open_staging(self.staging_dir, file_hash(self.csv_file_path), 'legado')
+        if self.staging is None or not self.staging.pronto:
+            return False
+        
+        with self.metricas.fase('staging') as fase:
+            self.df = self.staging.ler()
+            fase['linhas'] = len(self.df)
+        logger.info(f"Dados carregados do staging (sem parsing do CSV nem limpeza): {len(self.df)} registros")
+        return True
+    
+    def stage_data(self, linhas_lidas):
+        """Grava os dados limpos no staging em Parquet, se pedido
+        
+        O staging é só um cache: uma falha ao gravá-lo é registrada e a carga
+        continua a partir dos dados em memória.
+        """
+        if self.staging is None:
+            return
+        
+        try:
+            with self.metricas.fase('staging') as fase:
+                self.staging.iniciar()
+                self.staging.gravar(self.df, linhas_lidas)
+                self.staging.concluir()
+                fase['linhas'] = len(self.df)
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar o staging: {e}")
+    
     def create_database_connection(self):
         """Cria conexão com o banco de dados"""
         try:
@@ -108,19 +1576,17 @@ class AlmoxarifadoDataProcessor:
             return False
     
     def create_tables(self):
-        """Cria as tabelas no banco de dados"""
+        """Cria as tabelas no banco de dados
+        
+        Fora da recarga completa (que esvazia as tabelas derivadas), um banco
+        carregado antes de estoque_flat e dos resumos existirem tem o estoque
+        migrado e essas tabelas montadas aqui, antes da carga.
+        """
         try:
-            with open('database_schema.sql', 'r', encoding='utf-8') as f:
-                schema = f.read()
-            
-            # Executar schema em partes (SQLite não suporta múltiplas statements)
-            statements = schema.split(';')
-            for statement in statements:
-                statement = statement.strip()
-                if statement:
-                    self.conn.execute(statement)
-            
-            self.conn.commit()
+            if self.recarga_completa:
+                apply_schema(self.conn)
+            else:
+                ensure_derived_tables(self.conn)
             logger.info("Tabelas criadas com sucesso")
             return True
             
@@ -128,118 +1594,25 @@ class AlmoxarifadoDataProcessor:
             logger.error(f"Erro ao criar tabelas: {e}")
             return False
     
+    def upsert_dimensions(self):
+        """Insere as tabelas de lookup e retorna os mapas ``{tabela: {codigo: id}}``"""
+        self.id_maps = upsert_dimensions(self.conn, dimension_frames(self.df))
+        return self.id_maps
+    
+    def _confirmar(self, linhas=0):
+        """Confirma a transação, ou apenas registra as linhas se houver um perfil de carga ativo"""
+        if self.carga:
+            self.carga.registrar(linhas)
+        else:
+            self.conn.commit()
+    
     def insert_lookup_data(self):
         """Insere dados de lookup (tabelas de referência)"""
         logger.info("Inserindo dados de lookup...")
         
         try:
-            # Inserir períodos
-            periodos = self.df[['periodo']].drop_duplicates()
-            for _, row in periodos.iterrows():
-                periodo = row['periodo']
-                # Extrair ano e mês do período
-                try:
-                    if '/' in periodo:
-                        mes, ano = periodo.split('/')
-                        ano = int('20' + ano) if len(ano) == 2 else int(ano)
-                        mes = int(mes)
-                    else:
-                        ano = 2023
-                        mes = 1
-                except:
-                    ano = 2023
-                    mes = 1
-                
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO periodos (periodo, ano, mes) 
-                    VALUES (?, ?, ?)
-                """, (periodo, ano, mes))
-            
-            # Inserir famílias
-            familias = self.df[['cod_familia', 'desc_familia']].drop_duplicates()
-            for _, row in familias.iterrows():
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO familias (codigo, descricao) 
-                    VALUES (?, ?)
-                """, (int(row['cod_familia']), row['desc_familia']))
-            
-            # Inserir grupos de materiais
-            grupos = self.df[['cod_grupo_material', 'desc_grupo_material', 'cod_familia']].drop_duplicates()
-            for _, row in grupos.iterrows():
-                # Buscar ID da família
-                familia_id = self.conn.execute("""
-                    SELECT id FROM familias WHERE codigo = ?
-                """, (int(row['cod_familia']),)).fetchone()
-                
-                familia_id = familia_id[0] if familia_id else None
-                
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO grupos_materiais (codigo, descricao, familia_id) 
-                    VALUES (?, ?, ?)
-                """, (int(row['cod_grupo_material']), row['desc_grupo_material'], familia_id))
-            
-            # Inserir tipos de materiais
-            tipos = self.df[['cod_tipo_material', 'desc_tipo_material']].drop_duplicates()
-            for _, row in tipos.iterrows():
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO tipos_materiais (codigo, descricao) 
-                    VALUES (?, ?)
-                """, (int(row['cod_tipo_material']), row['desc_tipo_material']))
-            
-            # Inserir almoxarifados
-            almoxarifados = self.df[['cod_almoxarifado', 'desc_almoxarifado']].drop_duplicates()
-            for _, row in almoxarifados.iterrows():
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO almoxarifados (codigo, descricao) 
-                    VALUES (?, ?)
-                """, (int(row['cod_almoxarifado']), row['desc_almoxarifado']))
-            
-            # Inserir localizações
-            localizacoes = self.df[['cod_localizacao', 'desc_localizacao', 'cod_almoxarifado']].drop_duplicates()
-            for _, row in localizacoes.iterrows():
-                if pd.notna(row['cod_localizacao']):
-                    self.conn.execute("""
-                        INSERT OR IGNORE INTO localizacoes (codigo, descricao, codigo_almoxarifado) 
-                        VALUES (?, ?, ?)
-                    """, (str(row['cod_localizacao']), row['desc_localizacao'], int(row['cod_almoxarifado'])))
-            
-            # Inserir classificações SPED
-            speds = self.df[['cod_classificacao_sped', 'desc_classificacao_sped']].drop_duplicates()
-            for _, row in speds.iterrows():
-                if pd.notna(row['cod_classificacao_sped']):
-                    self.conn.execute("""
-                        INSERT OR IGNORE INTO classificacoes_sped (codigo, descricao) 
-                        VALUES (?, ?)
-                    """, (int(row['cod_classificacao_sped']), row['desc_classificacao_sped']))
-            
-            # Inserir contas contábeis
-            contas = self.df[['conta_contabil', 'desc_conta_contabil']].drop_duplicates()
-            for _, row in contas.iterrows():
-                if pd.notna(row['conta_contabil']):
-                    self.conn.execute("""
-                        INSERT OR IGNORE INTO contas_contabeis (codigo, descricao) 
-                        VALUES (?, ?)
-                    """, (int(row['conta_contabil']), row['desc_conta_contabil']))
-            
-            # Inserir classificações fiscais
-            fiscais = self.df[['ncm', 'desc_classificacao_fiscal']].drop_duplicates()
-            for _, row in fiscais.iterrows():
-                if pd.notna(row['ncm']):
-                    self.conn.execute("""
-                        INSERT OR IGNORE INTO classificacoes_fiscais (ncm, descricao) 
-                        VALUES (?, ?)
-                    """, (str(row['ncm']), row['desc_classificacao_fiscal']))
-            
-            # Inserir identificações
-            ids = self.df[['cod_identificacao', 'desc_identificacao']].drop_duplicates()
-            for _, row in ids.iterrows():
-                if pd.notna(row['cod_identificacao']):
-                    self.conn.execute("""
-                        INSERT OR IGNORE INTO identificacoes (codigo, descricao) 
-                        VALUES (?, ?)
-                    """, (int(row['cod_identificacao']), row['desc_identificacao']))
-            
-            self.conn.commit()
+            self.upsert_dimensions()
+            self._confirmar()
             logger.info("Dados de lookup inseridos com sucesso")
             return True
             
@@ -248,99 +1621,52 @@ class AlmoxarifadoDataProcessor:
             return False
     
     def insert_materials_and_stock(self):
-        """Insere materiais e dados de estoque"""
+        """Insere materiais e dados de estoque em lote
+        
+        Cada chave estrangeira é resolvida com um único dicionário código -> id
+        por coluna, e o estoque é gravado com executemany em transações de
+        ``batch_size`` registros (com um perfil de carga ativo, a cada
+        ``batch_size`` registros confirma-se a transação do perfil).
+        
+        No modo incremental só entram os períodos cujo hash de conteúdo mudou;
+        as partições antigas desses períodos são removidas antes.
+        """
         logger.info("Inserindo materiais e dados de estoque...")
         
         try:
+            if not self.id_maps:
+                self.id_maps = load_id_maps(self.conn)
+            
             # Inserir materiais
-            materiais = self.df[['cod_material', 'desc_material', 'cod_grupo_material', 
-                               'cod_tipo_material', 'unidade', 'situacao', 'controla_est_min',
-                               'estoque_minimo', 'controla_est_max', 'estoque_maximo', 'curva_xyz']].drop_duplicates()
+            insert_materiais(self.conn, self.df, self.id_maps)
+            self._confirmar()
             
-            for _, row in materiais.iterrows():
-                # Buscar IDs das tabelas relacionadas
-                grupo_id = self.conn.execute("""
-                    SELECT id FROM grupos_materiais WHERE codigo = ?
-                """, (int(row['cod_grupo_material']),)).fetchone()
-                grupo_id = grupo_id[0] if grupo_id else None
-                
-                tipo_id = self.conn.execute("""
-                    SELECT id FROM tipos_materiais WHERE codigo = ?
-                """, (int(row['cod_tipo_material']),)).fetchone()
-                tipo_id = tipo_id[0] if tipo_id else None
-                
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO materiais 
-                    (codigo, descricao, grupo_material_id, tipo_material_id, unidade, situacao,
-                     controla_estoque_min, estoque_minimo, controla_estoque_max, estoque_maximo, curva_xyz)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (int(row['cod_material']), row['desc_material'], grupo_id, tipo_id,
-                      row['unidade'], row['situacao'], row['controla_est_min'], row['estoque_minimo'],
-                      row['controla_est_max'], row['estoque_maximo'], row['curva_xyz']))
+            # Resolver todas as chaves estrangeiras do estoque de uma vez
+            estoque = estoque_frame(self.df, self.id_maps)
             
-            # Inserir dados de estoque
-            for _, row in self.df.iterrows():
-                # Buscar IDs das tabelas relacionadas
-                periodo_id = self.conn.execute("""
-                    SELECT id FROM periodos WHERE periodo = ?
-                """, (row['periodo'],)).fetchone()
-                periodo_id = periodo_id[0] if periodo_id else None
-                
-                material_id = self.conn.execute("""
-                    SELECT id FROM materiais WHERE codigo = ?
-                """, (int(row['cod_material']),)).fetchone()
-                material_id = material_id[0] if material_id else None
-                
-                localizacao_id = None
-                if pd.notna(row['cod_localizacao']):
-                    localizacao_id = self.conn.execute("""
-                        SELECT id FROM localizacoes WHERE codigo = ?
-                    """, (str(row['cod_localizacao']),)).fetchone()
-                    localizacao_id = localizacao_id[0] if localizacao_id else None
-                
-                almoxarifado_id = self.conn.execute("""
-                    SELECT id FROM almoxarifados WHERE codigo = ?
-                """, (int(row['cod_almoxarifado']),)).fetchone()
-                almoxarifado_id = almoxarifado_id[0] if almoxarifado_id else None
-                
-                classificacao_sped_id = None
-                if pd.notna(row['cod_classificacao_sped']):
-                    classificacao_sped_id = self.conn.execute("""
-                        SELECT id FROM classificacoes_sped WHERE codigo = ?
-                    """, (int(row['cod_classificacao_sped']),)).fetchone()
-                    classificacao_sped_id = classificacao_sped_id[0] if classificacao_sped_id else None
-                
-                conta_contabil_id = None
-                if pd.notna(row['conta_contabil']):
-                    conta_contabil_id = self.conn.execute("""
-                        SELECT id FROM contas_contabeis WHERE codigo = ?
-                    """, (int(row['conta_contabil']),)).fetchone()
-                    conta_contabil_id = conta_contabil_id[0] if conta_contabil_id else None
-                
-                classificacao_fiscal_id = None
-                if pd.notna(row['ncm']):
-                    classificacao_fiscal_id = self.conn.execute("""
-                        SELECT id FROM classificacoes_fiscais WHERE ncm = ?
-                    """, (str(row['ncm']),)).fetchone()
-                    classificacao_fiscal_id = classificacao_fiscal_id[0] if classificacao_fiscal_id else None
-                
-                identificacao_id = None
-                if pd.notna(row['cod_identificacao']):
-                    identificacao_id = self.conn.execute("""
-                        SELECT id FROM identificacoes WHERE codigo = ?
-                    """, (int(row['cod_identificacao']),)).fetchone()
-                    identificacao_id = identificacao_id[0] if identificacao_id else None
-                
-                self.conn.execute("""
-                    INSERT INTO estoque 
-                    (periodo_id, material_id, localizacao_id, almoxarifado_id, classificacao_sped_id,
-                     conta_contabil_id, classificacao_fiscal_id, identificacao_id, quantidade, custo_medio, valor_total)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (periodo_id, material_id, localizacao_id, almoxarifado_id, classificacao_sped_id,
-                      conta_contabil_id, classificacao_fiscal_id, identificacao_id, row['quantidade'],
-                      row['custo_medio'], row['vlr_total']))
+            hashes = hash_periodos(self.df) if self.incremental or self.recarga_completa else {}
+            if self.incremental:
+                hashes, ids = begin_incremental_load(self.conn, hashes, self.id_maps['periodos'])
+                estoque = estoque[estoque['periodo_id'].isin(ids)]
+            
+            # Inserir dados de estoque em transações grandes
+            total = len(estoque)
+            for start in range(0, total, self.batch_size):
+                lote = estoque.iloc[start:start + self.batch_size]
+                insert_estoque(self.conn, lote)
+                self._confirmar(len(lote))
+                logger.info(f"Estoque: {min(start + self.batch_size, total)}/{total} registros inseridos")
+            
+            self.periodos_carregados = (None if self.recarga_completa else
+                                        estoque['periodo_id'].fillna(PERIODO_AUSENTE).unique().tolist())
+            if hashes:
+                record_period_hashes(self.conn, hashes, self.id_maps['periodos'])
+            elif self.periodos_carregados is not None:
+                # Linhas acrescentadas sem controle: o hash desses períodos deixa de valer
+                # (na recarga completa os hashes já foram apagados por begin_full_reload)
+                forget_period_hashes(self.conn, self.periodos_carregados)
+            self._confirmar()
             
-            self.conn.commit()
             logger.info("Materiais e dados de estoque inseridos com sucesso")
             return True
             
@@ -352,11 +1678,18 @@ class AlmoxarifadoDataProcessor:
         """Executa todo o pipeline de processamento"""
         logger.info("Iniciando processamento completo dos dados...")
         
-        if not self.load_csv_data():
-            return False
-        
-        if not self.clean_data():
-            return False
+        if not self.load_staged_data():
+            with self.metricas.fase('leitura') as fase:
+                if not self.load_csv_data():
+                    return False
+                fase['linhas'] = linhas_lidas = len(self.df)
+            
+            with self.metricas.fase('limpeza') as fase:
+                if not self.clean_data():
+                    return False
+                fase['linhas'] = len(self.df)
+            
+            self.stage_data(linhas_lidas)
         
         if not self.create_database_connection():
             return False
@@ -364,21 +1697,80 @@ class AlmoxarifadoDataProcessor:
         if not self.create_tables():
             return False
         
-        if not self.insert_lookup_data():
-            return False
-        
-        if not self.insert_materials_and_stock():
-            return False
+        indices = []
+        try:
+            # A carga incremental substitui as partições em uma única transação
+            linhas_por_transacao = None if self.incremental else self.batch_size
+            with CargaSQLite(self.conn, self.perfil_carga, linhas_por_transacao) as self.carga:
+                if self.recarga_completa:
+                    indices = begin_full_reload(self.conn)
+                    self.carga.commit()
+                
+                with self.metricas.fase('lookups') as fase:
+                    if not self.insert_lookup_data():
+                        self.carga.falhar()
+                        return False
+                    fase['linhas'] = len(self.df)
+                
+                with self.metricas.fase('estoque') as fase:
+                    if not self.insert_materials_and_stock():
+                        # Desfazer também a remoção das partições da carga incremental
+                        self.carga.falhar()
+                        return False
+                    fase['linhas'] = len(self.df)
+                
+                with self.metricas.fase('estoque_flat') as fase:
+                    fase['linhas'] = refresh_estoque_flat(self.conn, self.periodos_carregados)
+                
+                with self.metricas.fase('resumos') as fase:
+                    fase['linhas'] = refresh_resumos(self.conn, self.periodos_carregados)
+        finally:
+            self.carga = None
+            self._rebuild_indexes(indices)
         
+        self.metricas.log_resumo()
         logger.info("Processamento concluído com sucesso!")
         return True
     
+    def _rebuild_indexes(self, indices):
+        """Recria os índices adiados pela recarga completa e roda ANALYZE"""
+        if not indices:
+            return
+        
+        with self.metricas.fase('indices') as fase:
+            rebuild_indexes(self.conn, indices, self.perfil_carga)
+            fase['linhas'] = self.conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]
+    
     def close_connection(self):
         """Fecha a conexão com o banco de dados"""
         if self.conn:
             self.conn.close()
             logger.info("Conexão com banco de dados fechada")
 
+def bootstrap_database(csv_file_path, db_path="almoxarifado.db", **kwargs):
+    """Monta um banco novo a partir de um CSV com o carregador em lote
+    
+    A carga é uma recarga completa com o perfil 'maximo' em ``db_path +
+    '.carga'``, arquivo que só substitui ``db_path`` ao final: uma falha no
+    meio não deixa um banco pela metade que seria tomado como pronto.
+    Retorna o número de registros de estoque carregados.
+    """
+    temporario = f"{db_path}.carga"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    
+    kwargs.setdefault('perfil_carga', 'maximo')
+    processor = AlmoxarifadoDataProcessor(csv_file_path, db_path=temporario, recarga_completa=True, **kwargs)
+    try:
+        if not processor.process_all():
+            raise RuntimeError(f"Não foi possível carregar {csv_file_path}")
+        registros = processor.conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]
+    finally:
+        processor.close_connection()
+    
+    os.replace(temporario, db_path)
+    return registros
+
 if __name__ == "__main__":
     processor = AlmoxarifadoDataProcessor("Database.csv")
     
@@ -3,23 +3,116 @@ Processador Otimizado de Dados do Almoxarifado
 Versão otimizada para processar grandes volumes de dados em lotes
 """
 
-import pandas as pd
 import sqlite3
-import numpy as np
-from datetime import datetime
 import logging
 import gc
+import argparse
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processor import (
+    COLUNAS, COLUNAS_HASH, DIMENSOES, PERIODO_AUSENTE, ArquivoMapeado, CargaSQLite, MedidorFases, apply_schema,
+    begin_full_reload, begin_incremental_load, can_memory_map, convert_numeric, dimension_frames,
+    drop_secondary_indexes, ensure_derived_tables, estoque_frame, excel_format, file_hash, forget_period_hashes,
+    in_memory, hash_periodos, insert_estoque, insert_materiais, load_id_maps, merge_dimension_frames,
+    merge_hashes, open_staging, period_key, read_database_csv, rebuild_indexes, record_period_hashes,
+    refresh_estoque_flat, refresh_resumos, upsert_dimensions, validate_file
+)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def process_chunk(chunk):
+    """Processa um chunk de dados
+    
+    Função de módulo (e não método) para poder ser executada nos processos
+    do pool de ``OptimizedAlmoxarifadoProcessor``.
+    """
+    # Renomear colunas
+    chunk.columns = COLUNAS
+    
+    # Limpar dados
+    chunk = chunk.dropna(subset=['cod_material', 'desc_material'])
+    
+    # Converter tipos de dados (só colunas que o parser não leu como número)
+    chunk = convert_numeric(chunk.copy())
+    
+    # Converter booleanos
+    chunk['controla_est_min'] = chunk['controla_est_min'].map({'Sim': True, 'Não': False, 'NÃO': False})
+    chunk['controla_est_max'] = chunk['controla_est_max'].map({'Sim': True, 'Não': False, 'NÃO': False})
+    
+    return chunk
+
+def count_and_process_chunk(chunk):
+    """Processa um chunk já lido, retornando também quantos registros foram lidos"""
+    return len(chunk), process_chunk(chunk)
+
+def process_mapped_range(path, engine, inicio, fim):
+    """Lê a faixa de bytes ``[inicio, fim)`` do arquivo mapeado em memória e a processa
+    
+    Executada nos processos do pool: cada um mapeia o arquivo e faz o parsing
+    da própria faixa, sem receber o chunk já lido pela thread leitora.
+    """
+    with ArquivoMapeado(path, engine) as arquivo:
+        chunk = arquivo.ler(inicio, fim)
+    return count_and_process_chunk(chunk)
+
+def load_checkpoint(conn, arquivo_hash):
+    """Retorna o último checkpoint confirmado de um arquivo, ou None"""
+    linha = conn.execute("""
+        SELECT lote, linhas_lidas, registros, concluido FROM checkpoints_carga WHERE arquivo_hash = ?
+    """, (arquivo_hash,)).fetchone()
+    if linha is None:
+        return None
+    return dict(zip(('lote', 'linhas_lidas', 'registros', 'concluido'), linha))
+
+def save_checkpoint(conn, arquivo_hash, arquivo, lote, linhas_lidas, registros, concluido=False):
+    """Grava o checkpoint de um arquivo na transação corrente
+    
+    Como o checkpoint é gravado junto com o lote, ele só passa a valer quando
+    a transação que contém o lote é confirmada.
+    """
+    conn.execute("""
+        INSERT OR REPLACE INTO checkpoints_carga
+            (arquivo_hash, arquivo, lote, linhas_lidas, registros, concluido, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (arquivo_hash, str(arquivo), lote, linhas_lidas, registros, concluido))
+
 class OptimizedAlmoxarifadoProcessor:
-    def __init__(self, csv_file_path, db_path="almoxarifado.db", batch_size=10000):
+    def __init__(self, csv_file_path, db_path="almoxarifado.db", batch_size=10000, workers=1, engine='c',
+                 perfil_carga='rapido', linhas_por_transacao=100000, recarga_completa=False, incremental=False,
+                 resume=False, memory_map=False, nome_arquivo=None, progresso=None, staging=None):
+        if recarga_completa and incremental:
+            raise ValueError("recarga_completa e incremental são modos exclusivos")
+        if resume and incremental:
+            raise ValueError("A carga incremental é feita em uma única transação e não pode ser retomada")
         self.csv_file_path = csv_file_path
         self.db_path = db_path
         self.batch_size = batch_size
+        self.workers = workers
+        self.engine = engine
+        self.perfil_carga = perfil_carga
+        self.linhas_por_transacao = linhas_por_transacao
+        self.recarga_completa = recarga_completa
+        self.incremental = incremental
+        self.resume = resume
+        self.memory_map = memory_map
+        # csv_file_path pode ser o próprio conteúdo em bytes (upload do dashboard)
+        self.nome_arquivo = nome_arquivo or ('<memória>' if in_memory(csv_file_path) else str(csv_file_path))
+        self.progresso = progresso
+        self.staging_dir = staging
+        self.staging = None
+        self.total_linhas = None
+        self.arquivo_hash = None
         self.conn = None
+        self.carga = None
+        self.metricas = MedidorFases()
+        self.id_maps = {}
+        self.hashes = {}
+        self.periodos_arquivo = []
         
     def create_database_connection(self):
         """Cria conexão com o banco de dados"""
@@ -32,19 +125,17 @@ class OptimizedAlmoxarifadoProcessor:
             return False
     
     def create_tables(self):
-        """Cria as tabelas no banco de dados"""
+        """Cria as tabelas no banco de dados
+        
+        Fora da recarga completa (que esvazia as tabelas derivadas), um banco
+        carregado antes de estoque_flat e dos resumos existirem tem o estoque
+        migrado e essas tabelas montadas aqui, antes da carga.
+        """
         try:
-            with open('database_schema.sql', 'r', encoding='utf-8') as f:
-                schema = f.read()
-            
-            # Executar schema em partes
-            statements = schema.split(';')
-            for statement in statements:
-                statement = statement.strip()
-                if statement:
-                    self.conn.execute(statement)
-            
-            self.conn.commit()
+            if self.recarga_completa:
+                apply_schema(self.conn)
+            else:
+                ensure_derived_tables(self.conn)
             logger.info("Tabelas criadas com sucesso")
             return True
             
@@ -53,159 +144,358 @@ class OptimizedAlmoxarifadoProcessor:
             return False
     
     def process_csv_in_batches(self):
-        """Processa o CSV em lotes para economizar memória"""
+        """Processa o CSV em lotes para economizar memória
+        
+        Cada lote grava também o checkpoint do arquivo (lote, registros lidos e
+        gravados) na mesma transação. Com ``resume=True`` a carga continua a
+        partir do último lote confirmado em vez de recomeçar do início.
+        """
         logger.info("Iniciando processamento em lotes...")
         
+        indices = []
         try:
-            # Primeiro, inserir dados de lookup
-            self._insert_lookup_data()
+            self.arquivo_hash = file_hash(self.csv_file_path)
+            if self.memory_map and (excel_format(self.csv_file_path) or not can_memory_map(self.csv_file_path)):
+                logger.warning("Só arquivos CSV não compactados em disco podem ser mapeados em memória; lendo em fluxo")
+                self.memory_map = False
+            if self.staging_dir:
+                self.staging = open_staging(self.staging_dir, self.arquivo_hash, 'otimizado')
+            checkpoint = load_checkpoint(self.conn, self.arquivo_hash) if self.resume else None
+            if checkpoint and checkpoint['concluido']:
+                logger.info("Este arquivo já foi carregado por completo; nada a retomar")
+                return True
             
-            # Processar dados de estoque em lotes
-            chunk_count = 0
-            total_processed = 0
+            chunk_count, inicio, total_processed = (
+                (checkpoint['lote'], checkpoint['linhas_lidas'], checkpoint['registros']) if checkpoint else (0, 0, 0)
+            )
+            if chunk_count:
+                logger.info(f"Retomando a partir do lote {chunk_count + 1} "
+                            f"(registro {inicio + 1} do arquivo, {total_processed} já gravados)")
             
-            for chunk in pd.read_csv(
-                self.csv_file_path, 
-                sep=';', 
-                encoding='latin-1',
-                chunksize=self.batch_size
-            ):
-                chunk_count += 1
-                logger.info(f"Processando lote {chunk_count}...")
+            # A carga incremental substitui as partições em uma única transação
+            linhas_por_transacao = None if self.incremental else self.linhas_por_transacao
+            with CargaSQLite(self.conn, self.perfil_carga, linhas_por_transacao) as self.carga:
+                if self.recarga_completa:
+                    # Ao retomar, o estoque já foi esvaziado pela execução interrompida
+                    indices = drop_secondary_indexes(self.conn) if checkpoint else begin_full_reload(self.conn)
+                save_checkpoint(self.conn, self.arquivo_hash, self.nome_arquivo, chunk_count, inicio, total_processed)
+                self.carga.commit()
                 
-                # Processar chunk
-                processed_chunk = self._process_chunk(chunk)
+                # Primeiro, inserir dados de lookup
+                if not self._insert_lookup_data():
+                    self.carga.falhar()
+                    return False
                 
-                # Inserir no banco
-                self._insert_chunk_to_database(processed_chunk)
+                # Períodos cujas linhas de estoque_flat e dos resumos serão refeitas (None: as tabelas inteiras);
+                # no acréscimo, também o dos registros sem período, que entram sem estar em periodos_arquivo
+                periodos, periodos_flat = None, [*self.periodos_arquivo, PERIODO_AUSENTE]
+                if self.incremental:
+                    self.hashes, periodos_flat = begin_incremental_load(self.conn, self.hashes,
+                                                                        self.id_maps['periodos'])
+                    periodos = set(self.hashes)
+                elif self.recarga_completa:
+                    periodos_flat = None
                 
-                total_processed += len(processed_chunk)
-                logger.info(f"Lote {chunk_count} processado. Total: {total_processed} registros")
+                # Processar dados de estoque em lotes
+                linhas_lidas = inicio
+                inicio_fase = time.perf_counter()
+                with self.metricas.fase('estoque') as fase:
+                    for linhas_lidas, processed_chunk in self._iter_processed_chunks(inicio, periodos):
+                        chunk_count += 1
+                        
+                        if periodos is not None:
+                            processed_chunk = processed_chunk[period_key(processed_chunk['periodo']).isin(periodos)]
+                        
+                        # Inserir no banco (com o checkpoint do lote)
+                        total_processed += len(processed_chunk)
+                        self._insert_chunk_to_database(processed_chunk, chunk_count, linhas_lidas, total_processed)
+                        
+                        fase['linhas'] = total_processed
+                        self._notificar('estoque', chunk_count, linhas_lidas, inicio_fase, inicio, self.total_linhas)
+                        logger.info(f"Lote {chunk_count} processado. Total: {total_processed} registros")
+                        
+                        # Limpar memória
+                        del processed_chunk
+                        gc.collect()
                 
-                # Limpar memória
-                del chunk, processed_chunk
-                gc.collect()
+                with self.metricas.fase('estoque_flat') as fase:
+                    fase['linhas'] = refresh_estoque_flat(self.conn, periodos_flat)
+                
+                with self.metricas.fase('resumos') as fase:
+                    fase['linhas'] = refresh_resumos(self.conn, periodos_flat)
+                
+                if self.hashes:
+                    record_period_hashes(self.conn, self.hashes, self.id_maps['periodos'])
+                save_checkpoint(self.conn, self.arquivo_hash, self.nome_arquivo, chunk_count, linhas_lidas,
+                                total_processed, concluido=True)
+                self._confirmar()
+            
+            self._rebuild_indexes(indices)
+            indices = []
             
+            self.metricas.log_resumo()
             logger.info(f"Processamento concluído. Total de registros: {total_processed}")
             return True
             
         except Exception as e:
             logger.error(f"Erro no processamento em lotes: {e}")
+            if not self.incremental:
+                logger.info("Os lotes já confirmados foram preservados; use --resume para continuar a carga")
             return False
+        
+        finally:
+            self.carga = None
+            # Mesmo após uma falha o banco não pode ficar sem índices
+            self._rebuild_indexes(indices)
+    
+    def _notificar(self, fase, lote, linhas, inicio_fase, linhas_iniciais=0, total=None):
+        """Envia o andamento da fase ao callback ``progresso``, se houver
+        
+        O callback recebe um dicionário com a fase, o lote, os registros lidos
+        (e o total do arquivo, se já conhecido) e a vazão em registros/s.
+        """
+        if self.progresso is None:
+            return
+        segundos = time.perf_counter() - inicio_fase
+        self.progresso({
+            'fase': fase,
+            'lote': lote,
+            'linhas': linhas,
+            'total': total,
+            'linhas_por_segundo': (linhas - linhas_iniciais) / segundos if segundos > 0 else 0.0,
+        })
+    
+    def _rebuild_indexes(self, indices):
+        """Recria os índices adiados pela recarga completa e roda ANALYZE"""
+        if not indices:
+            return
+        
+        with self.metricas.fase('indices') as fase:
+            rebuild_indexes(self.conn, indices, self.perfil_carga)
+            fase['linhas'] = self.conn.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]
+    
+    def _confirmar(self, linhas=0):
+        """Confirma a transação, ou apenas registra as linhas se houver um perfil de carga ativo"""
+        if self.carga:
+            self.carga.registrar(linhas)
+        else:
+            self.conn.commit()
+    
+    def _read_chunks(self, inicio=0, **kwargs):
+        """Lê o CSV em chunks de ``batch_size`` linhas, a partir do registro ``inicio``
+        
+        Com ``memory_map`` os chunks são faixas do arquivo mapeado em memória;
+        as duas passagens (lookups e estoque) leem as mesmas páginas do cache do
+        sistema operacional, sem cópias para buffers de leitura.
+        """
+        if self.memory_map:
+            return self._read_mapped_chunks(inicio, **kwargs)
+        return read_database_csv(self.csv_file_path, engine=self.engine, chunksize=self.batch_size, inicio=inicio,
+                                 **kwargs)
+    
+    def _read_mapped_chunks(self, inicio=0, **kwargs):
+        with ArquivoMapeado(self.csv_file_path, self.engine) as arquivo:
+            for faixa in arquivo.faixas(arquivo.tamanho_para(self.batch_size), arquivo.offset_linha(inicio)):
+                yield arquivo.ler(*faixa, **kwargs)
+    
+    def _chunk_tasks(self, inicio=0):
+        """Gera as tarefas ``(função, argumentos)`` de leitura e limpeza de cada lote para o pool
+        
+        Com ``memory_map`` cada processo faz o parsing da própria faixa do
+        arquivo; sem ele, os chunks são lidos aqui e enviados já prontos.
+        """
+        if self.memory_map:
+            with ArquivoMapeado(self.csv_file_path, self.engine) as arquivo:
+                faixas = arquivo.faixas(arquivo.tamanho_para(self.batch_size), arquivo.offset_linha(inicio))
+            for faixa in faixas:
+                yield process_mapped_range, (self.csv_file_path, self.engine, *faixa)
+        else:
+            for chunk in self._read_chunks(inicio):
+                yield count_and_process_chunk, (chunk,)
+    
+    def _iter_processed_chunks(self, inicio=0, periodos=None):
+        """Gera ``(registros lidos do arquivo, chunk processado)`` na ordem do arquivo
+        
+        Com o staging em Parquet pronto, os chunks já limpos vêm dele (só as
+        partições de ``periodos``, se informado); os registros lidos continuam
+        contados no arquivo original, então checkpoints e progresso valem
+        para as duas origens.
+        
+        Com ``workers > 1`` a limpeza roda em um pool de processos: uma thread
+        leitora envia os chunks ao pool e coloca os futures em uma fila limitada,
+        consumida em ordem pela thread principal, que é a única a escrever no
+        SQLite.
+        """
+        if self.staging is not None and self.staging.pronto:
+            if self.staging.alinhado(inicio):
+                yield from self.staging.ler_lotes(inicio, periodos)
+                return
+            logger.warning("O checkpoint não coincide com um lote do staging; lendo o arquivo original")
+        
+        if self.workers <= 1:
+            # Sem pool, leitura e limpeza são medidas como sub-fases da passagem em curso
+            lidas = inicio
+            chunks = self._read_chunks(inicio)
+            while True:
+                with self.metricas.fase('leitura') as fase:
+                    chunk = next(chunks, None)
+                    fase['linhas'] = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    return
+                lidas += len(chunk)
+                with self.metricas.fase('limpeza') as fase:
+                    chunk = self._process_chunk(chunk)
+                    fase['linhas'] = len(chunk)
+                yield lidas, chunk
+        
+        fila = queue.Queue(maxsize=self.workers * 2)
+        parar = threading.Event()
+        
+        def enfileirar(item):
+            while not parar.is_set():
+                try:
+                    fila.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            def produzir():
+                try:
+                    for funcao, argumentos in self._chunk_tasks(inicio):
+                        if not enfileirar(pool.submit(funcao, *argumentos)):
+                            return
+                except Exception as e:
+                    enfileirar(e)
+                finally:
+                    enfileirar(None)
+            
+            leitor = threading.Thread(target=produzir, daemon=True)
+            leitor.start()
+            
+            try:
+                lidas = inicio
+                while True:
+                    item = fila.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    linhas, chunk = item.result()
+                    lidas += linhas
+                    yield lidas, chunk
+            finally:
+                parar.set()
+                leitor.join()
+                pool.shutdown(cancel_futures=True)
     
     def _process_chunk(self, chunk):
         """Processa um chunk de dados"""
-        # Renomear colunas
-        chunk.columns = [
-            'periodo', 'cod_familia', 'desc_familia', 'cod_grupo_material', 'desc_grupo_material',
-            'cod_material', 'desc_material', 'cod_tipo_material', 'desc_tipo_material', 'situacao',
-            'localizacao', 'desc_localizacao', 'cod_localizacao', 'cod_almoxarifado', 'desc_almoxarifado',
-            'unidade', 'quantidade', 'custo_medio', 'vlr_total', 'cod_classificacao_sped',
-            'desc_classificacao_sped', 'controla_est_min', 'estoque_minimo', 'controla_est_max',
-            'estoque_maximo', 'conta_contabil', 'desc_conta_contabil', 'ncm', 'desc_classificacao_fiscal',
-            'cod_identificacao', 'desc_identificacao', 'curva_xyz'
-        ]
-        
-        # Limpar dados
-        chunk = chunk.dropna(subset=['cod_material', 'desc_material'])
-        
-        # Converter tipos de dados
-        numeric_columns = ['cod_familia', 'cod_grupo_material', 'cod_material', 'cod_tipo_material',
-                          'cod_almoxarifado', 'quantidade', 'custo_medio', 'vlr_total',
-                          'cod_classificacao_sped', 'estoque_minimo', 'estoque_maximo',
-                          'conta_contabil', 'cod_identificacao']
-        
-        for col in numeric_columns:
-            if col in chunk.columns:
-                chunk[col] = chunk[col].astype(str).str.replace(',', '.')
-                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
-        
-        # Converter booleanos
-        chunk['controla_est_min'] = chunk['controla_est_min'].map({'Sim': True, 'Não': False, 'NÃO': False})
-        chunk['controla_est_max'] = chunk['controla_est_max'].map({'Sim': True, 'Não': False, 'NÃO': False})
-        
-        return chunk
+        return process_chunk(chunk)
     
     def _insert_lookup_data(self):
-        """Insere dados de lookup uma única vez"""
+        """Insere dados de lookup uma única vez
+        
+        Faz uma primeira passagem completa pelo arquivo, lendo em lotes apenas
+        as colunas de código/descrição, e acumula os códigos distintos de cada
+        uma das dez tabelas de lookup. A memória usada é proporcional ao número
+        de códigos distintos, não ao tamanho do arquivo.
+        
+        Nos modos incremental e de recarga completa a mesma passagem lê também
+        as colunas de estoque e acumula o hash de conteúdo de cada período.
+        
+        Com staging, a passagem lê os lotes já limpos do staging ou, na
+        primeira carga do arquivo, lê e limpa os lotes completos e os grava
+        no staging, de onde a passagem do estoque vai lê-los.
+        """
         logger.info("Inserindo dados de lookup...")
         
         try:
-            # Ler apenas uma amostra para obter dados de lookup
-            sample_df = pd.read_csv(
-                self.csv_file_path, 
-                sep=';', 
-                encoding='latin-1',
-                nrows=1000
-            )
-            
-            # Renomear colunas
-            sample_df.columns = [
-                'periodo', 'cod_familia', 'desc_familia', 'cod_grupo_material', 'desc_grupo_material',
-                'cod_material', 'desc_material', 'cod_tipo_material', 'desc_tipo_material', 'situacao',
-                'localizacao', 'desc_localizacao', 'cod_localizacao', 'cod_almoxarifado', 'desc_almoxarifado',
-                'unidade', 'quantidade', 'custo_medio', 'vlr_total', 'cod_classificacao_sped',
-                'desc_classificacao_sped', 'controla_est_min', 'estoque_minimo', 'controla_est_max',
-                'estoque_maximo', 'conta_contabil', 'desc_conta_contabil', 'ncm', 'desc_classificacao_fiscal',
-                'cod_identificacao', 'desc_identificacao', 'curva_xyz'
-            ]
+            dimensoes = {col for key, _, cols in DIMENSOES.values() for col in (key, *cols)}
+            usadas = set(dimensoes)
+            calcular_hashes = self.incremental or self.recarga_completa
+            if calcular_hashes:
+                usadas.update(COLUNAS_HASH)
+            nomes = [col for col in COLUNAS if col in usadas]
+            # Só as descrições das dimensões: o hash precisa ver as descrições de material ausentes
+            descricoes = [col for col in nomes if col.startswith('desc_') and col in dimensoes]
             
-            # Inserir períodos
-            periodos = sample_df[['periodo']].drop_duplicates()
-            for _, row in periodos.iterrows():
-                periodo = row['periodo']
-                try:
-                    if '/' in periodo:
-                        mes, ano = periodo.split('/')
-                        ano = int('20' + ano) if len(ano) == 2 else int(ano)
-                        mes = int(mes)
-                    else:
-                        ano = 2023
-                        mes = 1
-                except:
-                    ano = 2023
-                    mes = 1
+            frames = {}
+            inicio_fase = time.perf_counter()
+            with self.metricas.fase('lookups') as fase:
+                for lote, chunk in enumerate(self._lookup_chunks(nomes), start=1):
+                    chunk[descricoes] = chunk[descricoes].astype(object).fillna('')
+                    frames = merge_dimension_frames(frames, dimension_frames(chunk))
+                    if calcular_hashes:
+                        self.hashes = merge_hashes(self.hashes, hash_periodos(convert_numeric(chunk)))
+                    fase['linhas'] += len(chunk)
+                    self._notificar('lookups', lote, fase['linhas'], inicio_fase)
                 
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO periodos (periodo, ano, mes) 
-                    VALUES (?, ?, ?)
-                """, (periodo, ano, mes))
-            
-            # Inserir outras tabelas de lookup de forma similar...
-            # (código simplificado para brevidade)
+                self.total_linhas = self.staging.total_linhas if self.staging else fase['linhas']
+                self.id_maps = upsert_dimensions(self.conn, frames)
+                self.periodos_arquivo = [self.id_maps['periodos'][periodo]
+                                         for periodo in frames['periodos']['periodo']]
+                self._confirmar()
             
-            self.conn.commit()
-            logger.info("Dados de lookup inseridos")
+            logger.info("Dados de lookup inseridos: " +
+                        ", ".join(f"{table}={len(id_map)}" for table, id_map in self.id_maps.items()))
+            return True
             
         except Exception as e:
             logger.error(f"Erro ao inserir dados de lookup: {e}")
+            return False
     
-    def _insert_chunk_to_database(self, chunk):
-        """Insere um chunk de dados no banco"""
+    def _lookup_chunks(self, nomes):
+        """Gera os chunks (colunas ``nomes``) da passagem de lookups
+        
+        Sem staging, lê do arquivo só essas colunas, como texto; com o staging
+        pronto, lê os lotes limpos dele; com o staging por fazer, lê e limpa
+        os lotes do arquivo e os grava no staging ao passar.
+        """
+        if self.staging is None:
+            yield from self._read_chunks(dtype=str, usecols=nomes)
+            return
+        
+        if not self.staging.pronto:
+            self.staging.iniciar()
+            anterior = 0
+            for lidas, chunk in self._iter_processed_chunks():
+                self.staging.gravar(chunk, lidas - anterior)
+                anterior = lidas
+                yield chunk[nomes]
+            self.staging.concluir()
+            return
+        
+        for _, chunk in self.staging.ler_lotes():
+            yield chunk[nomes]
+    
+    def _insert_chunk_to_database(self, chunk, lote, linhas_lidas, registros):
+        """Insere um chunk de dados no banco
+        
+        Os códigos do chunk são convertidos em ids com ``Series.map`` sobre os
+        mapas em cache (``self.id_maps``); materiais novos e registros de
+        estoque entram com um executemany cada, seguidos do checkpoint do lote.
+        
+        Um erro interrompe a carga: a transação em aberto é desfeita e a carga
+        pode ser retomada do último checkpoint confirmado.
+        """
         try:
-            for _, row in chunk.iterrows():
-                # Inserir material se não existir
-                self.conn.execute("""
-                    INSERT OR IGNORE INTO materiais 
-                    (codigo, descricao, unidade, situacao, controla_estoque_min, 
-                     estoque_minimo, controla_estoque_max, estoque_maximo, curva_xyz)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (int(row['cod_material']), row['desc_material'], row['unidade'], 
-                      row['situacao'], row['controla_est_min'], row['estoque_minimo'],
-                      row['controla_est_max'], row['estoque_maximo'], row['curva_xyz']))
-                
-                # Inserir registro de estoque
-                self.conn.execute("""
-                    INSERT INTO estoque 
-                    (material_id, quantidade, custo_medio, valor_total)
-                    VALUES ((SELECT id FROM materiais WHERE codigo = ?), ?, ?, ?)
-                """, (int(row['cod_material']), row['quantidade'], 
-                      row['custo_medio'], row['vlr_total']))
+            if not self.id_maps:
+                self.id_maps = load_id_maps(self.conn)
             
-            self.conn.commit()
+            insert_materiais(self.conn, chunk, self.id_maps)
+            estoque = estoque_frame(chunk, self.id_maps)
+            insert_estoque(self.conn, estoque)
+            if not self.hashes:
+                # Linhas acrescentadas sem controle: o hash desses períodos deixa de valer
+                forget_period_hashes(self.conn, estoque['periodo_id'].dropna().unique().tolist())
+            save_checkpoint(self.conn, self.arquivo_hash, self.nome_arquivo, lote, linhas_lidas, registros)
+            self._confirmar(len(chunk))
             
         except Exception as e:
-            logger.error(f"Erro ao inserir chunk: {e}")
+            logger.error(f"Erro ao inserir o lote {lote}: {e}")
+            raise
     
     def process_all(self):
         """Executa todo o pipeline de processamento"""
@@ -229,8 +519,68 @@ class OptimizedAlmoxarifadoProcessor:
             self.conn.close()
             logger.info("Conexão fechada")
 
+def ingest(fonte, db_path="almoxarifado.db", progresso=None, **opcoes):
+    """Carrega um arquivo no banco dentro do próprio processo
+    
+    ``fonte`` é um caminho ou o conteúdo do arquivo em bytes (por exemplo, o
+    upload do dashboard, sem passar por um arquivo temporário). ``progresso``
+    recebe os dicionários de andamento de cada lote; as demais opções são as
+    de ``OptimizedAlmoxarifadoProcessor``. Retorna True se a carga concluiu.
+    """
+    processor = OptimizedAlmoxarifadoProcessor(fonte, db_path=db_path, progresso=progresso, **opcoes)
+    try:
+        return processor.process_all()
+    finally:
+        processor.close_connection()
+
 if __name__ == "__main__":
-    processor = OptimizedAlmoxarifadoProcessor("Database.csv")
+    parser = argparse.ArgumentParser(description="Processador otimizado de dados do almoxarifado")
+    parser.add_argument("--file", default="Database.csv", help="Arquivo CSV de entrada")
+    parser.add_argument("--db", default="almoxarifado.db", help="Banco de dados SQLite de destino")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Registros por lote")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processos para limpar os lotes em paralelo (1 = sem paralelismo)")
+    parser.add_argument("--engine", choices=["c", "pyarrow"], default="c",
+                        help="Parser do CSV (pyarrow: multi-thread, requer o pacote pyarrow)")
+    parser.add_argument("--perfil-carga", choices=["seguro", "rapido", "maximo"], default="rapido",
+                        help="PRAGMAs do SQLite durante a carga (restaurados ao final)")
+    parser.add_argument("--linhas-por-transacao", type=int, default=100000,
+                        help="Registros por transação (BEGIN/COMMIT)")
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument("--recarga-completa", action="store_true",
+                      help="Substitui todo o estoque, recriando os índices uma única vez ao final")
+    modo.add_argument("--incremental", action="store_true",
+                      help="Recarrega apenas os períodos novos ou alterados (comparando hashes de conteúdo)")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Lê o arquivo mapeado em memória, com o parsing dos lotes feito nos processos do pool")
+    parser.add_argument("--resume", action="store_true",
+                        help="Retoma a carga deste arquivo a partir do último lote confirmado")
+    parser.add_argument("--staging", metavar="DIR",
+                        help="Grava os lotes limpos em Parquet, por período, em DIR e carrega de lá; "
+                             "cargas seguintes do mesmo arquivo pulam o parsing e a limpeza")
+    parser.add_argument("--validar", action="store_true",
+                        help="Apenas valida o arquivo (dry-run), sem gravar no banco")
+    args = parser.parse_args()
+    if args.resume and args.incremental:
+        parser.error("--resume não se aplica à carga incremental (feita em uma única transação)")
+    
+    if args.validar:
+        relatorio = validate_file(args.file, engine=args.engine, memory_map=args.mmap)
+        print(relatorio.resumo().to_string(index=False))
+        for regra, total in relatorio.ocorrencias.items():
+            if total:
+                print(f"\nExemplos de {regra}:")
+                print(relatorio.exemplos(regra).to_string(index=False))
+        print("✅ Arquivo válido" if relatorio.valido else "❌ Arquivo com problemas; corrija-o antes da carga")
+        raise SystemExit(0 if relatorio.valido else 1)
+    
+    processor = OptimizedAlmoxarifadoProcessor(args.file, db_path=args.db, batch_size=args.batch_size,
+                                               workers=args.workers, engine=args.engine,
+                                               perfil_carga=args.perfil_carga,
+                                               linhas_por_transacao=args.linhas_por_transacao,
+                                               recarga_completa=args.recarga_completa,
+                                               incremental=args.incremental, resume=args.resume,
+                                               memory_map=args.mmap, staging=args.staging)
     
     try:
         success = processor.process_all()
@@ -10,6 +10,10 @@ CREATE TABLE IF NOT EXISTS periodos (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Período 0: referenciado pelos registros de estoque sem período (a chave
+-- primária do estoque não aceita NULL). Fica fora das consultas por período
+INSERT OR IGNORE INTO periodos (id, periodo, ano, mes) VALUES (0, '(sem período)', NULL, NULL);
+
 -- Tabela de Famílias de Materiais
 CREATE TABLE IF NOT EXISTS familias (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -107,9 +111,14 @@ CREATE TABLE IF NOT EXISTS materiais (
 );
 
 -- Tabela de Estoque (dados históricos)
+-- Layout compacto: tabela WITHOUT ROWID agrupada por período (todas as
+-- leituras do estoque são por período), sem id nem created_at por registro.
+-- linha numera os registros dentro do período, e registros sem período
+-- ficam no período 0 (criado acima), já que a chave primária não aceita NULL. Bancos
+-- com o layout antigo são migrados por apply_schema (data_processor.py)
 CREATE TABLE IF NOT EXISTS estoque (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    periodo_id INTEGER,
+    periodo_id INTEGER NOT NULL,
+    linha INTEGER NOT NULL,
     material_id INTEGER,
     localizacao_id INTEGER,
     almoxarifado_id INTEGER,
@@ -120,7 +129,7 @@ CREATE TABLE IF NOT EXISTS estoque (
     quantidade REAL,
     custo_medio REAL,
     valor_total REAL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (periodo_id, linha),
     FOREIGN KEY (periodo_id) REFERENCES periodos(id),
     FOREIGN KEY (material_id) REFERENCES materiais(id),
     FOREIGN KEY (localizacao_id) REFERENCES localizacoes(id),
@@ -129,13 +138,112 @@ CREATE TABLE IF NOT EXISTS estoque (
     FOREIGN KEY (conta_contabil_id) REFERENCES contas_contabeis(id),
     FOREIGN KEY (classificacao_fiscal_id) REFERENCES classificacoes_fiscais(id),
     FOREIGN KEY (identificacao_id) REFERENCES identificacoes(id)
+) WITHOUT ROWID;
+
+-- Estoque desnormalizado com as colunas usadas pelo dashboard, mantido pela
+-- carga (refeito por período carregado) para dispensar os joins na leitura
+CREATE TABLE IF NOT EXISTS estoque_flat (
+    cod_material INTEGER,
+    desc_material TEXT,
+    unidade TEXT,
+    familia TEXT,
+    grupo TEXT,
+    almoxarifado TEXT,
+    periodo TEXT,
+    ano INTEGER,
+    mes INTEGER,
+    quantidade REAL,
+    custo_medio REAL,
+    valor_total REAL
+);
+
+-- Resumos (rollups) do estoque mantidos pela carga, refeitos por período
+-- carregado: as consultas agregadas leem um registro por grupo em vez de
+-- varrer o estoque. soma_custo e registros_custo dão a média do custo médio.
+-- O resumo por material inclui o almoxarifado para contar materiais
+-- distintos por almoxarifado entre períodos. Um registro por grupo é
+-- garantido pelo GROUP BY da carga, e os índices de cobertura abaixo
+-- servem as leituras (sem chave primária para não concorrer com eles)
+CREATE TABLE IF NOT EXISTS resumo_periodo_material (
+    periodo_id INTEGER,
+    material_id INTEGER,
+    almoxarifado_id INTEGER,
+    registros INTEGER NOT NULL,
+    quantidade REAL,
+    valor_total REAL,
+    soma_custo REAL,
+    registros_custo INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS resumo_periodo_almoxarifado (
+    periodo_id INTEGER,
+    almoxarifado_id INTEGER,
+    total_materiais INTEGER NOT NULL,
+    registros INTEGER NOT NULL,
+    quantidade REAL,
+    valor_total REAL,
+    soma_custo REAL,
+    registros_custo INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS resumo_periodo_familia (
+    periodo_id INTEGER,
+    familia_id INTEGER,
+    total_materiais INTEGER NOT NULL,
+    registros INTEGER NOT NULL,
+    quantidade REAL,
+    valor_total REAL,
+    soma_custo REAL,
+    registros_custo INTEGER NOT NULL
+);
+
+-- Controle da carga incremental: hash do conteúdo de cada período carregado
+CREATE TABLE IF NOT EXISTS cargas_periodos (
+    periodo_id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    carregado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (periodo_id) REFERENCES periodos(id)
+);
+
+-- Checkpoints da carga em lotes: último lote confirmado de cada arquivo
+CREATE TABLE IF NOT EXISTS checkpoints_carga (
+    arquivo_hash TEXT PRIMARY KEY,
+    arquivo TEXT,
+    lote INTEGER NOT NULL,
+    linhas_lidas INTEGER NOT NULL,
+    registros INTEGER NOT NULL,
+    concluido BOOLEAN DEFAULT 0,
+    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Índices para otimizar consultas
-CREATE INDEX IF NOT EXISTS idx_estoque_periodo ON estoque(periodo_id);
-CREATE INDEX IF NOT EXISTS idx_estoque_material ON estoque(material_id);
-CREATE INDEX IF NOT EXISTS idx_estoque_almoxarifado ON estoque(almoxarifado_id);
-CREATE INDEX IF NOT EXISTS idx_estoque_localizacao ON estoque(localizacao_id);
+-- Montados a partir das consultas do dashboard, do DatabaseUtils e da
+-- atualização das tabelas derivadas, como índices de cobertura: as leituras
+-- do estoque e dos resumos não consultam as linhas das tabelas
+-- (benchmarks/verificar_planos.py confere os planos)
+-- O estoque só é lido por período (estoque_flat, resumos e recarga
+-- incremental) e já é agrupado por período na própria tabela, então não
+-- leva índices secundários
+DROP INDEX IF EXISTS idx_estoque_periodo;
+DROP INDEX IF EXISTS idx_estoque_material;
+DROP INDEX IF EXISTS idx_estoque_almoxarifado;
+DROP INDEX IF EXISTS idx_estoque_localizacao;
+DROP INDEX IF EXISTS idx_estoque_periodo_almoxarifado;
+CREATE INDEX IF NOT EXISTS idx_resumo_material_por_periodo
+    ON resumo_periodo_material(periodo_id, material_id, quantidade, valor_total, soma_custo, registros_custo);
+CREATE INDEX IF NOT EXISTS idx_resumo_material_por_material
+    ON resumo_periodo_material(material_id, quantidade, valor_total, soma_custo, registros_custo);
+-- registros também serve a contagem total do estoque (SUM), sem ler o estoque
+DROP INDEX IF EXISTS idx_resumo_material_por_almoxarifado;
+CREATE INDEX IF NOT EXISTS idx_resumo_material_por_almoxarifado_registros
+    ON resumo_periodo_material(almoxarifado_id, material_id, registros);
+CREATE INDEX IF NOT EXISTS idx_resumo_almoxarifado_por_almoxarifado
+    ON resumo_periodo_almoxarifado(almoxarifado_id, quantidade, valor_total);
+CREATE INDEX IF NOT EXISTS idx_resumo_familia_por_periodo
+    ON resumo_periodo_familia(periodo_id, familia_id, total_materiais, quantidade, valor_total, soma_custo,
+                              registros_custo);
+CREATE INDEX IF NOT EXISTS idx_estoque_flat_periodo ON estoque_flat(periodo);
 CREATE INDEX IF NOT EXISTS idx_materiais_grupo ON materiais(grupo_material_id);
 CREATE INDEX IF NOT EXISTS idx_materiais_tipo ON materiais(tipo_material_id);
 CREATE INDEX IF NOT EXISTS idx_grupos_familia ON grupos_materiais(familia_id);
@@ -2,43 +2,176 @@
 Utilitários para consultas no banco de dados do Almoxarifado
 """
 
+import os
+import queue
 import sqlite3
+import threading
 import pandas as pd
-from datetime import datetime
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# Consultas que o load_data do dashboard carrega: nome -> SQL
+CONSULTAS_DASHBOARD = {
+    # Tabela já desnormalizada pela carga: sem joins na abertura do dashboard
+    'estoque': """
+        SELECT cod_material, desc_material, unidade, familia, grupo, almoxarifado,
+               periodo, ano, mes, quantidade, custo_medio, valor_total
+        FROM estoque_flat
+    """,
+    'materiais': """
+        SELECT m.*, f.descricao as familia, g.descricao as grupo,
+               t.descricao as tipo_material
+        FROM materiais m
+        LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
+        LEFT JOIN familias f ON g.familia_id = f.id
+        LEFT JOIN tipos_materiais t ON m.tipo_material_id = t.id
+    """,
+    # Agregados lidos dos resumos mantidos pela carga, não do estoque
+    'resumo_por_periodo': """
+        SELECT p.periodo, p.ano, p.mes,
+               COUNT(DISTINCT r.material_id) as total_materiais,
+               SUM(r.quantidade) as total_quantidade,
+               SUM(r.valor_total) as valor_total_estoque,
+               SUM(r.soma_custo) / SUM(r.registros_custo) as custo_medio_geral
+        FROM resumo_periodo_material r
+        JOIN periodos p ON r.periodo_id = p.id AND p.id <> 0
+        GROUP BY p.id, p.periodo, p.ano, p.mes
+        ORDER BY p.ano, p.mes
+    """,
+    'top_materiais_valor': """
+        SELECT m.codigo, m.descricao, f.descricao as familia,
+               SUM(r.valor_total) as valor_total,
+               SUM(r.quantidade) as quantidade_total,
+               SUM(r.soma_custo) / SUM(r.registros_custo) as custo_medio
+        FROM resumo_periodo_material r
+        JOIN materiais m ON r.material_id = m.id
+        LEFT JOIN grupos_materiais g ON m.grupo_material_id = g.id
+        LEFT JOIN familias f ON g.familia_id = f.id
+        GROUP BY m.id, m.codigo, m.descricao, f.descricao
+        ORDER BY valor_total DESC
+        LIMIT 20
+    """,
+    'estoque_por_almoxarifado': """
+        SELECT a.descricao as almoxarifado,
+               MAX(d.total_materiais) as total_materiais,
+               SUM(r.quantidade) as quantidade_total,
+               SUM(r.valor_total) as valor_total
+        FROM resumo_periodo_almoxarifado r
+        JOIN almoxarifados a ON r.almoxarifado_id = a.id
+        LEFT JOIN (SELECT almoxarifado_id, COUNT(DISTINCT material_id) as total_materiais
+                   FROM resumo_periodo_material
+                   GROUP BY almoxarifado_id) d ON d.almoxarifado_id = a.id
+        GROUP BY a.id, a.descricao
+        ORDER BY valor_total DESC
+    """
+}
+
+class PoolConexoes:
+    """Pool de conexões somente leitura a um banco SQLite, seguro entre threads
+    
+    As conexões são abertas sob demanda (até ``tamanho``) pela URI
+    ``mode=ro&cache=shared``, com ``PRAGMA query_only``, e reaproveitadas:
+    consultas repetidas não pagam de novo a abertura do arquivo nem a leitura
+    do schema, as conexões do pool dividem um único cache de páginas e cada
+    uma guarda seus comandos preparados (``cached_statements``), então o
+    mesmo SQL não é compilado de novo. Com todas emprestadas, quem pede espera
+    uma ser devolvida.
+    """
+    
+    def __init__(self, db_path, tamanho=4, cached_statements=256):
+        self.db_path = db_path
+        self.tamanho = tamanho
+        self.cached_statements = cached_statements
+        self._livres = queue.LifoQueue()
+        self._abertas = []
+        self._lock = threading.Lock()
+    
+    def _conectar(self):
+        """Abre uma conexão somente leitura (o arquivo precisa existir)"""
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro&cache=shared"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+    
+    def _emprestar(self):
+        """Retorna uma conexão livre, abrindo uma nova se o pool ainda não estiver cheio"""
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if len(self._abertas) < self.tamanho:
+                conn = self._conectar()
+                self._abertas.append(conn)
+                return conn
+        return self._livres.get()
+    
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão do pool durante o bloco ``with``"""
+        conn = self._emprestar()
+        try:
+            yield conn
+        finally:
+            # Sem transação de leitura aberta, a conexão volta a ver o que outras gravaram
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put(conn)
+    
+    def fechar(self):
+        """Fecha as conexões abertas pelo pool (que volta a abri-las sob demanda)"""
+        with self._lock:
+            for conn in self._abertas:
+                conn.close()
+            self._abertas = []
+            self._livres = queue.LifoQueue()
 
 class DatabaseUtils:
-    def __init__(self, db_path="almoxarifado.db"):
+    """Consultas somente leitura sobre o banco do almoxarifado
+    
+    As consultas agregadas leem os resumos: bancos carregados antes deles são
+    atualizados pelos processadores (ou pelo dashboard), nunca por esta classe.
+    """
+    
+    def __init__(self, db_path="almoxarifado.db", tamanho_pool=4):
         self.db_path = db_path
+        self.pool = PoolConexoes(db_path, tamanho_pool)
     
     def get_connection(self):
-        """Retorna conexão com o banco de dados"""
+        """Retorna conexão com o banco de dados
+        
+        Conexão própria de quem chama (que a fecha), fora do pool; os métodos
+        desta classe usam ``conexao``.
+        """
         return sqlite3.connect(self.db_path)
     
+    def conexao(self):
+        """Empresta uma conexão somente leitura do pool (use com ``with``)"""
+        return self.pool.conexao()
+    
     def get_estatisticas_gerais(self):
         """Retorna estatísticas gerais do banco"""
-        conn = self.get_connection()
-        
         queries = {
             'total_materiais': "SELECT COUNT(DISTINCT codigo) FROM materiais",
             'total_familias': "SELECT COUNT(*) FROM familias",
             'total_grupos': "SELECT COUNT(*) FROM grupos_materiais",
             'total_almoxarifados': "SELECT COUNT(*) FROM almoxarifados",
-            'total_periodos': "SELECT COUNT(*) FROM periodos",
-            'total_registros_estoque': "SELECT COUNT(*) FROM estoque"
+            'total_periodos': "SELECT COUNT(*) FROM periodos WHERE id <> 0",
+            # Dos resumos: contar o estoque seria ler a tabela inteira
+            'total_registros_estoque': "SELECT COALESCE(SUM(registros), 0) FROM resumo_periodo_material"
         }
         
         stats = {}
-        for key, query in queries.items():
-            result = conn.execute(query).fetchone()
-            stats[key] = result[0] if result else 0
+        with self.conexao() as conn:
+            for key, query in queries.items():
+                result = conn.execute(query).fetchone()
+                stats[key] = result[0] if result else 0
         
-        conn.close()
         return stats
     
     def get_materiais_por_familia(self):
         """Retorna distribuição de materiais por família"""
-        conn = self.get_connection()
-        
         query = """
             SELECT f.descricao as familia, COUNT(m.id) as total_materiais
             FROM familias f
@@ -48,41 +181,58 @@ class DatabaseUtils:
             ORDER BY total_materiais DESC
         """
         
-        result = pd.read_sql_query(query, conn)
-        conn.close()
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn)
+        
         return result
     
     def get_estoque_por_periodo(self):
         """Retorna evolução do estoque por período"""
-        conn = self.get_connection()
-        
         query = """
             SELECT p.periodo, p.ano, p.mes,
-                   COUNT(DISTINCT e.material_id) as total_materiais,
-                   SUM(e.quantidade) as quantidade_total,
-                   SUM(e.valor_total) as valor_total,
-                   AVG(e.custo_medio) as custo_medio
-            FROM estoque e
-            JOIN periodos p ON e.periodo_id = p.id
+                   COUNT(DISTINCT r.material_id) as total_materiais,
+                   SUM(r.quantidade) as quantidade_total,
+                   SUM(r.valor_total) as valor_total,
+                   SUM(r.soma_custo) / SUM(r.registros_custo) as custo_medio
+            FROM resumo_periodo_material r
+            JOIN periodos p ON r.periodo_id = p.id AND p.id <> 0
             GROUP BY p.id, p.periodo, p.ano, p.mes
             ORDER BY p.ano, p.mes
         """
         
-        result = pd.read_sql_query(query, conn)
-        conn.close()
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn)
+        
+        return result
+    
+    def get_estoque_por_familia(self):
+        """Retorna o estoque de cada família por período"""
+        query = """
+            SELECT p.periodo, p.ano, p.mes, f.descricao as familia,
+                   r.total_materiais,
+                   r.quantidade as quantidade_total,
+                   r.valor_total,
+                   r.soma_custo / r.registros_custo as custo_medio
+            FROM resumo_periodo_familia r
+            JOIN periodos p ON r.periodo_id = p.id AND p.id <> 0
+            JOIN familias f ON r.familia_id = f.id
+            ORDER BY p.ano, p.mes, r.valor_total DESC
+        """
+        
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn)
+        
         return result
     
     def get_top_materiais_valor(self, limit=20):
         """Retorna top materiais por valor"""
-        conn = self.get_connection()
-        
         query = """
             SELECT m.codigo, m.descricao, f.descricao as familia,
-                   SUM(e.valor_total) as valor_total,
-                   SUM(e.quantidade) as quantidade_total,
-                   AVG(e.custo_medio) as custo_medio
-            FROM estoque e
-            JOIN materiais m ON e.material_id = m.id
+                   SUM(r.valor_total) as valor_total,
+                   SUM(r.quantidade) as quantidade_total,
+                   SUM(r.soma_custo) / SUM(r.registros_custo) as custo_medio
+            FROM resumo_periodo_material r
+            JOIN materiais m ON r.material_id = m.id
             JOIN grupos_materiais g ON m.grupo_material_id = g.id
             JOIN familias f ON g.familia_id = f.id
             GROUP BY m.id, m.codigo, m.descricao, f.descricao
@@ -90,22 +240,21 @@ class DatabaseUtils:
             LIMIT ?
         """
         
-        result = pd.read_sql_query(query, conn, params=(limit,))
-        conn.close()
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn, params=(limit,))
+        
         return result
     
     def get_materiais_baixo_estoque(self, percentual_minimo=0.1):
         """Retorna materiais com estoque baixo"""
-        conn = self.get_connection()
-        
         query = """
             SELECT m.codigo, m.descricao, f.descricao as familia,
-                   SUM(e.quantidade) as quantidade_atual,
+                   SUM(r.quantidade) as quantidade_atual,
                    m.estoque_minimo,
-                   AVG(e.custo_medio) as custo_medio,
-                   SUM(e.valor_total) as valor_total
-            FROM estoque e
-            JOIN materiais m ON e.material_id = m.id
+                   SUM(r.soma_custo) / SUM(r.registros_custo) as custo_medio,
+                   SUM(r.valor_total) as valor_total
+            FROM resumo_periodo_material r
+            JOIN materiais m ON r.material_id = m.id
             JOIN grupos_materiais g ON m.grupo_material_id = g.id
             JOIN familias f ON g.familia_id = f.id
             WHERE m.controla_estoque_min = 1
@@ -114,27 +263,27 @@ class DatabaseUtils:
             ORDER BY (quantidade_atual / m.estoque_minimo) ASC
         """
         
-        result = pd.read_sql_query(query, conn, params=(percentual_minimo,))
-        conn.close()
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn, params=(percentual_minimo,))
+        
         return result
     
     def get_curva_abc(self):
         """Retorna dados para análise de curva ABC"""
-        conn = self.get_connection()
-        
         query = """
             SELECT m.codigo, m.descricao, f.descricao as familia,
-                   SUM(e.valor_total) as valor_total,
-                   SUM(e.quantidade) as quantidade_total
-            FROM estoque e
-            JOIN materiais m ON e.material_id = m.id
+                   SUM(r.valor_total) as valor_total,
+                   SUM(r.quantidade) as quantidade_total
+            FROM resumo_periodo_material r
+            JOIN materiais m ON r.material_id = m.id
             JOIN grupos_materiais g ON m.grupo_material_id = g.id
             JOIN familias f ON g.familia_id = f.id
             GROUP BY m.id, m.codigo, m.descricao, f.descricao
             ORDER BY valor_total DESC
         """
         
-        result = pd.read_sql_query(query, conn)
+        with self.conexao() as conn:
+            result = pd.read_sql_query(query, conn)
         
         # Calcular percentuais acumulados
         result['valor_acumulado'] = result['valor_total'].cumsum()
@@ -145,13 +294,10 @@ class DatabaseUtils:
         result.loc[result['percentual_acumulado'] <= 80, 'classificacao'] = 'A'
         result.loc[(result['percentual_acumulado'] > 80) & (result['percentual_acumulado'] <= 95), 'classificacao'] = 'B'
         
-        conn.close()
         return result
     
     def export_to_excel(self, filename="relatorio_almoxarifado.xlsx"):
         """Exporta dados principais para Excel"""
-        conn = self.get_connection()
-        
         with pd.ExcelWriter(filename, engine='openpyxl') as writer:
             # Estatísticas gerais
             stats = self.get_estatisticas_gerais()
@@ -163,6 +309,9 @@ class DatabaseUtils:
             # Estoque por período
             self.get_estoque_por_periodo().to_excel(writer, sheet_name='Estoque por Período', index=False)
             
+            # Estoque por família
+            self.get_estoque_por_familia().to_excel(writer, sheet_name='Estoque por Família', index=False)
+            
             # Top materiais
             self.get_top_materiais_valor(50).to_excel(writer, sheet_name='Top 50 Materiais', index=False)
             
@@ -172,7 +321,6 @@ class DatabaseUtils:
             # Materiais baixo estoque
             self.get_materiais_baixo_estoque().to_excel(writer, sheet_name='Baixo Estoque', index=False)
         
-        conn.close()
         return filename
 
 if __name__ == "__main__":
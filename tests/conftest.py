@@ -0,0 +1,35 @@
+"""
+Fixtures dos testes do almoxarifado
+Os arquivos de entrada são gerados no formato do Database.csv pelo gerador dos benchmarks
+"""
+
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+from gerar_database_csv import CABECALHO, gerar_frame
+
+@pytest.fixture
+def database_csv(tmp_path):
+    """Grava um Database.csv (';', latin-1, decimal com vírgula) e retorna o caminho
+    
+    Recebe as linhas do gerador sintético ou um DataFrame já montado, com as
+    colunas de CABECALHO.
+    """
+    def gravar(linhas=0, nome='Database.csv', frame=None, **kwargs):
+        if frame is None:
+            frame = gerar_frame(linhas, **kwargs)
+        caminho = tmp_path / nome
+        with open(caminho, 'w', encoding='latin-1', newline='') as f:
+            frame[CABECALHO].to_csv(f, sep=';', decimal=',', index=False, lineterminator='\r\n')
+        return str(caminho)
+    return gravar
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'almoxarifado.db')
@@ -0,0 +1,75 @@
+"""
+Testes das cargas dos dois processadores (recarga completa, incremental e acréscimo)
+"""
+
+import sqlite3
+
+import pytest
+
+from data_processor import AlmoxarifadoDataProcessor
+from data_processor_optimized import OptimizedAlmoxarifadoProcessor
+from gerar_database_csv import gerar_frame
+
+PROCESSADORES = [AlmoxarifadoDataProcessor, OptimizedAlmoxarifadoProcessor]
+
+def carregar(processador, csv, db_path, **kwargs):
+    """Executa uma carga e retorna o resultado de process_all"""
+    p = processador(csv, db_path=db_path, **kwargs)
+    try:
+        return p.process_all()
+    finally:
+        p.close_connection()
+
+def contar(db_path, sql="SELECT COUNT(*) FROM estoque"):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(sql).fetchone()[0]
+
+@pytest.mark.parametrize('processador', PROCESSADORES)
+def test_recarga_completa_de_arquivo_vazio(processador, database_csv, db_path):
+    assert carregar(processador, database_csv(200), db_path)
+    assert contar(db_path) == 200
+    
+    assert carregar(processador, database_csv(0, nome='vazio.csv'), db_path, recarga_completa=True)
+    assert contar(db_path) == 0
+    assert contar(db_path, "SELECT COUNT(*) FROM cargas_periodos") == 0
+
+def sem_periodo(frame, linhas):
+    """Apaga o período das ``linhas`` (posições) de ``frame``"""
+    frame = frame.copy()
+    frame.iloc[linhas, frame.columns.get_loc('Período')] = None
+    return frame
+
+@pytest.mark.parametrize('processador', PROCESSADORES)
+@pytest.mark.parametrize('modo', [{}, {'incremental': True}, {'recarga_completa': True}])
+def test_registros_sem_periodo_entram_em_todos_os_modos(processador, modo, database_csv, db_path):
+    frame = sem_periodo(gerar_frame(3000), list(range(0, 3000, 61)))
+    assert carregar(processador, database_csv(frame=frame), db_path, **modo)
+    assert contar(db_path) == 3000
+    assert contar(db_path, "SELECT COUNT(*) FROM estoque WHERE periodo_id = 0") == 50
+
+@pytest.mark.parametrize('processador', PROCESSADORES)
+def test_incremental_substitui_a_particao_sem_periodo(processador, database_csv, db_path):
+    frame = sem_periodo(gerar_frame(3000), list(range(0, 3000, 61)))
+    csv = database_csv(frame=frame)
+    assert carregar(processador, csv, db_path, incremental=True)
+    
+    # Mesmo conteúdo: nada é recarregado nem duplicado
+    assert carregar(processador, csv, db_path, incremental=True)
+    assert contar(db_path) == 3000
+    
+    # Uma linha sem período alterada: só essa partição é refeita
+    frame.iloc[0, frame.columns.get_loc('Quantidade')] += 1
+    assert carregar(processador, database_csv(frame=frame, nome='alterado.csv'), db_path, incremental=True)
+    assert contar(db_path) == 3000
+    assert contar(db_path, "SELECT SUM(quantidade) FROM estoque") == frame['Quantidade'].sum()
+    assert contar(db_path, "SELECT COUNT(*) FROM cargas_periodos WHERE periodo_id = 0") == 1
+
+@pytest.mark.parametrize('processador', PROCESSADORES)
+def test_periodo_invalido_fica_sem_ano_e_mes(processador, database_csv, db_path):
+    frame = gerar_frame(300)
+    frame.iloc[:10, frame.columns.get_loc('Período')] = 'xyz/23'
+    assert carregar(processador, database_csv(frame=frame), db_path)
+    
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT ano, mes FROM periodos WHERE periodo = 'xyz/23'").fetchone() == (None, None)
+        assert conn.execute("SELECT ano, mes FROM periodos WHERE periodo = 'jan/23'").fetchone() == (2023, 1)
@@ -0,0 +1,35 @@
+"""
+Testes dos planos de consulta (EXPLAIN QUERY PLAN) sobre um banco sintético
+As regras e as consultas conferidas são as de benchmarks/verificar_planos.py
+"""
+
+import sqlite3
+
+import pytest
+
+from database_utils import DatabaseUtils
+from verificar_planos import banco_de_teste, verificar_consultas, verificar_plano
+
+@pytest.fixture(scope='module')
+def banco(tmp_path_factory):
+    return banco_de_teste(str(tmp_path_factory.mktemp('planos')), 20000)
+
+def test_consultas_leem_o_estoque_e_os_resumos_por_indices_de_cobertura(banco):
+    violacoes = {nome: erros for nome, (_, erros) in verificar_consultas(banco).items() if erros}
+    assert violacoes == {}
+
+def test_todos_os_metodos_do_database_utils_sao_conferidos(banco):
+    nomes = {nome for nome in verificar_consultas(banco) if nome.startswith('DatabaseUtils.')}
+    metodos = {f'DatabaseUtils.{nome}' for nome in dir(DatabaseUtils)
+               if nome.startswith('get_') and nome != 'get_connection'}
+    assert nomes == metodos
+
+@pytest.mark.parametrize('sql', [
+    "SELECT COUNT(*) FROM estoque",
+    "SELECT SUM(valor_total) FROM estoque e WHERE e.material_id = 1",
+    "SELECT * FROM resumo_periodo_material WHERE material_id = 1",
+])
+def test_varredura_ou_acesso_as_linhas_e_violacao(banco, sql):
+    with sqlite3.connect(banco) as conn:
+        _, violacoes = verificar_plano(conn, sql)
+    assert violacoes